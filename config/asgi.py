@@ -5,6 +5,26 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+
+ASGIでの起動
+------------
+棚編集画面から頻繁に呼ばれるJSON API（商品パレット・配置・削除・フェース数変更・一括更新・
+メーカー別ブランド取得）は非同期ビューのため、ASGIサーバーで動かすと応答待ちの間にワーカーを占有しない。
+同期ビュー（画面表示・出力）はDjangoがスレッドで実行する。
+
+同じ棚を開いている他の画面への配置の反映（shelves/services/live.py）も、ASGI では
+Server-Sent Events で即時に届く。WSGI では接続ごとにワーカーを占有してしまうため配信せず、
+画面が数秒ごとに差分を取りに行く（反映がその分遅れる）。どちらの場合も配信はプロセス内で行うため、
+複数ワーカーで動かす場合は同じ棚の画面が同じワーカーにつながるとは限らず、届かない差分は再同期で補う。
+
+    pip install uvicorn
+    uvicorn config.asgi:application --host 0.0.0.0 --port 8000 --workers 4
+
+静的ファイルは WSGI と同様に collectstatic したうえで Webサーバー（nginx 等）から配信する。
+WSGI（gunicorn config.wsgi 等）との比較は次のコマンドで行える。
+
+    python manage.py run_benchmark editor --concurrency 16 --interface wsgi
+    python manage.py run_benchmark editor --concurrency 16 --interface asgi
 """
 
 import os
@@ -0,0 +1,128 @@
+# ==================== config/database.py ====================
+
+import functools
+import logging
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+from django.db.backends.signals import connection_created
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    # WAL では読み取りが書き込みを待たず、書き込みも追記だけで済む（データベースファイルに記録され、以降も有効）
+    'JOURNAL_MODE': 'WAL',
+    # WAL と組み合わせる場合、NORMAL でも電源断以外で壊れることはない（コミットごとの fsync を省く）
+    'SYNCHRONOUS': 'NORMAL',
+    # ロック中に待つ時間（ミリ秒）。この間に解放されなければ "database is locked" になる
+    'BUSY_TIMEOUT': 5000,
+    # ページキャッシュ（負の値は KiB 単位。-65536 で 64MB）
+    'CACHE_SIZE': -65536,
+    # メモリマップで読み込む上限（バイト）
+    'MMAP_SIZE': 256 * 1024 * 1024,
+    'TEMP_STORE': 'MEMORY',
+    # write_transaction がロック待ちで失敗した場合の再試行回数と、初回の待ち時間（秒。試行ごとに倍）
+    'WRITE_RETRIES': 5,
+    'RETRY_BACKOFF': 0.05,
+}
+
+_PRAGMAS = [
+    ('journal_mode', 'JOURNAL_MODE'),
+    ('synchronous', 'SYNCHRONOUS'),
+    ('busy_timeout', 'BUSY_TIMEOUT'),
+    ('cache_size', 'CACHE_SIZE'),
+    ('mmap_size', 'MMAP_SIZE'),
+    ('temp_store', 'TEMP_STORE'),
+]
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SQLITE_TUNING', {})}
+
+
+def pragma_statements(config=None):
+    """接続ごとに実行する PRAGMA 文（値が None の項目は SQLite の既定値のまま）"""
+    config = config or get_config()
+    return [f'PRAGMA {name} = {config[key]}' for name, key in _PRAGMAS if config[key] is not None]
+
+
+def configure_connection(sender, connection, **kwargs):
+    """SQLite の接続作成時に PRAGMA を設定する（SQLite 以外のデータベースでは何もしない）"""
+    if connection.vendor != 'sqlite':
+        return
+    config = get_config()
+    if not config['ENABLED']:
+        return
+    with connection.cursor() as cursor:
+        for statement in pragma_statements(config):
+            cursor.execute(statement)
+
+
+connection_created.connect(configure_connection, dispatch_uid='config.database.configure_connection')
+
+
+def is_locked_error(error):
+    """他の接続の書き込みロックで失敗したか（sqlite3・Django のどちらの OperationalError でも判定できる）"""
+    message = str(error).lower()
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+def retry_delays(config=None):
+    """再試行までの待ち時間（指数バックオフ。同時に失敗した接続が揃って再試行しないよう揺らぎを加える）"""
+    config = config or get_config()
+    for attempt in range(config['WRITE_RETRIES']):
+        yield config['RETRY_BACKOFF'] * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+@contextmanager
+def _immediate(connection):
+    """ブロック内で開始するトランザクションを BEGIN IMMEDIATE にする
+
+    DEFERRED（既定）では読み取り後に書き込もうとした時点で書き込みロックを取りに行き、
+    他の接続と競合するとビジータイムアウトを待たずに失敗する。IMMEDIATE は開始時にロックを取るため、
+    競合した場合も開始時にビジータイムアウトまで待ち、書き込みの途中で失敗することがない。
+    """
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        yield
+        return
+    # transaction_mode は接続時に設定（OPTIONS）から読み直されるため、接続してから切り替える
+    connection.ensure_connection()
+    previous = connection.transaction_mode
+    connection.transaction_mode = 'IMMEDIATE'
+    try:
+        yield
+    finally:
+        connection.transaction_mode = previous
+
+
+def write_transaction(func=None, *, using=None):
+    """書き込み処理を1つのトランザクション（SQLite では BEGIN IMMEDIATE）で実行するデコレーター
+
+    ロック待ちで開始できなかった場合は retry_delays の間隔で再試行する。
+    IMMEDIATE ではロックの競合はトランザクション開始時にしか起きないため、再試行時に書き込みが重複することはない。
+    既にトランザクション内で呼ばれた場合は、外側のトランザクションに含めて1回だけ実行する。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            connection = connections[using or DEFAULT_DB_ALIAS]
+            nested = connection.in_atomic_block
+            delays = retry_delays()
+            while True:
+                try:
+                    with _immediate(connection), transaction.atomic(using=using):
+                        return func(*args, **kwargs)
+                except OperationalError as e:
+                    delay = None if nested or not is_locked_error(e) else next(delays, None)
+                    if delay is None:
+                        raise
+                    logger.info('%s の書き込みがロック待ちで失敗したため %.2f秒後に再試行します', func.__qualname__, delay)
+                    time.sleep(delay)
+        return wrapper
+
+    return decorator(func) if func is not None else decorator
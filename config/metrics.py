@@ -0,0 +1,284 @@
+# ==================== config/metrics.py ====================
+
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    # 計測するリクエストの割合（0〜1）。本番では小さくしても統計の傾向は追える
+    'SAMPLE_RATE': 1.0,
+    # ビュー名（'shelves:shelf_detail' など）ごとの上限 {'ms': 壁時計時間, 'queries': クエリ数, 'sql_ms': SQL時間}
+    'BUDGETS': {},
+    # BUDGETS に無いビューの上限（None の項目は判定しない）
+    'DEFAULT_BUDGET': {'ms': 1000, 'queries': 50, 'sql_ms': None},
+    # 同じ形のクエリがこの回数以上実行されたら N+1 の疑いとして記録する
+    'DUPLICATE_THRESHOLD': 5,
+    # ビューごとに保持する直近の計測数（中央値・95パーセンタイルの計算に使う）
+    'SAMPLES_PER_VIEW': 200,
+    # 上限超過・N+1 の疑いがあったリクエストを保持する件数
+    'RECENT_ISSUES': 50,
+    # Server-Timing ヘッダーを付ける
+    'SERVER_TIMING': True,
+}
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_NUMBER = re.compile(r'\b\d+\b')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REQUEST_METRICS', {})}
+
+
+def fingerprint(sql):
+    """パラメーターの値・IN 句の件数・リテラルを除いたクエリの形"""
+    sql = _IN_LIST.sub('IN (...)', sql)
+    sql = _STRING.sub('?', sql)
+    return _NUMBER.sub('?', sql)
+
+
+class QueryRecorder:
+    """リクエスト中のクエリ数・時間・形を記録する"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def add(self, sql, duration):
+        self.duration += duration
+        self.count += 1
+        self.shapes[fingerprint(sql)] += 1
+
+    def duplicates(self, threshold):
+        """threshold 回以上実行された形 [(形, 回数), ...]（回数の多い順）"""
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+
+# 記録中の QueryRecorder（入れ子にできるようタプルで持つ）。
+# 接続はスレッドごとだが、コンテキスト変数は sync_to_async で実行されるスレッドにも引き継がれるため、
+# 非同期ビューから ORM を呼んだ場合も呼び出し元のリクエストに記録される。
+_recorders = ContextVar('query_recorders', default=())
+
+
+def _record_query(execute, sql, params, many, context):
+    recorders = _recorders.get()
+    if not recorders:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        for recorder in recorders:
+            recorder.add(sql, duration)
+
+
+def _install(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+connection_created.connect(_install)
+
+
+@contextmanager
+def record_queries():
+    """ブロック内（呼び出し元のコンテキスト）で実行されたクエリを記録する"""
+    for connection in connections.all():
+        _install(connection)
+    recorder = QueryRecorder()
+    token = _recorders.set(_recorders.get() + (recorder,))
+    try:
+        yield recorder
+    finally:
+        _recorders.reset(token)
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class ViewMetrics:
+    """ビュー1つ分の集計（件数・合計は累計、分布は直近 SAMPLES_PER_VIEW 件）"""
+
+    def __init__(self, view_name, max_samples):
+        self.view_name = view_name
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.total_queries = 0
+        self.max_queries = 0
+        self.total_sql_ms = 0.0
+        self.over_budget = 0
+        self.duplicate_requests = 0
+        self.samples = deque(maxlen=max_samples)
+
+    def add(self, sample):
+        self.count += 1
+        self.total_ms += sample['ms']
+        self.max_ms = max(self.max_ms, sample['ms'])
+        self.total_queries += sample['queries']
+        self.max_queries = max(self.max_queries, sample['queries'])
+        self.total_sql_ms += sample['sql_ms']
+        self.over_budget += bool(sample['exceeded'])
+        self.duplicate_requests += bool(sample['duplicates'])
+        self.samples.append((sample['ms'], sample['queries']))
+
+    def as_dict(self):
+        durations = [ms for ms, _ in self.samples]
+        return {
+            'view': self.view_name,
+            'count': self.count,
+            'avg_ms': round(self.total_ms / self.count, 1),
+            'p50_ms': round(_percentile(durations, 0.5), 1),
+            'p95_ms': round(_percentile(durations, 0.95), 1),
+            'max_ms': round(self.max_ms, 1),
+            'avg_queries': round(self.total_queries / self.count, 1),
+            'max_queries': self.max_queries,
+            'avg_sql_ms': round(self.total_sql_ms / self.count, 1),
+            'over_budget': self.over_budget,
+            'duplicate_requests': self.duplicate_requests,
+        }
+
+
+class MetricsRegistry:
+    """プロセス内の計測結果（複数プロセスで動かす場合はプロセスごとの値になる）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        config = get_config()
+        with self._lock:
+            self.views = {}
+            self.issues = deque(maxlen=config['RECENT_ISSUES'])
+            self.started_at = timezone.now()
+
+    def record(self, sample):
+        config = get_config()
+        with self._lock:
+            view = self.views.get(sample['view'])
+            if view is None:
+                view = self.views[sample['view']] = ViewMetrics(sample['view'], config['SAMPLES_PER_VIEW'])
+            view.add(sample)
+            if sample['exceeded'] or sample['duplicates']:
+                self.issues.appendleft(sample)
+
+    def snapshot(self):
+        with self._lock:
+            views = [view.as_dict() for view in self.views.values()]
+            issues = list(self.issues)
+        return {
+            'started_at': self.started_at,
+            'views': sorted(views, key=lambda view: view['p95_ms'], reverse=True),
+            'issues': issues,
+        }
+
+
+registry = MetricsRegistry()
+
+
+def _budget_for(config, view_name):
+    return {**config['DEFAULT_BUDGET'], **config['BUDGETS'].get(view_name, {})}
+
+
+def _exceeded(budget, sample):
+    """上限を超えた項目 {'ms': (実績, 上限), ...}"""
+    return {
+        key: (sample[key], limit)
+        for key, limit in budget.items()
+        if limit is not None and sample[key] > limit
+    }
+
+
+class RequestMetricsMiddleware:
+    """ビューごとの処理時間・SQL件数・SQL時間・重複クエリを計測する
+
+    SAMPLE_RATE の割合のリクエストだけを計測し、それ以外は乱数1回分の負荷で素通りする。
+    計測したリクエストが上限を超えた場合や、同じ形のクエリが繰り返された場合は警告ログを出す。
+    WSGI・ASGI のどちらでも動作する（ASGI では非同期のまま処理し、スレッドを占有しない）。
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def _sampled(self, config):
+        return config['ENABLED'] and random.random() < config['SAMPLE_RATE']
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        config = get_config()
+        if not self._sampled(config):
+            return self.get_response(request)
+        started = time.perf_counter()
+        with record_queries() as recorder:
+            response = self.get_response(request)
+        return self._finish(config, request, response, recorder, started)
+
+    async def __acall__(self, request):
+        config = get_config()
+        if not self._sampled(config):
+            return await self.get_response(request)
+        started = time.perf_counter()
+        with record_queries() as recorder:
+            response = await self.get_response(request)
+        return self._finish(config, request, response, recorder, started)
+
+    def _finish(self, config, request, response, recorder, started):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        match = getattr(request, 'resolver_match', None)
+        view_name = (match.view_name if match else None) or f'{request.method} (未解決)'
+        sample = {
+            'view': view_name,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'ms': round(elapsed_ms, 1),
+            'queries': recorder.count,
+            'sql_ms': round(recorder.duration * 1000, 1),
+            'duplicates': recorder.duplicates(config['DUPLICATE_THRESHOLD']),
+            'at': timezone.now(),
+        }
+        sample['exceeded'] = _exceeded(_budget_for(config, view_name), sample)
+        registry.record(sample)
+        self._log(sample)
+
+        if config['SERVER_TIMING']:
+            response['Server-Timing'] = (
+                f'app;dur={sample["ms"]}, db;dur={sample["sql_ms"]};desc="{sample["queries"]} queries"'
+            )
+        return response
+
+    def _log(self, sample):
+        if sample['exceeded']:
+            logger.warning(
+                '%s %s が上限を超えました: %s',
+                sample['method'], sample['view'],
+                ', '.join(f'{key}={value}(上限 {limit})' for key, (value, limit) in sample['exceeded'].items()),
+            )
+        for shape, count in sample['duplicates']:
+            logger.warning('%s で同じ形のクエリが %d 回実行されました（N+1 の疑い）: %s', sample['view'], count, shape[:300])
@@ -0,0 +1,185 @@
+# ==================== config/pagination.py ====================
+
+import base64
+import hashlib
+import json
+from datetime import datetime
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import DateTimeField, F, FileField, Func, Value
+from django.db.models.lookups import GreaterThan, LessThan
+from django.http import Http404, JsonResponse
+from django.utils.dateparse import parse_datetime
+
+
+# 件数の概算（COUNT(*) の結果）を使い回す秒数
+COUNT_CACHE_SECONDS = 300
+
+
+class InvalidCursor(Exception):
+    """解釈できないカーソル"""
+
+
+class RowValue(Func):
+    """行値 (a, b, ...)。(created_at, id) < (%s, %s) のように比較すると、複合インデックスの範囲検索になる"""
+    template = '(%(expressions)s)'
+    output_field = DateTimeField()
+
+
+def _key_fields(queryset):
+    """並び順のキー [(フィールド名, 降順か)]（一意にするため末尾に id を加える）"""
+    keys = []
+    for ordering in queryset.query.order_by:
+        name = ordering.lstrip('-')
+        keys.append(('id' if name == 'pk' else name, ordering.startswith('-')))
+    if not any(name == 'id' for name, _ in keys):
+        keys.append(('id', keys[0][1] if keys else True))
+    if len({descending for _, descending in keys}) > 1:
+        raise ValueError('キーセットページングでは並び順の向きを揃えてください')
+    return keys
+
+
+def encode_cursor(values, backwards=False):
+    # 日時はマイクロ秒まで残す（DjangoJSONEncoder はミリ秒に丸めるため使わない）
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    payload = json.dumps([values, backwards], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, keys, model):
+    """カーソルを (キーの値のリスト, 前のページか) に戻す"""
+    try:
+        values, backwards = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError
+        decoded = []
+        for (name, _), value in zip(keys, values):
+            field = model._meta.get_field(name) if name in {f.name for f in model._meta.concrete_fields} else None
+            if isinstance(field, DateTimeField):
+                value = parse_datetime(value)
+                if value is None:
+                    raise ValueError
+            elif field is not None:
+                value = field.to_python(value)
+            decoded.append(value)
+    except (TypeError, ValueError, ValidationError) as e:
+        raise InvalidCursor(str(e))
+    return decoded, bool(backwards)
+
+
+def estimate_count(queryset):
+    """件数の概算（同じ条件の COUNT(*) を COUNT_CACHE_SECONDS 秒使い回す）"""
+    sql, params = queryset.order_by().query.sql_with_params()
+    key = 'pagination:count:' + hashlib.sha256(repr((queryset.db, sql, params)).encode()).hexdigest()
+    return cache.get_or_set(key, queryset.count, COUNT_CACHE_SECONDS)
+
+
+class CursorPage:
+    """キーセットページングの1ページ分"""
+
+    def __init__(self, object_list, has_next, has_previous, next_cursor, previous_cursor, estimated_count=None):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.estimated_count = estimated_count
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+def paginate(queryset, cursor=None, page_size=20, with_count=False):
+    """クエリセットの並び順（末尾に id を補う）をキーにしたキーセットページング
+
+    OFFSET を使わず「前のページの最後の行より後」を行値の比較で取り出すため、
+    並び順に合う複合インデックスがあれば何ページ目でも同じ時間で取得できる。
+    cursor が不正な場合は InvalidCursor を送出する。
+    """
+    keys = _key_fields(queryset)
+    estimated_count = estimate_count(queryset) if with_count else None
+    descending = keys[0][1]
+    names = [name for name, _ in keys]
+    backwards = False
+    if cursor:
+        values, backwards = decode_cursor(cursor, keys, queryset.model)
+        # 次のページは並び順で後ろ、前のページは並び順で前の行を、逆順に取り出す
+        lookup = LessThan if descending != backwards else GreaterThan
+        queryset = queryset.filter(lookup(
+            RowValue(*[F(name) for name in names]),
+            RowValue(*[Value(value) for value in values]),
+        ))
+    if backwards:
+        queryset = queryset.order_by(*[name if descending else f'-{name}' for name in names])
+    else:
+        queryset = queryset.order_by(*[f'-{name}' if descending else name for name in names])
+
+    rows = list(queryset[:page_size + 1])
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+
+    has_next = more if not backwards else True
+    has_previous = bool(cursor) if not backwards else more
+    return CursorPage(
+        rows,
+        has_next=has_next and bool(rows),
+        has_previous=has_previous and bool(rows),
+        next_cursor=encode_cursor([getattr(rows[-1], name) for name in names]) if has_next and rows else None,
+        previous_cursor=encode_cursor([getattr(rows[0], name) for name in names], backwards=True)
+        if has_previous and rows else None,
+        estimated_count=estimated_count,
+    )
+
+
+class CursorPaginationMixin:
+    """ListView をキーセットページング（?cursor=）にする
+
+    並び順は get_queryset の order_by（末尾に id を補う）。?format=json で serialize_object による JSON を返す。
+    serialize_object は既定では json_fields（未指定ならファイル以外の全項目。外部キーは *_id）の値を返し、
+    関連先の名称などを含める場合はビューで上書きする。
+    件数は概算（COUNT(*) のキャッシュ）で、?count=0 で省略できる。
+    """
+    paginate_by = 20
+    json_fields = None
+
+    def paginate_queryset(self, queryset, page_size):
+        try:
+            page = paginate(
+                queryset, self.request.GET.get('cursor'), page_size,
+                with_count=self.request.GET.get('count') != '0',
+            )
+        except InvalidCursor:
+            raise Http404('無効なページです')
+        return None, page, page.object_list, page.has_other_pages()
+
+    def get_json_fields(self, model):
+        if self.json_fields is not None:
+            return [model._meta.get_field(name) for name in self.json_fields]
+        return [field for field in model._meta.concrete_fields if not isinstance(field, FileField)]
+
+    def serialize_object(self, obj):
+        """1件分の JSON（日時・Decimal は JsonResponse のエンコーダーが文字列にする）"""
+        return {field.attname: field.value_from_object(obj) for field in self.get_json_fields(type(obj))}
+
+    def render_to_response(self, context, **response_kwargs):
+        if self.request.GET.get('format') != 'json':
+            return super().render_to_response(context, **response_kwargs)
+        page = context['page_obj']
+        return JsonResponse({
+            'success': True,
+            'results': [self.serialize_object(obj) for obj in page],
+            'has_next': page.has_next,
+            'has_previous': page.has_previous,
+            'next_cursor': page.next_cursor,
+            'previous_cursor': page.previous_cursor,
+            'estimated_count': page.estimated_count,
+        })
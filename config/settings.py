@@ -29,6 +29,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'config.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -66,6 +67,14 @@ DATABASES = {
     }
 }
 
+# SQLite の PRAGMA と書き込みの再試行（config/database.py。省略した項目は DEFAULTS の値）
+# 効果は manage.py run_sqlite_benchmark で確認できる
+SQLITE_TUNING = {
+    'JOURNAL_MODE': 'WAL',
+    'SYNCHRONOUS': 'NORMAL',
+    'BUSY_TIMEOUT': 5000,
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -99,6 +108,31 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# 生成済みPDFのキャッシュ保存先と、最後に使われてから残す期間（秒）・合計サイズの上限（バイト）。
+# 期限切れ・上限超過分は manage.py run_export_worker が定期的に削除する
+PDF_CACHE_DIR = BASE_DIR / 'cache' / 'pdf'
+PDF_CACHE_RETENTION = 7 * 24 * 60 * 60
+PDF_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# 出力ジョブ（manage.py run_export_worker が処理する）の結果の保存先・保存期間・タイムアウト（秒）
+EXPORT_JOB_DIR = BASE_DIR / 'cache' / 'exports'
+EXPORT_JOB_RETENTION = 24 * 60 * 60
+EXPORT_JOB_TIMEOUT = 10 * 60
+EXPORT_JOB_MAX_ATTEMPTS = 3
+
+# リクエスト計測（config/metrics.py）。結果は /metrics/ で確認できる（スタッフのみ）
+REQUEST_METRICS = {
+    'SAMPLE_RATE': 1.0 if DEBUG else 0.05,
+    'BUDGETS': {
+        'shelves:shelf_detail': {'ms': 500, 'queries': 15},
+        'shelves:floor_detail': {'ms': 800, 'queries': 10},
+        'proposals:proposal_detail': {'ms': 500, 'queries': 15},
+        'proposals:export_pdf': {'ms': 5000, 'queries': 20},
+        'products:product_list': {'ms': 500, 'queries': 15},
+        'index': {'ms': 300, 'queries': 10},
+    },
+}
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -7,6 +7,7 @@ from . import views
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', views.index, name='index'),
+    path('metrics/', views.request_metrics, name='request_metrics'),
     path('products/', include('products.urls')),
     path('shelves/', include('shelves.urls')),
     path('proposals/', include('proposals.urls')),
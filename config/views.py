@@ -1,16 +1,35 @@
 # ==================== プロジェクトのメインviews.py（tanaoroshi_project/views.py） ====================
 
-from django.shortcuts import render
-from products.models import Product
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+from django.shortcuts import render, redirect
+from proposals.services import dashboard
+
+from . import metrics
 
 
 def index(request):
-    """ホーム画面"""
-    context = {
-        'total_products': Product.objects.filter(is_active=True).count(),
-        'own_products': Product.objects.filter(is_active=True, is_own_product=True).count(),
-        'competitor_products': Product.objects.filter(is_active=True, is_own_product=False).count(),
-        'recent_products': Product.objects.filter(is_active=True).select_related('maker').order_by('-created_at')[:5],
-    }
+    """ホーム画面（集計値は短時間キャッシュし、書き込み時に破棄する）"""
+    context = dashboard.get_summary()
     return render(request, 'index.html', context)
 
+
+@staff_member_required
+def request_metrics(request):
+    """リクエスト計測の結果（?format=json でJSON、POST で集計をリセット）"""
+    if request.method == 'POST':
+        metrics.registry.reset()
+        return redirect('request_metrics')
+    
+    context = metrics.registry.snapshot()
+    config = metrics.get_config()
+    if request.GET.get('format') == 'json':
+        return JsonResponse(context)
+    
+    context.update({
+        'sample_rate': config['SAMPLE_RATE'],
+        'duplicate_threshold': config['DUPLICATE_THRESHOLD'],
+        'budgets': sorted(config['BUDGETS'].items()),
+        'default_budget': config['DEFAULT_BUDGET'],
+    })
+    return render(request, 'request_metrics.html', context)
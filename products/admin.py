@@ -21,10 +21,10 @@ class BrandAdmin(admin.ModelAdmin):
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ('name', 'parent', 'created_at', 'created_by')
-    list_filter = ('parent', 'created_at')
-    search_fields = ('name',)
-    readonly_fields = ('created_at',)
+    list_display = ('full_name', 'depth', 'created_at', 'created_by')
+    list_filter = ('depth', 'created_at')
+    search_fields = ('name', 'full_name')
+    readonly_fields = ('path', 'full_name', 'created_at')
 
 
 @admin.register(Product)
@@ -1,8 +1,75 @@
 # products/forms.py
 
+import copy
+
 from django import forms
 from django.core.exceptions import ValidationError
+from django.forms.models import ModelChoiceIterator
 from .models import Product, Maker, Brand, Category
+from .services import masters
+
+
+class MasterChoiceIterator(ModelChoiceIterator):
+    """キャッシュ済みのマスタ一覧から選択肢を作る（DBを参照しない）"""
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for obj in self.field.master_objects:
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(self.field.master_objects) + (1 if self.field.empty_label is not None else 0)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(self.field.master_objects)
+
+
+class MasterChoiceField(forms.ModelChoiceField):
+    """マスタ（メーカー・ブランド・カテゴリ・得意先）用の選択項目
+
+    選択肢の表示と入力値の検証をマスタキャッシュで行う。
+    restrict_to_group() でグループ（例: メーカー）内の選択肢に絞り込める。
+    """
+    iterator = MasterChoiceIterator
+
+    def __init__(self, queryset, **kwargs):
+        super().__init__(queryset, **kwargs)
+        self.kind = masters.kind_for_model(queryset.model)
+        self.restricted = False
+        self.group_key = None
+
+    def restrict_to_group(self, key):
+        """グループ内の選択肢に絞り込む（key が None なら選択肢なし）"""
+        self.restricted = True
+        self.group_key = key
+        self.widget.choices = self.choices
+
+    @property
+    def master_objects(self):
+        if not self.restricted:
+            return masters.objects(self.kind)
+        if self.group_key is None:
+            return []
+        return masters.group(self.kind, self.group_key)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        if isinstance(value, self.queryset.model):
+            value = value.pk
+        try:
+            obj = masters.get(self.kind, int(value))
+        except (TypeError, ValueError):
+            obj = None
+        if obj is None or (self.restricted and obj not in self.master_objects):
+            raise ValidationError(
+                self.error_messages['invalid_choice'],
+                code='invalid_choice',
+                params={'value': value},
+            )
+        # キャッシュ上のオブジェクトを変更されないよう複製して返す
+        return copy.copy(obj)
 
 
 class ProductForm(forms.ModelForm):
@@ -28,20 +95,26 @@ class ProductForm(forms.ModelForm):
             'image': forms.ClearableFileInput(attrs={'class': 'form-control'}),
             'is_own_product': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
         }
+        field_classes = {
+            'maker': MasterChoiceField,
+            'brand': MasterChoiceField,
+            'category': MasterChoiceField,
+        }
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # ブランドのクエリセットを空にしておく（JavaScriptで動的に更新）
-        self.fields['brand'].queryset = Brand.objects.none()
+        # ブランドの選択肢は選択中のメーカーのものに絞る（JavaScriptで動的に更新）
+        maker_id = None
         
         if 'maker' in self.data:
             try:
                 maker_id = int(self.data.get('maker'))
-                self.fields['brand'].queryset = Brand.objects.filter(maker_id=maker_id).order_by('name')
             except (ValueError, TypeError):
                 pass
-        elif self.instance.pk and self.instance.maker:
-            self.fields['brand'].queryset = self.instance.maker.brand_set.order_by('name')
+        elif self.instance.pk and self.instance.maker_id:
+            maker_id = self.instance.maker_id
+        
+        self.fields['brand'].restrict_to_group(maker_id)
 
 
 class MakerForm(forms.ModelForm):
@@ -65,6 +138,7 @@ class BrandForm(forms.ModelForm):
             'maker': forms.Select(attrs={'class': 'form-select'}),
             'name': forms.TextInput(attrs={'class': 'form-control'})
         }
+        field_classes = {'maker': MasterChoiceField}
 
 
 class CategoryForm(forms.ModelForm):
@@ -77,6 +151,7 @@ class CategoryForm(forms.ModelForm):
             'parent': forms.Select(attrs={'class': 'form-select'}),
             'name': forms.TextInput(attrs={'class': 'form-control'})
         }
+        field_classes = {'parent': MasterChoiceField}
 
 
 class ProductSearchForm(forms.Form):
@@ -89,13 +164,13 @@ class ProductSearchForm(forms.Form):
             'placeholder': '商品名、JANコード、メーカー名'
         })
     )
-    maker = forms.ModelChoiceField(
+    maker = MasterChoiceField(
         queryset=Maker.objects.all(),
         required=False,
         empty_label='すべて',
         widget=forms.Select(attrs={'class': 'form-select'})
     )
-    category = forms.ModelChoiceField(
+    category = MasterChoiceField(
         queryset=Category.objects.all(),
         required=False,
         empty_label='すべて',
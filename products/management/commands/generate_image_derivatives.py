@@ -0,0 +1,34 @@
+# products/management/commands/generate_image_derivatives.py
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from products.models import Product
+from products.services.images import generate_derivatives
+
+
+class Command(BaseCommand):
+    help = '商品画像の派生画像（セル用・アイコン・印刷用）を生成します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='生成済みの商品も再生成する')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['all']:
+            products = products.filter(Q(image_thumb='') | Q(image_thumb__isnull=True))
+        
+        generated = 0
+        for product in products.iterator(chunk_size=200):
+            try:
+                generate_derivatives(product)
+            except (OSError, ValueError) as e:
+                self.stdout.write(self.style.WARNING(f'商品 "{product.product_name}" の画像を処理できません: {e}'))
+                continue
+            Product.objects.filter(pk=product.pk).update(
+                image_thumb=product.image_thumb.name,
+                image_icon=product.image_icon.name,
+                image_print=product.image_print.name,
+            )
+            generated += 1
+        
+        self.stdout.write(self.style.SUCCESS(f'{generated} 件の商品画像を処理しました'))
@@ -0,0 +1,318 @@
+# products/management/commands/import_products.py
+
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from products.models import Maker, Brand, Category, Product
+from products.services import masters
+from products.signals import products_bulk_changed
+
+
+# CSVの列名（日本語見出しと英語見出しの両方を受け付ける）
+COLUMN_ALIASES = {
+    'product_name': ('product_name', '商品名'),
+    'product_code': ('product_code', 'JANコード', 'jan'),
+    'maker': ('maker', 'メーカー'),
+    'brand': ('brand', 'ブランド'),
+    'category': ('category', 'カテゴリ'),
+    'size': ('size', '容量・規格'),
+    'price': ('price', '価格'),
+    'width': ('width', '幅'),
+    'height': ('height', '高さ'),
+    'depth': ('depth', '奥行'),
+    'is_own_product': ('is_own_product', '自社商品', '区分'),
+}
+
+REQUIRED_COLUMNS = ('product_name', 'product_code', 'maker', 'category')
+
+# CSVから上書きする項目（attname で比較し、変更のない行は更新しない）
+IMPORT_FIELDS = [
+    'product_name', 'maker_id', 'brand_id', 'category_id', 'size', 'price',
+    'width', 'height', 'depth', 'is_own_product', 'is_active',
+]
+
+UPDATE_FIELDS = IMPORT_FIELDS + ['updated_at']
+
+# bulk_update は列ごとに CASE WHEN 式を組み立てるため行数に対して重く、
+# 既存行の更新はプレースホルダ付きUPDATEの executemany で発行する
+UPDATE_BATCH_SIZE = 1000
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', '自社', '○', 'o'}
+
+
+class RowError(ValueError):
+    pass
+
+
+def is_valid_jan(code):
+    """JANコード（EAN-13 / EAN-8）のチェックデジットを検証"""
+    if not code.isdigit() or len(code) not in (8, 13):
+        return False
+    digits = [int(ch) for ch in code]
+    body, check_digit = digits[:-1], digits[-1]
+    # 末尾（チェックデジットの直前）から奇数桁に3を掛ける
+    total = sum(d * (3 if i % 2 == 0 else 1) for i, d in enumerate(reversed(body)))
+    return (10 - total % 10) % 10 == check_digit
+
+
+def _same(current, new):
+    """DB値とCSV値の比較（DecimalField と float の差を吸収）"""
+    if current is None or new is None:
+        return current is new
+    if isinstance(new, float):
+        return float(current) == new
+    return current == new
+
+
+class Command(BaseCommand):
+    help = 'CSVから商品を一括登録・更新します（JANコードで照合。カテゴリは「飲料 > 炭酸飲料」のように上位から指定）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', help='取り込むCSVファイル')
+        parser.add_argument('--batch-size', type=int, default=2000, help='1トランザクションで処理する行数')
+        parser.add_argument('--encoding', default='utf-8-sig', help='CSVの文字コード（例: cp932）')
+        parser.add_argument('--skip-jan-check', action='store_true', help='JANコードのチェックデジット検証を行わない')
+        parser.add_argument('--max-errors', type=int, default=50, help='表示するエラー行数の上限')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.check_jan = not options['skip_jan_check']
+        self.errors = []
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        
+        # マスタは名前→インスタンスのキャッシュで解決し、行ごとの get_or_create を避ける
+        self.makers = {maker.name: maker for maker in Maker.objects.all()}
+        # カテゴリは表示名（"飲料 > 炭酸飲料"）で照合する（同名が複数あれば先に登録されたもの）
+        self.categories = {category.full_name: category for category in Category.objects.order_by('-pk')}
+        self.brands = {(brand.maker_id, brand.name): brand for brand in Brand.objects.all()}
+        
+        started = time.monotonic()
+        rows = 0
+        try:
+            with open(options['csv_file'], newline='', encoding=options['encoding']) as csv_file:
+                reader = csv.DictReader(csv_file)
+                columns = self._resolve_columns(reader.fieldnames or [])
+                
+                batch = []
+                for line_number, record in enumerate(reader, start=2):
+                    rows += 1
+                    batch.append((line_number, record))
+                    if len(batch) >= self.batch_size:
+                        self._import_batch(batch, columns)
+                        batch = []
+                if batch:
+                    self._import_batch(batch, columns)
+        except FileNotFoundError:
+            raise CommandError(f'ファイルが見つかりません: {options["csv_file"]}')
+        except UnicodeDecodeError as e:
+            raise CommandError(f'文字コードを確認してください（--encoding）: {e}')
+        
+        elapsed = time.monotonic() - started
+        for line_number, message in self.errors[:options['max_errors']]:
+            self.stdout.write(self.style.WARNING(f'{line_number}行目: {message}'))
+        if len(self.errors) > options['max_errors']:
+            self.stdout.write(self.style.WARNING(f'ほか {len(self.errors) - options["max_errors"]} 件のエラー'))
+        
+        rate = rows / elapsed if elapsed > 0 else rows
+        self.stdout.write(self.style.SUCCESS(
+            f'{rows} 行を処理しました（新規 {self.created} 件 / 更新 {self.updated} 件 / 変更なし {self.unchanged} 件 / エラー {len(self.errors)} 件）'
+            f' {elapsed:.1f}秒 {rate:,.0f} 行/秒'
+        ))
+
+    def _resolve_columns(self, fieldnames):
+        stripped = {name.strip(): name for name in fieldnames if name}
+        columns = {}
+        for key, aliases in COLUMN_ALIASES.items():
+            for alias in aliases:
+                if alias in stripped:
+                    columns[key] = stripped[alias]
+                    break
+        missing = [key for key in REQUIRED_COLUMNS if key not in columns]
+        if missing:
+            raise CommandError(f'必須列がありません: {", ".join(missing)}')
+        return columns
+
+    def _value(self, record, columns, key):
+        column = columns.get(key)
+        return (record.get(column) or '').strip() if column else ''
+
+    def _number(self, record, columns, key):
+        value = self._value(record, columns, key)
+        if not value:
+            return None
+        try:
+            return float(value.replace(',', ''))
+        except ValueError:
+            raise RowError(f'{key} が数値ではありません: {value}')
+
+    def _category_full_name(self, value):
+        """カテゴリ列（"飲料 > 炭酸飲料" のように上位から区切った表記）を表示名の形式に揃える"""
+        names = [name.strip()[:100] for name in value.split(Category.LABEL_SEPARATOR.strip())]
+        if not all(names):
+            raise RowError(f'カテゴリの指定が不正です: {value}')
+        return Category.LABEL_SEPARATOR.join(names)
+
+    def _parse(self, record, columns):
+        data = {key: self._value(record, columns, key) for key in REQUIRED_COLUMNS}
+        for key in REQUIRED_COLUMNS:
+            if not data[key]:
+                raise RowError(f'{key} が空です')
+        if len(data['product_code']) > 50:
+            raise RowError('JANコードが長すぎます')
+        if self.check_jan and not is_valid_jan(data['product_code']):
+            raise RowError(f'JANコードが不正です: {data["product_code"]}')
+        
+        price = self._number(record, columns, 'price')
+        return {
+            'product_name': data['product_name'][:200],
+            'product_code': data['product_code'],
+            'maker_name': data['maker'][:100],
+            'brand_name': self._value(record, columns, 'brand')[:100],
+            'category_full_name': self._category_full_name(data['category']),
+            'size': self._value(record, columns, 'size')[:100],
+            'price': round(price, 2) if price is not None else None,
+            'width': self._number(record, columns, 'width'),
+            'height': self._number(record, columns, 'height'),
+            'depth': self._number(record, columns, 'depth'),
+            'is_own_product': self._value(record, columns, 'is_own_product').lower() in TRUE_VALUES,
+        }
+
+    def _resolve_masters(self, parsed_rows):
+        """バッチ内で未登録のマスタをまとめて作成"""
+        new_makers = {row['maker_name'] for row in parsed_rows} - self.makers.keys()
+        if new_makers:
+            Maker.objects.bulk_create([Maker(name=name) for name in new_makers], ignore_conflicts=True)
+            self.makers.update((m.name, m) for m in Maker.objects.filter(name__in=new_makers))
+            masters.invalidate('maker')
+        
+        new_categories = {row['category_full_name'] for row in parsed_rows} - self.categories.keys()
+        if new_categories:
+            self._create_categories(new_categories)
+            masters.invalidate('category')
+        
+        new_brands = {
+            (self.makers[row['maker_name']].id, row['brand_name'])
+            for row in parsed_rows if row['brand_name']
+        } - self.brands.keys()
+        if new_brands:
+            Brand.objects.bulk_create(
+                [Brand(maker_id=maker_id, name=name) for maker_id, name in new_brands], ignore_conflicts=True
+            )
+            maker_ids = {maker_id for maker_id, _ in new_brands}
+            self.brands.update(
+                ((b.maker_id, b.name), b)
+                for b in Brand.objects.filter(maker_id__in=maker_ids, name__in={name for _, name in new_brands})
+            )
+            masters.invalidate('brand')
+
+    def _create_categories(self, full_names):
+        """未登録のカテゴリを上位の階層から順に作成（既存のカテゴリがあればその配下に追加する）"""
+        separator = Category.LABEL_SEPARATOR
+        missing = {}
+        for full_name in full_names:
+            names = full_name.split(separator)
+            for depth in range(1, len(names) + 1):
+                prefix = separator.join(names[:depth])
+                if prefix not in self.categories:
+                    missing.setdefault(depth, set()).add(prefix)
+        
+        for depth in sorted(missing):
+            categories = []
+            for full_name in sorted(missing[depth]):
+                parent_name, _, name = full_name.rpartition(separator)
+                categories.append(Category(name=name, parent=self.categories.get(parent_name)))
+            Category.objects.bulk_create(categories)
+            # bulk_create は save() を経由しないため、作成したカテゴリの経路・表示名だけを親から設定する
+            for category in categories:
+                category._derive_tree_fields(category.parent)
+            Category.objects.bulk_update(categories, ['path', 'depth', 'full_name'])
+            self.categories.update((category.full_name, category) for category in categories)
+
+    def _update_products(self, products):
+        """既存商品を1本のUPDATE文の繰り返し実行で更新"""
+        if not products:
+            return
+        opts = Product._meta
+        fields = [opts.get_field(name) for name in UPDATE_FIELDS]
+        qn = connection.ops.quote_name
+        sql = 'UPDATE {} SET {} WHERE {} = %s'.format(
+            qn(opts.db_table),
+            ', '.join(f'{qn(field.column)} = %s' for field in fields),
+            qn(opts.pk.column),
+        )
+        with connection.cursor() as cursor:
+            for start in range(0, len(products), UPDATE_BATCH_SIZE):
+                cursor.executemany(sql, [
+                    [field.get_db_prep_save(getattr(product, field.attname), connection) for field in fields]
+                    + [product.pk]
+                    for product in products[start:start + UPDATE_BATCH_SIZE]
+                ])
+
+    @transaction.atomic
+    def _import_batch(self, batch, columns):
+        parsed = {}
+        for line_number, record in batch:
+            try:
+                row = self._parse(record, columns)
+            except RowError as e:
+                self.errors.append((line_number, str(e)))
+                continue
+            # 同一バッチ内で同じJANコードが重複した場合は後勝ち
+            parsed[row['product_code']] = row
+        if not parsed:
+            return
+        
+        self._resolve_masters(parsed.values())
+        existing = Product.objects.in_bulk(list(parsed), field_name='product_code')
+        
+        now = timezone.now()
+        to_create = []
+        to_update = []
+        ownership_changed_ids = []
+        for code, row in parsed.items():
+            maker = self.makers[row['maker_name']]
+            brand = self.brands.get((maker.id, row['brand_name'])) if row['brand_name'] else None
+            values = {
+                'product_name': row['product_name'],
+                'maker_id': maker.id,
+                'brand_id': brand.id if brand else None,
+                'category_id': self.categories[row['category_full_name']].id,
+                'size': row['size'],
+                'price': row['price'],
+                'width': row['width'],
+                'height': row['height'],
+                'depth': row['depth'],
+                'is_own_product': row['is_own_product'],
+                'is_active': True,
+            }
+            product = existing.get(code)
+            if product is None:
+                to_create.append(Product(product_code=code, updated_at=now, **values))
+                continue
+            if all(_same(getattr(product, field), values[field]) for field in IMPORT_FIELDS):
+                self.unchanged += 1
+                continue
+            if product.is_own_product != row['is_own_product']:
+                ownership_changed_ids.append(product.pk)
+            for field, value in values.items():
+                setattr(product, field, value)
+            product.updated_at = now
+            to_update.append(product)
+        
+        Product.objects.bulk_create(to_create, batch_size=500)
+        self._update_products(to_update)
+        self.created += len(to_create)
+        self.updated += len(to_update)
+        
+        if not to_create and not to_update:
+            return
+        products_bulk_changed.send(
+            sender=Product,
+            product_ids=[product.pk for product in to_create + to_update],
+            ownership_changed_ids=ownership_changed_ids,
+        )
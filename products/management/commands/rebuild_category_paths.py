@@ -0,0 +1,12 @@
+# products/management/commands/rebuild_category_paths.py
+
+from django.core.management.base import BaseCommand
+from products.models import Category
+
+
+class Command(BaseCommand):
+    help = 'カテゴリの経路・表示名を親子関係から再計算します'
+
+    def handle(self, *args, **options):
+        count = Category.rebuild_paths()
+        self.stdout.write(self.style.SUCCESS(f'{count} 件のカテゴリを更新しました'))
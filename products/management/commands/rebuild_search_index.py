@@ -0,0 +1,26 @@
+# products/management/commands/rebuild_search_index.py
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from products.services import search
+
+
+class Command(BaseCommand):
+    help = '検索インデックス（商品・棚・提案）を再作成します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kinds', nargs='*', help='対象の種別（product / shelf / proposal、省略時はすべて）')
+
+    def handle(self, *args, **options):
+        kinds = options['kinds'] or search.registered_kinds()
+        unknown = set(kinds) - set(search.registered_kinds())
+        if unknown:
+            raise CommandError(f'不明な種別です: {", ".join(sorted(unknown))}')
+        
+        for kind in kinds:
+            started = time.monotonic()
+            count = search.rebuild_index(kind)
+            self.stdout.write(self.style.SUCCESS(
+                f'{kind}: {count} 件を索引しました（{time.monotonic() - started:.1f}秒）'
+            ))
@@ -0,0 +1,22 @@
+# products/management/commands/warm_master_cache.py
+
+from django.core.management.base import BaseCommand, CommandError
+from products.services import masters
+
+
+class Command(BaseCommand):
+    help = 'マスタ一覧（メーカー・ブランド・カテゴリ・得意先）のキャッシュを作り直します（デプロイ後に実行）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kinds', nargs='*', help='対象の種別（maker / brand / category / customer、省略時はすべて）')
+
+    def handle(self, *args, **options):
+        kinds = options['kinds'] or masters.registered_kinds()
+        unknown = set(kinds) - set(masters.registered_kinds())
+        if unknown:
+            raise CommandError(f'不明な種別です: {", ".join(sorted(unknown))}')
+        
+        # 旧バージョンのコードで作られたキャッシュを使わないよう、世代を更新してから読み込む
+        masters.invalidate(*kinds)
+        for kind, count in masters.warm(kinds).items():
+            self.stdout.write(self.style.SUCCESS(f'{kind}: {count} 件をキャッシュしました'))
@@ -1,5 +1,13 @@
-from django.db import models
+import logging
+
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+
+from .services.images import generate_derivatives
+
+
+logger = logging.getLogger(__name__)
 
 
 class Maker(models.Model):
@@ -36,20 +44,107 @@ class Brand(models.Model):
 
 class Category(models.Model):
     """カテゴリマスタ"""
+    PATH_SEPARATOR = '/'
+    LABEL_SEPARATOR = ' > '
+    
     name = models.CharField('カテゴリ名', max_length=100)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, verbose_name='親カテゴリ')
+    # 経路（ルートからのID列 "1/5/"）と表示名は保存時に親から算出する。
+    # 配下のカテゴリは path の前方一致で1クエリで取得できる。
+    path = models.CharField('経路', max_length=255, blank=True, db_index=True, editable=False)
+    depth = models.PositiveSmallIntegerField('階層', default=0, editable=False)
+    full_name = models.CharField('表示名', max_length=500, blank=True, editable=False)
     created_at = models.DateTimeField('作成日時', auto_now_add=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='作成者')
     
     class Meta:
         verbose_name = 'カテゴリ'
         verbose_name_plural = 'カテゴリ'
-        ordering = ['name']
+        ordering = ['full_name', 'name']
     
     def __str__(self):
-        if self.parent:
-            return f"{self.parent.name} > {self.name}"
-        return self.name
+        return self.full_name or self.name
+    
+    def clean(self):
+        super().clean()
+        if self.pk and self.parent_id:
+            if self.parent_id == self.pk or (self.path and self.parent.path.startswith(self.path)):
+                raise ValidationError({'parent': '自身または配下のカテゴリは親に指定できません'})
+    
+    def _derive_tree_fields(self, parent):
+        """親の経路・表示名から自身の経路・階層・表示名を設定"""
+        if parent is None:
+            self.path = f'{self.pk}{self.PATH_SEPARATOR}'
+            self.depth = 0
+            self.full_name = self.name
+        else:
+            self.path = f'{parent.path}{self.pk}{self.PATH_SEPARATOR}'
+            self.depth = parent.depth + 1
+            self.full_name = f'{parent.full_name}{self.LABEL_SEPARATOR}{self.name}'
+    
+    def save(self, *args, **kwargs):
+        if self.pk is None:
+            # 経路にIDを含むため、新規作成時は採番後に設定する
+            super().save(*args, **kwargs)
+            self._derive_tree_fields(self.parent)
+            Category.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth, full_name=self.full_name)
+            return
+        
+        previous = Category.objects.filter(pk=self.pk).values('path', 'full_name').first()
+        self._derive_tree_fields(self.parent)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'path', 'depth', 'full_name'}
+        with transaction.atomic():
+            # post_save の受け手（検索インデックス等）が配下の新しい表示名を参照できるよう、先に配下を更新する
+            if previous and previous['path'] and (previous['path'], previous['full_name']) != (self.path, self.full_name):
+                self._update_descendants(previous['path'])
+            super().save(*args, **kwargs)
+    
+    def _update_descendants(self, old_path):
+        """移動・名称変更を配下のカテゴリへ反映"""
+        nodes = {self.pk: self}
+        descendants = list(
+            Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).order_by('depth')
+        )
+        for category in descendants:
+            category._derive_tree_fields(nodes[category.parent_id])
+            nodes[category.pk] = category
+        Category.objects.bulk_update(descendants, ['path', 'depth', 'full_name'], batch_size=500)
+    
+    def subtree(self):
+        """自身と配下のカテゴリ"""
+        return Category.objects.filter(path__startswith=self.path)
+    
+    @property
+    def ancestor_ids(self):
+        """ルートから自身までのカテゴリID"""
+        return [int(pk) for pk in self.path.split(self.PATH_SEPARATOR) if pk]
+    
+    @classmethod
+    def subtree_q(cls, category_id, field='category'):
+        """指定カテゴリ（配下を含む）に属する条件。経路はサブクエリで引くため1クエリで絞り込める"""
+        path = cls.objects.filter(pk=category_id).values('path')[:1]
+        return models.Q(**{f'{field}__in': cls.objects.filter(path__startswith=models.Subquery(path))})
+    
+    @classmethod
+    def rebuild_paths(cls):
+        """全カテゴリの経路・表示名を親から再計算（一括登録後や既存データの移行用）"""
+        categories = cls.objects.in_bulk()
+        children = {}
+        for category in categories.values():
+            children.setdefault(category.parent_id, []).append(category)
+        
+        # ルートから幅優先でたどり、親の値が確定してから子を計算する
+        level = children.get(None, [])
+        updated = []
+        while level:
+            for category in level:
+                category._derive_tree_fields(categories.get(category.parent_id))
+            updated.extend(level)
+            level = [child for category in level for child in children.get(category.pk, [])]
+        cls.objects.bulk_update(updated, ['path', 'depth', 'full_name'], batch_size=500)
+        return len(updated)
 
 
 class Product(models.Model):
@@ -65,6 +160,9 @@ class Product(models.Model):
     height = models.FloatField('高さ(cm)', null=True, blank=True)
     depth = models.FloatField('奥行(cm)', null=True, blank=True)
     image = models.ImageField('商品画像', upload_to='products/', null=True, blank=True)
+    image_thumb = models.ImageField('セル用画像', upload_to='products/derivatives/', null=True, blank=True, editable=False)
+    image_icon = models.ImageField('アイコン画像', upload_to='products/derivatives/', null=True, blank=True, editable=False)
+    image_print = models.ImageField('印刷用画像', upload_to='products/derivatives/', null=True, blank=True, editable=False)
     is_own_product = models.BooleanField('自社商品', default=False)
     is_active = models.BooleanField('有効', default=True)
     created_at = models.DateTimeField('作成日時', auto_now_add=True)
@@ -75,6 +173,77 @@ class Product(models.Model):
         verbose_name = '商品'
         verbose_name_plural = '商品'
         ordering = ['-created_at']
+        indexes = [
+            # 一覧のキーセットページング（有効な商品を (created_at, id) の順に辿る）。
+            # is_active は「WHERE is_active」と比較なしで出力され複合インデックスの先頭列に使われないため、部分インデックスにする
+            models.Index(
+                fields=['created_at', 'id'], condition=models.Q(is_active=True), name='product_active_created_idx',
+            ),
+        ]
+    
+    def __str__(self):
+        return self.product_name
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 画像の差し替え判定用に読み込み時の画像名を保持
+        if 'image' in field_names:
+            instance._loaded_image_name = values[field_names.index('image')] or ''
+        return instance
+    
+    def save(self, *args, **kwargs):
+        image_name = self.image.name if self.image else ''
+        # 新規作成時は未保存扱い、読み込み時の値が不明な場合は変更なしとみなす
+        loaded_image_name = getattr(self, '_loaded_image_name', '' if self._state.adding else image_name)
+        if image_name != loaded_image_name or (self.image and not self.image_thumb):
+            try:
+                generate_derivatives(self)
+            except (OSError, ValueError):
+                # 元画像がストレージに無い・読めない場合も保存は続ける（派生画像の代わりに元画像のURLを使う）
+                logger.warning('商品 %s の派生画像を生成できませんでした', self.pk or self.product_code, exc_info=True)
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'image_thumb', 'image_icon', 'image_print'}
+        super().save(*args, **kwargs)
+        self._loaded_image_name = self.image.name if self.image else ''
+    
+    def _derivative_url(self, field_name):
+        derivative = getattr(self, field_name)
+        if derivative:
+            return derivative.url
+        return self.image.url if self.image else None
+    
+    @property
+    def thumbnail_url(self):
+        """棚グリッドのセル用画像URL"""
+        return self._derivative_url('image_thumb')
+    
+    @property
+    def icon_url(self):
+        """商品パレット・一覧用画像URL"""
+        return self._derivative_url('image_icon')
+    
+    @property
+    def print_image_url(self):
+        """PDF出力用画像URL"""
+        return self._derivative_url('image_print')
+
+class SearchToken(models.Model):
+    """検索インデックス（正規化済みn-gramトークン）"""
+    kind = models.CharField('種別', max_length=20)
+    object_id = models.PositiveBigIntegerField('対象ID')
+    token = models.CharField('トークン', max_length=50)
+    weight = models.PositiveSmallIntegerField('重み', default=1)
+    
+    class Meta:
+        verbose_name = '検索トークン'
+        verbose_name_plural = '検索トークン'
+        # 検索（トークン→対象）と一致度の計算・再索引（対象→トークン）の両方向を索引のみで引けるようにする
+        indexes = [
+            models.Index(fields=['kind', 'token', 'object_id', 'weight'], name='search_token_lookup_idx'),
+            models.Index(fields=['kind', 'object_id', 'token', 'weight'], name='search_token_object_idx'),
+        ]
     
     def __str__(self):
-        return self.product_name
\ No newline at end of file
+        return f"{self.kind}:{self.object_id} {self.token}"
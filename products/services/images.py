@@ -0,0 +1,70 @@
+# ==================== products/services/images.py ====================
+
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, features
+
+
+# 派生画像の種類: (フィールド名, 最大サイズ(px))
+#   thumb: 棚グリッドのセル用（セル最大100px × 高解像度ディスプレイ）
+#   icon:  商品パレット・一覧用
+#   print: PDF出力用
+IMAGE_DERIVATIVES = {
+    'thumb': ('image_thumb', (200, 200)),
+    'icon': ('image_icon', (160, 160)),
+    'print': ('image_print', (800, 800)),
+}
+
+if features.check('webp'):
+    DERIVATIVE_FORMAT, DERIVATIVE_EXTENSION = 'WEBP', 'webp'
+else:
+    DERIVATIVE_FORMAT, DERIVATIVE_EXTENSION = 'JPEG', 'jpg'
+
+DERIVATIVE_QUALITY = 80
+
+
+def _load_source(image_field):
+    image_field.open('rb')
+    try:
+        image_field.seek(0)
+        source = Image.open(image_field)
+        source.load()
+    finally:
+        image_field.seek(0)
+    # スマートフォン写真の回転情報を反映
+    source = ImageOps.exif_transpose(source)
+    if DERIVATIVE_FORMAT == 'JPEG' or source.mode not in ('RGB', 'RGBA'):
+        source = source.convert('RGBA' if DERIVATIVE_FORMAT == 'WEBP' and 'A' in source.getbands() else 'RGB')
+    return source
+
+
+def _encode(source, size):
+    image = source.copy()
+    image.thumbnail(size, Image.LANCZOS)
+    output = BytesIO()
+    image.save(output, DERIVATIVE_FORMAT, quality=DERIVATIVE_QUALITY, optimize=True)
+    return output.getvalue()
+
+
+def clear_derivatives(product):
+    for field_name, _ in IMAGE_DERIVATIVES.values():
+        derivative = getattr(product, field_name)
+        if derivative:
+            derivative.delete(save=False)
+        setattr(product, field_name, None)
+
+
+def generate_derivatives(product):
+    """商品画像から固定サイズの派生画像を生成（保存は呼び出し側で行う）"""
+    clear_derivatives(product)
+    if not product.image:
+        return
+    
+    source = _load_source(product.image)
+    stem = PurePosixPath(product.image.name).stem
+    for kind, (field_name, size) in IMAGE_DERIVATIVES.items():
+        getattr(product, field_name).save(
+            f'{stem}_{kind}.{DERIVATIVE_EXTENSION}', ContentFile(_encode(source, size)), save=False
+        )
@@ -0,0 +1,142 @@
+# ==================== products/services/masters.py ====================
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+# 共有キャッシュ上のマスタ一覧の保持期間（無効化は世代の更新で行うため長めでよい）
+MASTER_CACHE_TIMEOUT = 24 * 60 * 60
+# プロセス内キャッシュが共有キャッシュの世代を確認し直す間隔（秒）。
+# 他プロセスでの変更は最大この時間だけ遅れて反映される（同一プロセスでの変更は即時）。
+LOCAL_CHECK_INTERVAL = getattr(settings, 'MASTER_DATA_LOCAL_CHECK_INTERVAL', 5)
+
+# kind -> (モデル, クエリセットを返す関数, グループ化する項目)
+_masters = {}
+_local = {}
+_lock = threading.Lock()
+
+
+class MasterTable:
+    """マスタ一覧（表示順のリスト・ID引き・グループ別リスト）"""
+
+    def __init__(self, objects, group_by=None):
+        self.objects = objects
+        self.by_pk = {obj.pk: obj for obj in objects}
+        self.groups = {}
+        if group_by:
+            for obj in objects:
+                self.groups.setdefault(getattr(obj, group_by), []).append(obj)
+
+
+def register_master(kind, model, queryset, group_by=None):
+    """キャッシュ対象のマスタを登録（各アプリのシグナル定義から呼び出す）
+
+    queryset はクエリセットを返す関数で、その並び順が一覧の表示順になる。
+    """
+    _masters[kind] = (model, queryset, group_by)
+
+
+def registered_kinds():
+    return list(_masters)
+
+
+def kind_for_model(model):
+    for kind, (master_model, _, _) in _masters.items():
+        if master_model is model:
+            return kind
+    return None
+
+
+def _generation_key(kind):
+    return f'masters:{kind}:generation'
+
+
+def _table_key(kind, generation):
+    return f'masters:{kind}:{generation}'
+
+
+def _current_generation(kind):
+    key = _generation_key(kind)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def generation(*kinds):
+    """マスタ一覧の世代（一覧を使う画面の ETag に含め、マスタ変更時に再描画させる）"""
+    return tuple(_current_generation(kind) for kind in kinds)
+
+
+def _build(kind):
+    _, queryset, group_by = _masters[kind]
+    return MasterTable(list(queryset()), group_by)
+
+
+def table(kind):
+    """マスタ一覧を取得
+
+    プロセス内キャッシュ → 共有キャッシュ（Django cache）→ DB の順に参照する。
+    プロセス内キャッシュは LOCAL_CHECK_INTERVAL ごとに共有キャッシュの世代を確認する。
+    """
+    now = time.monotonic()
+    entry = _local.get(kind)
+    if entry is not None and now - entry[2] < LOCAL_CHECK_INTERVAL:
+        return entry[1]
+
+    generation = _current_generation(kind)
+    if entry is not None and entry[0] == generation:
+        _local[kind] = (generation, entry[1], now)
+        return entry[1]
+
+    key = _table_key(kind, generation)
+    master_table = cache.get(key)
+    if master_table is None:
+        master_table = _build(kind)
+        cache.set(key, master_table, MASTER_CACHE_TIMEOUT)
+    with _lock:
+        _local[kind] = (generation, master_table, now)
+    return master_table
+
+
+def objects(kind):
+    """表示順のマスタ一覧（共有オブジェクトのため変更しないこと）"""
+    return table(kind).objects
+
+
+def group(kind, key):
+    """グループ別のマスタ一覧（例: メーカー別のブランド）"""
+    return table(kind).groups.get(key, [])
+
+
+def get(kind, pk):
+    """IDでマスタを取得（無ければ None）"""
+    return table(kind).by_pk.get(pk)
+
+
+def _expire(kinds):
+    with _lock:
+        for kind in kinds:
+            _local.pop(kind, None)
+    cache.set_many({_generation_key(kind): time.time_ns() for kind in kinds}, None)
+
+
+def invalidate(*kinds):
+    """マスタ一覧のキャッシュを破棄（トランザクション中はコミット後にも破棄する）"""
+    kinds = [kind for kind in kinds if kind in _masters]
+    if kinds:
+        _expire(kinds)
+        transaction.on_commit(lambda: _expire(kinds))
+
+
+def warm(kinds=None):
+    """マスタ一覧を共有キャッシュとプロセス内キャッシュに読み込む"""
+    warmed = {}
+    for kind in kinds or registered_kinds():
+        warmed[kind] = len(table(kind).objects)
+    return warmed
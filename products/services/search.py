@@ -0,0 +1,184 @@
+# ==================== products/services/search.py ====================
+
+import unicodedata
+from functools import reduce
+from operator import or_
+
+from django.db import connection, transaction
+from django.db.models import IntegerField, OuterRef, Q, Subquery, Sum, Value
+
+from products.models import SearchToken
+
+
+# トークン列の長さ（SearchToken.token の max_length）
+MAX_TOKEN_LENGTH = 50
+INDEX_BATCH_SIZE = 1000
+# 一致件数がこれを超える検索（1文字の検索など）では一致度の計算を省く
+RANK_CANDIDATE_LIMIT = 5000
+
+# kind -> (モデル, [(values_list で取得する項目, 重み), ...])
+_indexes = {}
+
+
+def register_index(kind, model, fields):
+    """検索インデックスの対象モデルと項目を登録（各アプリのシグナル定義から呼び出す）"""
+    _indexes[kind] = (model, list(fields))
+
+
+def registered_kinds():
+    return list(_indexes)
+
+
+def _char_class(ch):
+    """文字種の判定（'ja': かな・漢字、'alnum': 英数字、None: 区切り）"""
+    if ch.isascii():
+        return 'alnum' if ch.isalnum() else None
+    if ('\u3041' <= ch <= '\u30ff' and ch not in '゛゜゠・') or '\u3400' <= ch <= '\u9fff' or ch in '々〆':
+        return 'ja'
+    return 'alnum' if ch.isalnum() else None
+
+
+def normalize(text):
+    """NFKC正規化・小文字化・カタカナのひらがな化"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    return ''.join(chr(ord(ch) - 0x60) if 'ァ' <= ch <= 'ヶ' else ch for ch in text)
+
+
+def _runs(text):
+    """正規化済みテキストを文字種ごとの連続部分に分割
+
+    空白以外の記号（「・」「-」等）は読み飛ばし、前後を連結する（「コカ・コーラ」→「こかこーら」）。
+    """
+    runs = []
+    current, current_class = [], None
+    for ch in normalize(text):
+        if ch.isspace():
+            char_class = 'space'
+        else:
+            char_class = _char_class(ch)
+            if char_class is None:
+                continue
+        if char_class != current_class and current:
+            runs.append((current_class, ''.join(current)))
+            current = []
+        current_class = char_class
+        if char_class != 'space':
+            current.append(ch)
+    if current:
+        runs.append((current_class, ''.join(current)))
+    return runs
+
+
+def index_tokens(text):
+    """索引用トークン
+
+    かな・漢字はbigramと末尾の1文字、英数字は語の各位置から末尾までの部分（接尾辞）を登録する。
+    1文字の検索や英数字の部分一致（JANコードの途中・末尾の桁など）は、トークンの前方一致（範囲検索）で引く。
+    """
+    tokens = set()
+    for char_class, run in _runs(text):
+        if char_class == 'ja':
+            tokens.update(run[i:i + 2] for i in range(len(run) - 1))
+            tokens.add(run[-1])
+        else:
+            run = run[:MAX_TOKEN_LENGTH]
+            tokens.update(run[i:] for i in range(len(run)))
+    return tokens
+
+
+def query_terms(query):
+    """検索語を (トークン, 前方一致か) の組に分解（すべてを含む対象のみ一致とする）"""
+    terms = set()
+    for char_class, run in _runs(query):
+        if char_class == 'ja' and len(run) > 1:
+            terms.update((run[i:i + 2], False) for i in range(len(run) - 1))
+        else:
+            terms.add((run[:MAX_TOKEN_LENGTH], True))
+    return terms
+
+
+def index_objects(kind, object_ids):
+    """指定したオブジェクトの索引を作り直す（削除済みのIDは索引から除去される）"""
+    model, fields = _indexes[kind]
+    object_ids = list(object_ids)
+    paths = [path for path, _ in fields]
+
+    for start in range(0, len(object_ids), INDEX_BATCH_SIZE):
+        chunk = object_ids[start:start + INDEX_BATCH_SIZE]
+        rows = []
+        for pk, *values in model._default_manager.filter(pk__in=chunk).values_list('pk', *paths):
+            # 複数項目に含まれるトークンは最も重い項目の重みで登録
+            weights = {}
+            for value, (_, weight) in zip(values, fields):
+                for token in index_tokens(str(value) if value is not None else ''):
+                    weights[token] = max(weights.get(token, 0), weight)
+            rows.extend((kind, pk, token, weight) for token, weight in weights.items())
+        with transaction.atomic():
+            SearchToken.objects.filter(kind=kind, object_id__in=chunk).delete()
+            _insert_tokens(rows)
+
+
+def _insert_tokens(rows):
+    """トークンをプレースホルダ付きINSERTの executemany で登録（モデルインスタンスを経由しない）"""
+    if not rows:
+        return
+    opts = SearchToken._meta
+    qn = connection.ops.quote_name
+    columns = [opts.get_field(name).column for name in ('kind', 'object_id', 'token', 'weight')]
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        qn(opts.db_table), ', '.join(qn(column) for column in columns), ', '.join(['%s'] * len(columns)),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def remove_objects(kind, object_ids):
+    SearchToken.objects.filter(kind=kind, object_id__in=list(object_ids)).delete()
+
+
+def rebuild_index(kind):
+    """種別ごとに索引を全件再作成"""
+    model, _ = _indexes[kind]
+    SearchToken.objects.filter(kind=kind).delete()
+    object_ids = list(model._default_manager.order_by('pk').values_list('pk', flat=True))
+    index_objects(kind, object_ids)
+    return len(object_ids)
+
+
+def _term_filter(token, prefix):
+    if prefix:
+        # LIKE は索引を使えないため、前方一致は範囲条件で表す
+        return Q(token__gte=token, token__lt=token + '\U0010ffff')
+    return Q(token=token)
+
+
+def _rank_filter(token, prefix):
+    # 対象ごとの一致度は (kind, object_id) から引くため、範囲条件にせず索引の選択を object_id に寄せる
+    return Q(token__startswith=token) if prefix else Q(token=token)
+
+
+def search(queryset, kind, query):
+    """索引で絞り込み、一致度（search_rank）を付与したクエリセットを返す
+
+    呼び出し側は order_by('-search_rank', ...) で一致度順に並べる。
+    """
+    terms = query_terms(query)
+    if not terms:
+        return queryset.none()
+
+    tokens = SearchToken.objects.filter(kind=kind)
+    postings = [tokens.filter(_term_filter(token, prefix)) for token, prefix in terms]
+    for posting in postings:
+        queryset = queryset.filter(pk__in=posting.values('object_id'))
+    
+    # 一致度は候補ごとに索引を引くため、最も絞り込めるトークンでも候補が多すぎる場合は
+    # 並び順を呼び出し側の既定に任せる（件数は上限までしか数えない）
+    if all(posting[:RANK_CANDIDATE_LIMIT + 1].count() > RANK_CANDIDATE_LIMIT for posting in postings):
+        return queryset.annotate(search_rank=Value(0, output_field=IntegerField()))
+    rank = (
+        tokens.filter(reduce(or_, (_rank_filter(token, prefix) for token, prefix in terms)), object_id=OuterRef('pk'))
+        .values('object_id')
+        .annotate(rank=Sum('weight'))
+        .values('rank')
+    )
+    return queryset.annotate(search_rank=Subquery(rank))
@@ -0,0 +1,86 @@
+# ==================== products/signals.py ====================
+
+from django.db.models import Exists, OuterRef
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import Signal, receiver
+
+from .models import Maker, Brand, Category, Product
+from .services import masters, search
+
+# 一括取り込み（bulk_create / bulk_update）で商品が変更された後に送信する。
+# save() を経由しないため、post_save に依存する処理はこのシグナルで追従する。
+# product_ids: 作成・更新された商品ID
+# ownership_changed_ids: 自社/競合区分が変わった商品ID
+products_bulk_changed = Signal()
+
+
+masters.register_master('maker', Maker, lambda: Maker.objects.order_by('name'))
+masters.register_master(
+    'brand', Brand, lambda: Brand.objects.select_related('maker').order_by('name'), group_by='maker_id',
+)
+masters.register_master('category', Category, lambda: Category.objects.order_by('full_name', 'name'))
+# 有効な商品が（配下を含めて）あるカテゴリ。棚編集画面のカテゴリ絞り込みに使う
+masters.register_master('palette_category', Category, lambda: Category.objects.filter(
+    Exists(Product.objects.filter(is_active=True, category__path__startswith=OuterRef('path')))
+).order_by('full_name', 'name'))
+
+search.register_index('product', Product, [
+    ('product_name', 3),
+    ('product_code', 3),
+    ('maker__name', 2),
+    ('brand__name', 1),
+    ('category__full_name', 1),
+])
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_objects('product', [instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_objects('product', [instance.pk])
+
+
+@receiver(products_bulk_changed)
+def index_bulk_changed_products(sender, product_ids=(), **kwargs):
+    search.index_objects('product', product_ids)
+
+
+@receiver(post_save, sender=Maker)
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+def reindex_products_on_master_rename(sender, instance, created, raw=False, **kwargs):
+    """マスタ名の変更を、その名称で索引されている商品に反映"""
+    if raw or created:
+        return
+    if sender is Category:
+        # 表示名は配下のカテゴリにも引き継がれるため、配下の商品もまとめて索引し直す
+        products = Product.objects.filter(Category.subtree_q(instance.pk))
+    else:
+        products = Product.objects.filter(**{sender._meta.model_name: instance})
+    product_ids = products.values_list('pk', flat=True)
+    search.index_objects('product', product_ids)
+
+
+@receiver(post_save, sender=Maker)
+@receiver(post_delete, sender=Maker)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_master_cache(sender, **kwargs):
+    masters.invalidate(masters.kind_for_model(sender))
+    if sender is Category:
+        masters.invalidate('palette_category')
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(products_bulk_changed)
+def invalidate_palette_categories(sender, raw=False, **kwargs):
+    """商品の追加・有効化・カテゴリ変更で、商品のあるカテゴリが変わり得る"""
+    if not raw:
+        masters.invalidate('palette_category')
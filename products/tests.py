@@ -1,3 +1,415 @@
-from django.test import TestCase
+import csv
+import json
+import tempfile
+from io import BytesIO, StringIO
+from pathlib import Path
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.views.generic import ListView
+from django.test import RequestFactory, TestCase, override_settings
+from PIL import Image
+
+from config.pagination import CursorPaginationMixin, InvalidCursor, encode_cursor, paginate
+from .management.commands import import_products
+from .models import Brand, Category, Maker, Product
+from .services import masters, search
+from .signals import products_bulk_changed
+
+
+class NormalizeTests(TestCase):
+    """検索語の正規化・トークン分割"""
+
+    def test_normalize(self):
+        # 全角英数字・半角カナ・カタカナは NFKC・小文字化・ひらがな化で揃える
+        self.assertEqual(search.normalize('ＣＯＬＡ　ｺｰﾗ コーラ'), 'cola こーら こーら')
+
+    def test_runs_join_across_symbols(self):
+        self.assertEqual(search._runs('コカ・コーラ 500ml'), [('ja', 'こかこーら'), ('alnum', '500ml')])
+
+    def test_index_tokens(self):
+        tokens = search.index_tokens('お茶 4901')
+        # かな・漢字は bigram と末尾の1文字、英数字は接尾辞
+        self.assertEqual(tokens, {'お茶', '茶', '4901', '901', '01', '1'})
+
+    def test_query_terms(self):
+        self.assertEqual(search.query_terms('緑茶 49'), {('緑茶', False), ('49', True)})
+        # 1文字の検索は前方一致
+        self.assertEqual(search.query_terms('茶'), {('茶', True)})
+
+
+class ProductSearchTests(TestCase):
+    """商品の検索（索引は保存時にシグナルで更新される）"""
+
+    def setUp(self):
+        maker = Maker.objects.create(name='コカ・コーラ')
+        category = Category.objects.create(name='飲料')
+        self.cola = Product.objects.create(
+            product_name='コカ・コーラ 500ml', product_code='4902102072618', maker=maker, category=category,
+        )
+        self.tea = Product.objects.create(
+            product_name='綾鷹 緑茶', product_code='4902102112345', maker=Maker.objects.create(name='伊藤園'),
+            category=category,
+        )
+
+    def find(self, query):
+        return set(search.search(Product.objects.all(), 'product', query))
+
+    def test_kana_and_width_insensitive(self):
+        self.assertEqual(self.find('こーら'), {self.cola})
+        self.assertEqual(self.find('ｺｰﾗ'), {self.cola})
+        self.assertEqual(self.find('500ML'), {self.cola})
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(self.find('緑茶 綾鷹'), {self.tea})
+        self.assertEqual(self.find('緑茶 こーら'), set())
+
+    def test_product_code_fragments(self):
+        self.assertEqual(self.find('490210'), {self.cola, self.tea})
+        # 途中・末尾の桁でも見つかる
+        self.assertEqual(self.find('2072'), {self.cola})
+        self.assertEqual(self.find('12345'), {self.tea})
+        self.assertEqual(self.find('2618'), {self.cola})
+
+    def test_index_follows_updates(self):
+        self.tea.product_name = '綾鷹 ほうじ茶'
+        self.tea.save()
+        self.assertEqual(self.find('緑茶'), set())
+        self.assertEqual(self.find('ほうじ'), {self.tea})
+
+    def test_product_list_search(self):
+        response = self.client.get('/products/', {'search': '2618', 'format': 'json'}).json()
+        self.assertEqual([row['id'] for row in response['results']], [self.cola.id])
+
+
+class ProductImageTests(TestCase):
+    """商品画像の派生画像"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.product = Product.objects.create(
+            product_name='緑茶', product_code='4900000000001',
+            maker=Maker.objects.create(name='伊藤園'), category=Category.objects.create(name='飲料'),
+        )
+
+    def test_derivatives_generated_on_upload(self):
+        output = BytesIO()
+        Image.new('RGB', (1200, 900), 'green').save(output, 'PNG')
+        self.product.image.save('tea.png', ContentFile(output.getvalue()))
+        self.assertTrue(self.product.image_thumb)
+        with Image.open(self.product.image_thumb) as thumb:
+            self.assertLessEqual(max(thumb.size), 200)
+
+    def test_missing_original_does_not_block_save(self):
+        Product.objects.filter(pk=self.product.pk).update(image='products/missing.png')
+        product = Product.objects.get(pk=self.product.pk)
+        product.product_name = '緑茶 600ml'
+        with self.assertLogs('products.models', 'WARNING'):
+            product.save()
+        product.refresh_from_db()
+        self.assertEqual(product.product_name, '緑茶 600ml')
+        self.assertEqual(product.thumbnail_url, product.image.url)
+
+
+class CursorPaginationTests(TestCase):
+    """キーセットページング（config/pagination.py）と商品一覧"""
+
+    def setUp(self):
+        maker = Maker.objects.create(name='メーカー')
+        category = Category.objects.create(name='飲料')
+        self.products = [
+            Product.objects.create(product_name=f'商品{i}', product_code=f'4900000{i:06d}', maker=maker, category=category)
+            for i in range(23)
+        ]
+        # 作成日時が同じ商品は id で順序が決まること（並び順の末尾に id を補う）
+        Product.objects.filter(pk__in=[p.pk for p in self.products[5:15]]).update(created_at=timezone.now())
+        Product.objects.filter(pk=self.products[0].pk).update(is_active=False)
+        self.expected = list(
+            Product.objects.filter(is_active=True).order_by('-created_at', '-id').values_list('pk', flat=True)
+        )
+
+    def walk(self, queryset, page_size):
+        pages, page = [], paginate(queryset, None, page_size)
+        pages.append(page)
+        while page.has_next:
+            page = paginate(queryset, page.next_cursor, page_size)
+            pages.append(page)
+        return pages
+
+    def test_forward_and_back(self):
+        queryset = Product.objects.filter(is_active=True).order_by('-created_at')
+        pages = self.walk(queryset, 5)
+        self.assertEqual([p.pk for page in pages for p in page], self.expected)
+        self.assertFalse(pages[0].has_previous)
+        self.assertEqual([len(page) for page in pages], [5, 5, 5, 5, 2])
+
+        # 前のページへ戻ると、同じページの内容が同じ順で返る
+        for index in range(len(pages) - 1, 0, -1):
+            previous = paginate(queryset, pages[index].previous_cursor, 5)
+            self.assertEqual([p.pk for p in previous], [p.pk for p in pages[index - 1]])
+            self.assertTrue(previous.has_next)
+            self.assertEqual(previous.has_previous, index - 1 > 0)
+
+    def test_ascending_order(self):
+        pages = self.walk(Product.objects.filter(is_active=True).order_by('created_at'), 7)
+        self.assertEqual([p.pk for page in pages for p in page], self.expected[::-1])
+
+    def test_estimated_count(self):
+        page = paginate(Product.objects.filter(is_active=True).order_by('-created_at'), None, 5, with_count=True)
+        self.assertEqual(page.estimated_count, 22)
+
+    def test_invalid_cursor(self):
+        queryset = Product.objects.order_by('-created_at')
+        for cursor in ('garbage', encode_cursor([1]), encode_cursor(['not a date', 1])):
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(InvalidCursor):
+                    paginate(queryset, cursor, 5)
+
+    def test_mixed_directions_rejected(self):
+        with self.assertRaises(ValueError):
+            paginate(Product.objects.order_by('-created_at', 'id'), None, 5)
+
+    def test_product_list_json(self):
+        ids, cursor = [], None
+        while True:
+            params = {'format': 'json', **({'cursor': cursor} if cursor else {})}
+            response = self.client.get('/products/', params).json()
+            ids += [row['id'] for row in response['results']]
+            if not response['has_next']:
+                break
+            cursor = response['next_cursor']
+        self.assertEqual(ids, self.expected)
+        self.assertEqual(self.client.get('/products/', {'format': 'json', 'count': '0'}).json()['estimated_count'], None)
+
+    def test_default_serialize_object(self):
+        class PlainProductList(CursorPaginationMixin, ListView):
+            queryset = Product.objects.filter(is_active=True).order_by('-created_at')
+
+        request = RequestFactory().get('/', {'format': 'json'})
+        rows = json.loads(PlainProductList.as_view(paginate_by=3)(request).content)['results']
+        self.assertEqual([row['id'] for row in rows], self.expected[:3])
+        product = Product.objects.get(pk=rows[0]['id'])
+        self.assertEqual(rows[0]['maker_id'], product.maker_id)
+        # 日時は JsonResponse のエンコーダーでミリ秒までの ISO 8601 形式になる
+        created_at = product.created_at.replace(microsecond=product.created_at.microsecond // 1000 * 1000)
+        self.assertEqual(parse_datetime(rows[0]['created_at']), created_at)
+        self.assertNotIn('image', rows[0])
+
+        PlainProductList.json_fields = ['id', 'product_name']
+        rows = json.loads(PlainProductList.as_view(paginate_by=3)(request).content)['results']
+        self.assertEqual(set(rows[0]), {'id', 'product_name'})
+
+    def test_product_list_invalid_cursor(self):
+        self.assertEqual(self.client.get('/products/', {'cursor': 'garbage'}).status_code, 404)
+
+    def test_product_list_html_links(self):
+        response = self.client.get('/products/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '?cursor=')
+
+
+class ProductFormQueryTests(TestCase):
+    """商品編集画面のクエリ数"""
+
+    def setUp(self):
+        makers = [Maker.objects.create(name=f'メーカー{i}') for i in range(4)]
+        for maker in makers:
+            for i in range(3):
+                Brand.objects.create(name=f'{maker.name} ブランド{i}', maker=maker)
+        self.product = Product.objects.create(
+            product_name='緑茶', product_code='4900000000001', maker=makers[0],
+            brand=Brand.objects.filter(maker=makers[0]).first(), category=Category.objects.create(name='飲料'),
+        )
+        self.url = reverse('products:product_edit', args=[self.product.pk])
+
+    def test_cold_masters_do_not_query_per_brand(self):
+        # マスタ一覧が未キャッシュでも、商品1件とマスタ3種の取得のみ（ブランドごとのメーカー取得をしない）
+        cache.clear()
+        masters._local.clear()
+        with self.assertNumQueries(4):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_warm_masters(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+
+def jan(body):
+    """12桁にチェックデジットを付けたJANコード"""
+    total = sum(int(d) * (3 if i % 2 == 0 else 1) for i, d in enumerate(reversed(body)))
+    return f'{body}{(10 - total % 10) % 10}'
+
+
+class ImportProductsTests(TestCase):
+    """CSVからの商品取り込み"""
+
+    HEADER = ['JANコード', '商品名', 'メーカー', 'ブランド', 'カテゴリ', '価格', '自社商品']
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / 'products.csv'
+        self.drinks = Category.objects.create(name='飲料')
+        self.sent = []
+        products_bulk_changed.connect(self.receive)
+        self.addCleanup(products_bulk_changed.disconnect, self.receive)
+
+    def receive(self, sender, **kwargs):
+        self.sent.append(kwargs)
+
+    def run_import(self, rows):
+        with open(self.path, 'w', newline='', encoding='utf-8') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(self.HEADER)
+            writer.writerows(rows)
+        command = import_products.Command()
+        call_command(command, str(self.path), stdout=StringIO())
+        return command
+
+    def test_rejects_invalid_check_digit(self):
+        valid = jan('490000000001')
+        bad_code = valid[:-1] + str((int(valid[-1]) + 1) % 10)
+        command = self.run_import([
+            [bad_code, '緑茶', '伊藤園', '', '飲料', '150', ''],
+            [jan('490000000002'), 'ほうじ茶', '伊藤園', '', '飲料', '150', ''],
+        ])
+        self.assertEqual([line for line, _ in command.errors], [2])
+        self.assertEqual(command.created, 1)
+        self.assertFalse(Product.objects.filter(product_code=bad_code).exists())
+
+    def test_created_updated_unchanged_counts(self):
+        rows = [[jan(f'49000000000{i}'), f'商品{i}', '伊藤園', '', '飲料', '100', ''] for i in range(3)]
+        command = self.run_import(rows)
+        self.assertEqual((command.created, command.updated, command.unchanged), (3, 0, 0))
+
+        rows[0][5] = '120'
+        rows[1][6] = '自社'
+        command = self.run_import(rows)
+        self.assertEqual((command.created, command.updated, command.unchanged), (0, 2, 1))
+        self.assertEqual(Product.objects.get(product_code=rows[0][0]).price, 120)
+        self.assertTrue(Product.objects.get(product_code=rows[1][0]).is_own_product)
+
+    def test_creates_missing_masters(self):
+        self.run_import([
+            [jan('490000000001'), '緑茶', '伊藤園', 'お〜いお茶', '飲料 > 茶系飲料', '150', ''],
+            [jan('490000000002'), 'ほうじ茶', '伊藤園', 'お〜いお茶', '飲料>茶系飲料', '150', ''],
+            [jan('490000000003'), 'ポテトチップス', 'カルビー', '', '食品 > 菓子 > スナック', '120', ''],
+        ])
+        self.assertEqual(set(Maker.objects.values_list('name', flat=True)), {'伊藤園', 'カルビー'})
+        self.assertEqual(list(Brand.objects.values_list('maker__name', 'name')), [('伊藤園', 'お〜いお茶')])
+        # 既存のルート「飲料」の配下に追加し、同名のルートを重複して作らない
+        self.assertEqual(Category.objects.filter(name='飲料').count(), 1)
+        tea = Category.objects.get(name='茶系飲料')
+        self.assertEqual((tea.parent_id, tea.full_name, tea.path), (self.drinks.pk, '飲料 > 茶系飲料', f'{self.drinks.path}{tea.pk}/'))
+        snack = Category.objects.get(name='スナック')
+        self.assertEqual(snack.full_name, '食品 > 菓子 > スナック')
+        self.assertEqual(snack.depth, 2)
+        self.assertEqual(
+            set(Product.objects.values_list('category__full_name', flat=True)),
+            {'飲料 > 茶系飲料', '食品 > 菓子 > スナック'},
+        )
+
+    def test_matches_existing_child_category_by_full_name(self):
+        tea = Category.objects.create(name='茶系飲料', parent=self.drinks)
+        self.run_import([[jan('490000000001'), '緑茶', '伊藤園', '', '飲料 > 茶系飲料', '150', '']])
+        self.assertEqual(Category.objects.count(), 2)
+        self.assertEqual(Product.objects.get().category_id, tea.pk)
+
+    def test_bulk_changed_payload(self):
+        rows = [[jan(f'49000000000{i}'), f'商品{i}', '伊藤園', '', '飲料', '100', ''] for i in range(3)]
+        self.run_import(rows)
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(set(self.sent[0]['product_ids']), set(Product.objects.values_list('pk', flat=True)))
+        self.assertEqual(self.sent[0]['ownership_changed_ids'], [])
+
+        rows[1][6] = '自社'
+        self.sent.clear()
+        self.run_import(rows)
+        changed = Product.objects.get(product_code=rows[1][0])
+        self.assertEqual(self.sent[0]['product_ids'], [changed.pk])
+        self.assertEqual(self.sent[0]['ownership_changed_ids'], [changed.pk])
+
+        # 変更がなければ送信しない
+        self.sent.clear()
+        self.run_import(rows)
+        self.assertEqual(self.sent, [])
+
+
+class CategoryTreeTests(TestCase):
+    """カテゴリ階層（経路・表示名）と配下の絞り込み"""
+
+    def setUp(self):
+        self.food = Category.objects.create(name='食品')
+        self.snack = Category.objects.create(name='菓子', parent=self.food)
+        self.chips = Category.objects.create(name='スナック', parent=self.snack)
+        self.drinks = Category.objects.create(name='飲料')
+        maker = Maker.objects.create(name='メーカー')
+        self.products = {
+            category.name: Product.objects.create(
+                product_name=f'{category.name}の商品', product_code=jan(f'49000000000{i}'), maker=maker, category=category,
+            )
+            for i, category in enumerate([self.food, self.snack, self.chips, self.drinks])
+        }
+
+    def refresh(self, *categories):
+        return [Category.objects.get(pk=category.pk) for category in categories]
+
+    def test_tree_fields(self):
+        chips, = self.refresh(self.chips)
+        self.assertEqual(chips.path, f'{self.food.pk}/{self.snack.pk}/{self.chips.pk}/')
+        self.assertEqual(chips.depth, 2)
+        self.assertEqual(chips.full_name, '食品 > 菓子 > スナック')
+        self.assertEqual(chips.ancestor_ids, [self.food.pk, self.snack.pk, self.chips.pk])
+
+    def test_move_rewrites_subtree(self):
+        self.snack.parent = self.drinks
+        self.snack.name = 'おやつ'
+        self.snack.save()
+        snack, chips = self.refresh(self.snack, self.chips)
+        self.assertEqual(snack.full_name, '飲料 > おやつ')
+        self.assertEqual(chips.path, f'{self.drinks.pk}/{self.snack.pk}/{self.chips.pk}/')
+        self.assertEqual(chips.full_name, '飲料 > おやつ > スナック')
+
+    def test_parent_in_own_subtree_rejected(self):
+        food, = self.refresh(self.food)
+        food.parent = self.chips
+        with self.assertRaises(ValidationError):
+            food.clean()
+
+    def test_rebuild_paths(self):
+        Category.objects.update(path='', depth=0, full_name='')
+        self.assertEqual(Category.rebuild_paths(), 4)
+        chips, = self.refresh(self.chips)
+        self.assertEqual((chips.path, chips.full_name), (f'{self.food.pk}/{self.snack.pk}/{self.chips.pk}/', '食品 > 菓子 > スナック'))
+
+    def test_subtree_filter(self):
+        def names(category):
+            products = Product.objects.filter(Category.subtree_q(category.pk))
+            return set(products.values_list('category__name', flat=True))
+
+        self.assertEqual(names(self.food), {'食品', '菓子', 'スナック'})
+        self.assertEqual(names(self.snack), {'菓子', 'スナック'})
+        self.assertEqual(names(self.chips), {'スナック'})
+
+    def test_product_list_filter_queries_do_not_grow_with_depth(self):
+        def list_products(category):
+            response = self.client.get('/products/', {'format': 'json', 'category': category.pk}).json()
+            return {row['id'] for row in response['results']}
+
+        # 件数と1ページ分の取得のみ（配下のカテゴリはサブクエリで引く）
+        list_products(self.drinks)
+        with self.assertNumQueries(2):
+            ids = list_products(self.food)
+        self.assertEqual(ids, {self.products[name].pk for name in ('食品', '菓子', 'スナック')})
+        with self.assertNumQueries(2):
+            self.assertEqual(list_products(self.chips), {self.products['スナック'].pk})
@@ -1,19 +1,21 @@
 # ==================== products/views.py ====================
 
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
 from django.http import JsonResponse
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView
 from django.urls import reverse_lazy
-from django.db.models import Q
 from django.views.decorators.http import require_POST
+from config.pagination import CursorPaginationMixin
 
-from .models import Product, Maker, Brand, Category
+from .models import Product, Category
 from .forms import ProductForm, MakerForm, BrandForm, CategoryForm
+from .services import masters, search as search_index
 
 
-class ProductListView(ListView):
-    """商品一覧"""
+class ProductListView(CursorPaginationMixin, ListView):
+    """商品一覧（?cursor= でページ送り、?format=json でJSON）"""
     model = Product
     template_name = 'product_list.html'
     context_object_name = 'products'
@@ -29,35 +31,46 @@ class ProductListView(ListView):
         is_own = self.request.GET.get('is_own')
         
         if search:
-            queryset = queryset.filter(
-                Q(product_name__icontains=search) |
-                Q(product_code__icontains=search) |
-                Q(maker__name__icontains=search)
-            )
+            queryset = search_index.search(queryset, 'product', search)
         
         if maker:
             queryset = queryset.filter(maker_id=maker)
         
         if category:
-            queryset = queryset.filter(category_id=category)
+            queryset = queryset.filter(Category.subtree_q(category))
         
         if is_own == 'true':
             queryset = queryset.filter(is_own_product=True)
         elif is_own == 'false':
             queryset = queryset.filter(is_own_product=False)
         
+        if search:
+            return queryset.order_by('-search_rank', '-created_at')
         return queryset.order_by('-created_at')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['search'] = self.request.GET.get('search', '')
-        context['makers'] = Maker.objects.all()
-        context['categories'] = Category.objects.all()
+        context['makers'] = masters.objects('maker')
+        context['categories'] = masters.objects('category')
         context['selected_maker'] = self.request.GET.get('maker', '')
         context['selected_category'] = self.request.GET.get('category', '')
         context['selected_is_own'] = self.request.GET.get('is_own', '')
         return context
 
+    def serialize_object(self, product):
+        return {
+            'id': product.id,
+            'product_name': product.product_name,
+            'product_code': product.product_code,
+            'maker_name': product.maker.name,
+            'brand_name': product.brand.name if product.brand else None,
+            'category_name': product.category.name if product.category else None,
+            'is_own_product': product.is_own_product,
+            'image_url': product.thumbnail_url,
+            'created_at': product.created_at.isoformat(),
+        }
+
 
 class ProductCreateView(CreateView):
     """商品作成"""
@@ -172,7 +185,8 @@ def add_category(request):
             'success': True,
             'category': {
                 'id': category.id,
-                'name': category.name
+                'name': category.name,
+                'full_name': category.full_name
             }
         })
     else:
@@ -182,8 +196,13 @@ def add_category(request):
         })
 
 
-def get_brands_by_maker(request):
+async def get_brands_by_maker(request):
     """メーカー別ブランド取得API"""
-    maker_id = request.GET.get('maker_id')
-    brands = Brand.objects.filter(maker_id=maker_id).values('id', 'name')
-    return JsonResponse({'brands': list(brands)})
+    try:
+        maker_id = int(request.GET.get('maker_id'))
+    except (TypeError, ValueError):
+        return JsonResponse({'brands': []})
+    # キャッシュの再検証でクエリを発行することがあるため、同期処理として実行する
+    group = await sync_to_async(masters.group)('brand', maker_id)
+    brands = [{'id': brand.id, 'name': brand.name} for brand in group]
+    return JsonResponse({'brands': brands})
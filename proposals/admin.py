@@ -1,6 +1,6 @@
 # proposals/admin.py
 from django.contrib import admin
-from .models import Customer, Proposal
+from .models import Customer, Proposal, ProposalSnapshot, ExportJob
 
 
 @admin.register(Customer)
@@ -17,4 +17,20 @@ class ProposalAdmin(admin.ModelAdmin):
     list_filter = ('status', 'customer', 'proposal_date', 'created_at')
     search_fields = ('title', 'customer__name', 'shelf__name')
     readonly_fields = ('created_at', 'updated_at')
-    date_hierarchy = 'proposal_date'
\ No newline at end of file
+    date_hierarchy = 'proposal_date'
+
+
+@admin.register(ProposalSnapshot)
+class ProposalSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('proposal', 'version', 'shelf_version', 'note', 'created_at')
+    list_filter = ('created_at',)
+    search_fields = ('proposal__title', 'note')
+    readonly_fields = ('proposal', 'version', 'shelf_version', 'layout', 'created_at', 'created_by')
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('proposal', 'kind', 'status', 'attempts', 'created_at', 'finished_at', 'expires_at')
+    list_filter = ('kind', 'status', 'created_at')
+    search_fields = ('proposal__title', 'filename')
+    readonly_fields = ('content_key', 'result_path', 'error', 'created_at', 'started_at', 'finished_at')
@@ -1,6 +1,7 @@
 # ==================== proposals/forms.py ====================
 
 from django import forms
+from products.forms import MasterChoiceField
 from .models import Proposal, Customer
 from shelves.models import Shelf
 
@@ -20,6 +21,7 @@ class ProposalForm(forms.ModelForm):
             'status': forms.Select(attrs={'class': 'form-select'}),
             'description': forms.Textarea(attrs={'class': 'form-control', 'rows': 4}),
         }
+        field_classes = {'customer': MasterChoiceField}
 
 
 class CustomerForm(forms.ModelForm):
@@ -52,7 +54,7 @@ class ProposalSearchForm(forms.Form):
         required=False,
         widget=forms.Select(attrs={'class': 'form-select'})
     )
-    customer = forms.ModelChoiceField(
+    customer = MasterChoiceField(
         queryset=Customer.objects.all(),
         required=False,
         empty_label='すべて',
@@ -0,0 +1,247 @@
+# proposals/management/commands/generate_scale_data.py
+
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from products.models import Maker, Brand, Category, Product
+from products.services import masters, search
+from shelves.models import Shelf, ShelfPlacement
+from shelves.services.stats import rebuild_shelf_stats
+from proposals.models import Customer, Proposal
+from proposals.services import dashboard
+
+
+# 生成データのJANコードは店内用の先頭2桁（20〜29のうち29）を使い、実在の商品と重ならないようにする
+JAN_PREFIX = '29'
+
+CATEGORY_NAMES = ['飲料', '菓子', '日用品', '化粧品', '食品', '冷凍食品', 'パン', '酒類', '調味料', '乳製品']
+SUBCATEGORY_NAMES = ['定番', '季節', '大容量', '小容量', 'プレミアム', 'お徳用', '限定', 'PB']
+PRODUCT_WORDS = ['オリジナル', 'ライト', 'ゼロ', 'プレミアム', 'まろやか', '濃厚', 'すっきり', '和風', 'スパイシー', 'レモン']
+SIZES = ['100g', '200g', '350ml', '500ml', '1L', '2L', '6個入', '12個入']
+# 商品寸法（幅, 高さ, 奥行）の代表値と出現比率
+PACKAGES = [
+    ((6.5, 20.5, 6.5), 5),
+    ((4.5, 12.0, 4.5), 3),
+    ((9.0, 31.0, 9.0), 2),
+    ((15.0, 22.0, 4.0), 3),
+    ((25.0, 35.0, 8.0), 1),
+]
+
+
+def jan_code(number):
+    """通し番号から13桁のJANコード（チェックデジット付き）を作る"""
+    body = f'{JAN_PREFIX}{number:010d}'
+    total = sum(int(ch) * (3 if i % 2 == 0 else 1) for i, ch in enumerate(reversed(body)))
+    return body + str((10 - total % 10) % 10)
+
+
+class Command(BaseCommand):
+    help = '負荷試験用の大量データ（メーカー・商品・棚・配置・提案）を一括作成します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=200000, help='商品数')
+        parser.add_argument('--makers', type=int, default=300, help='メーカー数')
+        parser.add_argument('--brands-per-maker', type=int, default=4, help='メーカーあたりのブランド数')
+        parser.add_argument('--shelves', type=int, default=5000, help='棚数')
+        parser.add_argument('--rows', type=int, default=20, help='棚の段数')
+        parser.add_argument('--columns', type=int, default=20, help='棚の列数')
+        parser.add_argument('--fill', type=float, default=0.8, help='棚のセルを埋める割合（0〜1）')
+        parser.add_argument('--customers', type=int, default=500, help='得意先数')
+        parser.add_argument('--proposals', type=int, default=20000, help='提案数')
+        parser.add_argument('--own-ratio', type=float, default=0.3, help='自社メーカーの割合（0〜1）')
+        parser.add_argument('--seed', type=int, default=0, help='乱数のシード（同じ値なら同じデータになる）')
+        parser.add_argument('--batch-size', type=int, default=5000, help='一括作成の件数')
+        parser.add_argument('--skip-index', action='store_true', help='検索インデックスを作成しない')
+
+    def handle(self, *args, **options):
+        if not 0 <= options['fill'] <= 1 or not 0 <= options['own_ratio'] <= 1:
+            raise CommandError('--fill と --own-ratio は0〜1で指定してください')
+        if not (1 <= options['rows'] <= 20 and 1 <= options['columns'] <= 20):
+            raise CommandError('--rows と --columns は1〜20で指定してください')
+
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        # 生成済みの最大の番号の続きから採番し、繰り返し実行してもJANコード・名前が重複しないようにする
+        self.code_offset = self._next_code_number()
+        self.run_label = timezone.localtime().strftime('%y%m%d%H%M%S')
+
+        started = time.monotonic()
+        steps = [
+            ('マスタ', lambda: self._create_masters(options)),
+            ('商品', lambda: self._create_products(options['products'])),
+            ('棚・配置', lambda: self._create_shelves(options)),
+            ('提案', lambda: self._create_proposals(options)),
+        ]
+        for label, step in steps:
+            step_started = time.monotonic()
+            with transaction.atomic():
+                count = step()
+            self.stdout.write(f'{label}: {count} 件（{time.monotonic() - step_started:.1f}秒）')
+
+        if not options['skip_index']:
+            step_started = time.monotonic()
+            for kind, object_ids in (('product', self.product_ids), ('shelf', self.shelf_ids), ('proposal', self.proposal_ids)):
+                search.index_objects(kind, object_ids)
+            self.stdout.write(f'検索インデックス（{time.monotonic() - step_started:.1f}秒）')
+
+        masters.invalidate(*masters.registered_kinds())
+        dashboard.invalidate()
+        self.stdout.write(self.style.SUCCESS(f'完了しました（{time.monotonic() - started:.1f}秒）'))
+
+    def _next_code_number(self):
+        """jan_code で作られた形式（接頭辞 + 10桁の番号 + チェックデジット）のコードのうち最大の番号の次"""
+        last_code = Product.objects.filter(
+            product_code__regex=rf'^{JAN_PREFIX}[0-9]{{11}}$'
+        ).aggregate(last=Max('product_code'))['last']
+        return int(last_code[len(JAN_PREFIX):-1]) + 1 if last_code else 0
+
+    def _label(self, prefix, number):
+        return f'{prefix}{self.run_label}-{number}'
+
+    def _create_masters(self, options):
+        makers = Maker.objects.bulk_create(
+            [Maker(name=self._label('メーカー', i)) for i in range(options['makers'])], batch_size=self.batch_size,
+        )
+        own_count = max(1, round(len(makers) * options['own_ratio']))
+        self.own_maker_ids = {maker.pk for maker in makers[:own_count]}
+        self.makers = makers
+        brands = Brand.objects.bulk_create(
+            [
+                Brand(maker=maker, name=self._label('ブランド', f'{maker.pk}-{i}'))
+                for maker in makers
+                for i in range(options['brands_per_maker'])
+            ],
+            batch_size=self.batch_size,
+        )
+        self.brands_by_maker = {}
+        for brand in brands:
+            self.brands_by_maker.setdefault(brand.maker_id, []).append(brand.pk)
+
+        # カテゴリは2階層（path 等は rebuild_paths でまとめて設定する）
+        parents = Category.objects.bulk_create([Category(name=f'{name}（{self.run_label}）') for name in CATEGORY_NAMES])
+        children = Category.objects.bulk_create([
+            Category(name=name, parent=parent) for parent in parents for name in SUBCATEGORY_NAMES
+        ])
+        Category.rebuild_paths()
+        self.category_ids = [category.pk for category in children]
+
+        customers = Customer.objects.bulk_create(
+            [Customer(name=self._label('得意先', i)) for i in range(options['customers'])], batch_size=self.batch_size,
+        )
+        self.customer_ids = [customer.pk for customer in customers]
+        return len(makers) + len(brands) + len(parents) + len(children) + len(customers)
+
+    def _insert(self, model, field_names, rows):
+        """プレースホルダ付きINSERTの executemany で登録（モデルインスタンスを経由しない）"""
+        opts = model._meta
+        qn = connection.ops.quote_name
+        columns = [opts.get_field(name).column for name in field_names]
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            qn(opts.db_table), ', '.join(qn(column) for column in columns), ', '.join(['%s'] * len(columns)),
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+
+    def _db_value(self, model, field_name, value):
+        return model._meta.get_field(field_name).get_db_prep_save(value, connection)
+
+    def _create_products(self, count):
+        packages = [package for package, _ in PACKAGES]
+        weights = [weight for _, weight in PACKAGES]
+        prices = [self._db_value(Product, 'price', Decimal(price)) for price in range(80, 2000, 10)]
+        # 作成日時は1件ずつずらす（実データと同じく一覧の並び順 (created_at, id) の先頭列で行が絞り込めるようにする）
+        started = timezone.now() - timedelta(seconds=count)
+        rng = self.random
+        fields = [
+            'product_name', 'product_code', 'maker', 'brand', 'category', 'size', 'price',
+            'width', 'height', 'depth', 'is_own_product', 'is_active', 'created_at', 'updated_at',
+        ]
+        self.product_ids = []
+        for start in range(0, count, self.batch_size):
+            rows = []
+            for number in range(start, min(start + self.batch_size, count)):
+                maker = rng.choice(self.makers)
+                created_at = self._db_value(Product, 'created_at', started + timedelta(seconds=number))
+                width, height, depth = rng.choices(packages, weights)[0]
+                brand_ids = self.brands_by_maker.get(maker.pk)
+                rows.append((
+                    f'{maker.name} {rng.choice(PRODUCT_WORDS)} {number}',
+                    jan_code(self.code_offset + number),
+                    maker.pk,
+                    rng.choice(brand_ids) if brand_ids and rng.random() < 0.8 else None,
+                    rng.choice(self.category_ids),
+                    rng.choice(SIZES),
+                    rng.choice(prices),
+                    width, height, depth,
+                    maker.pk in self.own_maker_ids,
+                    True, created_at, created_at,
+                ))
+            self._insert(Product, fields, rows)
+            # 登録したJANコード（一意）で、このバッチで作成した商品のIDを引く
+            self.product_ids.extend(Product.objects.filter(
+                product_code__in=[row[1] for row in rows]
+            ).order_by('pk').values_list('pk', flat=True))
+        return len(self.product_ids)
+
+    def _create_shelves(self, options):
+        rows, columns = options['rows'], options['columns']
+        shelves = []
+        for start in range(0, options['shelves'], self.batch_size):
+            shelves.extend(Shelf.objects.bulk_create([
+                Shelf(name=self._label('棚', i), width=columns * 10.0, height=rows * 10.0, depth=45, rows=rows, columns=columns)
+                for i in range(start, min(start + self.batch_size, options['shelves']))
+            ]))
+        self.shelf_ids = [shelf.pk for shelf in shelves]
+
+        # 棚ごとに商品を行順に並べ、fill の割合でセルを埋める（一部は2列占有）
+        rng = self.random
+        fields = ['shelf', 'product', 'row', 'column', 'face_count', 'span_rows', 'span_columns', 'created_at']
+        now = self._db_value(ShelfPlacement, 'created_at', timezone.now())
+        placements = []
+        created = 0
+        for shelf_id in self.shelf_ids:
+            for row in range(rows):
+                column = 0
+                while column < columns:
+                    span_columns = 2 if column + 1 < columns and rng.random() < 0.15 else 1
+                    if rng.random() < options['fill']:
+                        placements.append((
+                            shelf_id, rng.choice(self.product_ids), row, column,
+                            rng.randint(1, 3 * span_columns), 1, span_columns, now,
+                        ))
+                    column += span_columns
+            if len(placements) >= self.batch_size:
+                self._insert(ShelfPlacement, fields, placements)
+                created += len(placements)
+                placements = []
+        self._insert(ShelfPlacement, fields, placements)
+        created += len(placements)
+
+        rebuild_shelf_stats(self.shelf_ids, batch_size=self.batch_size)
+        return len(shelves) + created
+
+    def _create_proposals(self, options):
+        rng = self.random
+        statuses = [status for status, _ in Proposal.STATUS_CHOICES]
+        today = timezone.localdate()
+        self.proposal_ids = []
+        for start in range(0, options['proposals'], self.batch_size):
+            batch = [
+                Proposal(
+                    title=self._label('提案', i),
+                    customer_id=rng.choice(self.customer_ids),
+                    shelf_id=rng.choice(self.shelf_ids),
+                    sales_rep=f'担当{rng.randrange(50)}',
+                    proposal_date=today - timedelta(days=rng.randrange(365)),
+                    status=rng.choice(statuses),
+                )
+                for i in range(start, min(start + self.batch_size, options['proposals']))
+            ]
+            self.proposal_ids.extend(proposal.pk for proposal in Proposal.objects.bulk_create(batch))
+        return len(self.proposal_ids)
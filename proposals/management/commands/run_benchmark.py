@@ -0,0 +1,367 @@
+# proposals/management/commands/run_benchmark.py
+
+import asyncio
+import json
+import random
+import statistics
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+from django.urls import reverse
+from django.utils import timezone
+from products.models import Product
+from shelves.models import Shelf, ShelfPlacement
+from proposals.models import Proposal
+from config.metrics import record_queries
+from config.pagination import encode_cursor
+
+
+# 比較の基準にする指標（--baseline と比べて悪化率を判定する）
+COMPARED_METRICS = ('p95_ms', 'queries_mean')
+
+
+def _percentile(values, fraction):
+    """最近傍順位法によるパーセンタイル"""
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+# 計測項目（名前, 書き込みを伴うか）。各項目は Command._scenario_<名前>(rng) のジェネレーターで、
+# リクエスト (メソッド, URL, 引数) を yield するとレスポンスが返される（1回分のレイテンシは全リクエストの合計）
+SCENARIOS = [
+    ('product_list', False),
+    ('product_list_deep', False),
+    ('product_search', False),
+    ('product_palette', False),
+    ('shelf_detail', False),
+    ('proposal_detail', False),
+    ('export_excel', False),
+    ('export_pdf', False),
+    ('simulate', False),
+    ('batch_placement', True),
+    ('editor', True),
+]
+
+
+class HostAsyncClient(AsyncClient):
+    """Host ヘッダーを指定できる AsyncClient
+
+    AsyncClient は Host: testserver を常に付けるため、headers で渡しても置き換わらず
+    ALLOWED_HOSTS の検査で 400 になる。スコープの Host とサーバー名を差し替える。
+    """
+
+    def __init__(self, host, **kwargs):
+        super().__init__(**kwargs)
+        self.host = host
+
+    async def request(self, **request):
+        headers = [(name, value) for name, value in request.get('headers', []) if name != b'host']
+        request['headers'] = headers + [(b'host', self.host.encode('idna'))]
+        request['server'] = (self.host, request.get('server', ('', '80'))[1])
+        return await super().request(**request)
+
+
+class Command(BaseCommand):
+    help = '主要画面・API に繰り返しリクエストを送り、レイテンシ・クエリ数・スループットを計測します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help='実行する項目（省略時はすべて。--list で一覧）')
+        parser.add_argument('--list', action='store_true', help='項目の一覧を表示する')
+        parser.add_argument('--requests', type=int, default=50, help='項目ごとのリクエスト数')
+        parser.add_argument('--warmup', type=int, default=3, help='計測前に送るリクエスト数')
+        parser.add_argument('--concurrency', type=int, default=1, help='同時に実行する数（WSGI はスレッド、ASGI はタスク）')
+        parser.add_argument('--interface', choices=['wsgi', 'asgi'], default='wsgi', help='リクエストを処理するハンドラー')
+        parser.add_argument('--seed', type=int, default=0, help='対象データを選ぶ乱数のシード')
+        parser.add_argument('--host', default='localhost', help='リクエストの Host ヘッダー')
+        parser.add_argument('--output', help='結果のJSONを書き出すファイル（省略時は標準出力）')
+        parser.add_argument('--baseline', help='比較対象の結果JSON（p95・平均クエリ数の悪化を判定する）')
+        parser.add_argument('--max-regression', type=float, default=1.2, help='許容する悪化率（基準値に対する倍率）')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        if options['list']:
+            for name, writes in SCENARIOS:
+                self.stdout.write(f'{name}{"（書き込みあり）" if writes else ""}')
+            return
+
+        names = options['scenarios'] or [name for name, _ in SCENARIOS]
+        unknown = set(names) - {name for name, _ in SCENARIOS}
+        if unknown:
+            raise CommandError(f'不明な項目です: {", ".join(sorted(unknown))}')
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests と --concurrency は1以上で指定してください')
+
+        self._prepare()
+        results = {}
+        try:
+            for name in names:
+                results[name] = self._run(getattr(self, f'_scenario_{name}'), options)
+                self.stderr.write(
+                    f'{name}: p50 {results[name]["p50_ms"]}ms / p95 {results[name]["p95_ms"]}ms / '
+                    f'{results[name]["queries_mean"]} queries / {results[name]["throughput_rps"]} req/s'
+                )
+        finally:
+            self._cleanup()
+
+        report = {
+            'started_at': timezone.now().isoformat(),
+            'revision': self._revision(),
+            'database': connection.vendor,
+            'debug': settings.DEBUG,
+            'options': {key: options[key] for key in ('requests', 'warmup', 'concurrency', 'interface', 'seed')},
+            'dataset': {
+                'products': Product.objects.count(),
+                'shelves': Shelf.objects.count(),
+                'placements': ShelfPlacement.objects.count(),
+                'proposals': Proposal.objects.count(),
+            },
+            'scenarios': results,
+        }
+        regressions = self._compare(report, options) if options['baseline'] else []
+
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output_file:
+                output_file.write(output)
+            self.stderr.write(f'{options["output"]} に書き出しました')
+        else:
+            self.stdout.write(output)
+
+        if regressions:
+            for message in regressions:
+                self.stderr.write(self.style.ERROR(message))
+            raise CommandError(f'{len(regressions)} 件の指標が基準値より悪化しました')
+
+    # ---------- 対象データ ----------
+
+    def _prepare(self):
+        """計測対象のID（読み取り）と、書き込み系の項目で使う専用の棚を用意する"""
+        self.shelf_ids = list(Shelf.objects.values_list('pk', flat=True)[:1000])
+        self.proposal_ids = list(Proposal.objects.values_list('pk', flat=True)[:1000])
+        self.product_ids = list(Product.objects.filter(is_active=True).values_list('pk', flat=True)[:1000])
+        self.maker_id = Product.objects.filter(pk__in=self.product_ids[:1]).values_list('maker_id', flat=True).first()
+        # 一覧の深いページ（全体の1/4〜末尾付近）を開くカーソル（キーセットページングは何ページ目でも同じ時間になるはず）
+        active = Product.objects.filter(is_active=True).order_by('-created_at', '-id')
+        total = active.count()
+        self.product_cursors = [
+            encode_cursor(list(active.values_list('created_at', 'id')[position]))
+            for position in sorted({int(total * fraction) for fraction in (0.25, 0.5, 0.75, 0.99)})
+            if 0 < position < total
+        ]
+        if not (self.shelf_ids and self.proposal_ids and self.product_ids):
+            raise CommandError('商品・棚・提案がありません。先に generate_scale_data を実行してください')
+        self.bench_shelf = Shelf.objects.create(
+            name='ベンチマーク用（自動削除）', width=200, height=200, depth=45, rows=20, columns=20,
+        )
+
+    def _cleanup(self):
+        self.bench_shelf.delete()
+
+    # ---------- 項目 ----------
+
+    def _scenario_product_list(self, rng):
+        yield 'get', reverse('products:product_list'), {}
+
+    def _scenario_product_list_deep(self, rng):
+        data = {'cursor': rng.choice(self.product_cursors)} if self.product_cursors else {}
+        yield 'get', reverse('products:product_list'), {'data': data}
+
+    def _scenario_product_search(self, rng):
+        yield 'get', reverse('products:product_list'), {'data': {'q': rng.choice(['オリジナル', 'ゼロ', '500ml', '濃厚'])}}
+
+    def _scenario_product_palette(self, rng):
+        yield 'get', reverse('shelves:product_palette'), {'data': {'search': rng.choice(['ライト', 'レモン'])}}
+
+    def _scenario_shelf_detail(self, rng):
+        yield 'get', reverse('shelves:shelf_detail', args=[rng.choice(self.shelf_ids)]), {}
+
+    def _scenario_proposal_detail(self, rng):
+        yield 'get', reverse('proposals:proposal_detail', args=[rng.choice(self.proposal_ids)]), {}
+
+    def _scenario_export_excel(self, rng):
+        yield 'get', reverse('proposals:export_excel', args=[rng.choice(self.proposal_ids)]), {}
+
+    def _scenario_export_pdf(self, rng):
+        yield 'get', reverse('proposals:export_pdf', args=[rng.choice(self.proposal_ids)]), {}
+
+    def _scenario_simulate(self, rng):
+        shelf_ids = rng.sample(self.shelf_ids, min(20, len(self.shelf_ids)))
+        yield 'post', reverse('shelves:simulate_shelves'), self._json({'shelf_ids': shelf_ids})
+
+    def _scenario_batch_placement(self, rng):
+        # 1件配置してすぐに外す（棚の状態を変えずに書き込みを計測する）
+        url = reverse('shelves:batch_update_placements')
+        response = yield 'post', url, self._json({
+            'shelf_id': self.bench_shelf.pk,
+            'operations': [{'op': 'place', 'product_id': rng.choice(self.product_ids), **self._cell(rng)}],
+        })
+        removals = [{'op': 'remove', 'placement_id': placement['id']} for placement in response.json().get('changed', [])]
+        if removals:
+            yield 'post', url, self._json({'shelf_id': self.bench_shelf.pk, 'operations': removals})
+
+    def _scenario_editor(self, rng):
+        # 棚編集画面の操作1回分（パレット検索 → ブランド取得 → 配置 → フェース数変更 → 削除）
+        yield 'get', reverse('shelves:product_palette'), {'data': {'page': rng.randint(1, 5)}}
+        yield 'get', reverse('products:get_brands_by_maker'), {'data': {'maker_id': self.maker_id}}
+        response = yield 'post', reverse('shelves:place_product'), {'data': {
+            'shelf_id': self.bench_shelf.pk, 'product_id': rng.choice(self.product_ids), **self._cell(rng),
+        }}
+        placement = response.json().get('placement')
+        if placement:
+            yield 'post', reverse('shelves:update_face_count'), {'data': {'placement_id': placement['id'], 'face_count': 2}}
+            yield 'post', reverse('shelves:remove_product'), {'data': {'placement_id': placement['id']}}
+
+    def _json(self, payload):
+        return {'data': json.dumps(payload), 'content_type': 'application/json'}
+
+    def _cell(self, rng):
+        return {'row': rng.randrange(self.bench_shelf.rows), 'column': rng.randrange(self.bench_shelf.columns)}
+
+    # ---------- 実行 ----------
+
+    def _make_client(self, options):
+        if options['interface'] == 'asgi':
+            return HostAsyncClient(options['host'])
+        return Client(headers={'host': options['host']})
+
+    def _request(self, scenario, client, rng):
+        """項目を1回実行して (レイテンシ, クエリ数, 最大のステータス) を返す
+
+        エラー応答（4xx/5xx）を受けたらその回の残りのリクエストは送らず、エラーとして数える。
+        """
+        status = 0
+        with record_queries() as recorder:
+            started = time.perf_counter()
+            requests = scenario(rng)
+            try:
+                method, url, kwargs = next(requests)
+                while True:
+                    response = getattr(client, method)(url, **kwargs)
+                    if getattr(response, 'streaming', False):
+                        b''.join(response.streaming_content)
+                    status = max(status, response.status_code)
+                    if response.status_code >= 400:
+                        requests.close()
+                        break
+                    method, url, kwargs = requests.send(response)
+            except StopIteration:
+                pass
+            elapsed_ms = (time.perf_counter() - started) * 1000
+        return elapsed_ms, recorder.count, status
+
+    async def _arequest(self, scenario, client, rng):
+        """_request の ASGI 版"""
+        status = 0
+        with record_queries() as recorder:
+            started = time.perf_counter()
+            requests = scenario(rng)
+            try:
+                method, url, kwargs = next(requests)
+                while True:
+                    response = await getattr(client, method)(url, **kwargs)
+                    if getattr(response, 'streaming', False):
+                        if response.is_async:
+                            async for _ in response.streaming_content:
+                                pass
+                        else:
+                            b''.join(response.streaming_content)
+                    status = max(status, response.status_code)
+                    if response.status_code >= 400:
+                        requests.close()
+                        break
+                    method, url, kwargs = requests.send(response)
+            except StopIteration:
+                pass
+            elapsed_ms = (time.perf_counter() - started) * 1000
+        return elapsed_ms, recorder.count, status
+
+    def _worker(self, scenario, count, seed, options):
+        client = self._make_client(options)
+        rng = random.Random(seed)
+        try:
+            return [self._request(scenario, client, rng) for _ in range(count)]
+        finally:
+            # スレッドごとに開いた接続を閉じる
+            connections.close_all()
+
+    async def _aworker(self, scenario, count, seed, options):
+        client = self._make_client(options)
+        rng = random.Random(seed)
+        return [await self._arequest(scenario, client, rng) for _ in range(count)]
+
+    async def _arun(self, scenario, counts, seeds, options):
+        await self._aworker(scenario, options['warmup'], self.rng.randrange(1 << 30), options)
+        started = time.perf_counter()
+        batches = await asyncio.gather(*(
+            self._aworker(scenario, count, seed, options) for count, seed in zip(counts, seeds)
+        ))
+        return [sample for batch in batches for sample in batch], time.perf_counter() - started
+
+    def _run(self, scenario, options):
+        concurrency = options['concurrency']
+        counts = [options['requests'] // concurrency + (i < options['requests'] % concurrency) for i in range(concurrency)]
+        seeds = [self.rng.randrange(1 << 30) for _ in counts]
+        if options['interface'] == 'asgi':
+            samples, wall = asyncio.run(self._arun(scenario, counts, seeds, options))
+        else:
+            self._worker(scenario, options['warmup'], self.rng.randrange(1 << 30), options)
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                batches = executor.map(lambda args: self._worker(scenario, *args, options), zip(counts, seeds))
+                samples = [sample for batch in batches for sample in batch]
+            wall = time.perf_counter() - started
+
+        durations = [ms for ms, _, _ in samples]
+        queries = [count for _, count, _ in samples]
+        errors = sum(1 for _, _, status in samples if status >= 400)
+        return {
+            'requests': len(samples),
+            'errors': errors,
+            'mean_ms': round(statistics.fmean(durations), 2),
+            'p50_ms': round(_percentile(durations, 0.50), 2),
+            'p95_ms': round(_percentile(durations, 0.95), 2),
+            'p99_ms': round(_percentile(durations, 0.99), 2),
+            'max_ms': round(max(durations), 2),
+            'queries_mean': round(statistics.fmean(queries), 2),
+            'queries_max': max(queries),
+            'throughput_rps': round(len(samples) / wall, 1) if wall else None,
+        }
+
+    # ---------- 比較 ----------
+
+    def _compare(self, report, options):
+        try:
+            with open(options['baseline'], encoding='utf-8') as baseline_file:
+                baseline = json.load(baseline_file)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'基準の結果を読み込めません: {e}')
+
+        regressions = []
+        for name, result in report['scenarios'].items():
+            previous = baseline.get('scenarios', {}).get(name)
+            if not previous:
+                continue
+            result['baseline'] = {}
+            for metric in COMPARED_METRICS:
+                before, after = previous.get(metric), result[metric]
+                if not before:
+                    continue
+                ratio = round(after / before, 2)
+                result['baseline'][metric] = {'value': before, 'ratio': ratio}
+                if ratio > options['max_regression']:
+                    regressions.append(f'{name}: {metric} {before} → {after}（{ratio}倍）')
+        return regressions
+
+    def _revision(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, timeout=5,
+            ).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            return None
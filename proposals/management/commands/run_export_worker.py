@@ -0,0 +1,116 @@
+# proposals/management/commands/run_export_worker.py
+
+import multiprocessing
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from proposals.services import jobs
+from proposals.services.export import init_render_process, render_export
+from proposals.services.pdf import cleanup_pdf_cache
+
+
+class Command(BaseCommand):
+    help = '提案書の出力ジョブ（PDF・Excel・CSV）を処理します（生成は子プロセスで並列に行います）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2, help='生成に使う子プロセス数')
+        parser.add_argument('--poll', type=float, default=1.0, help='待機中のジョブを確認する間隔（秒）')
+        parser.add_argument('--cleanup-interval', type=float, default=600, help='期限切れの結果を削除する間隔（秒）')
+        parser.add_argument('--once', action='store_true', help='待機中のジョブを処理し終えたら終了する')
+
+    def handle(self, *args, **options):
+        if options['processes'] < 1:
+            raise CommandError('--processes は1以上で指定してください')
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        processes = options['processes']
+        running = {}
+        next_cleanup = 0.0
+        self.broken = False
+        pool = self._new_pool(processes)
+        try:
+            while True:
+                close_old_connections()
+                if time.monotonic() >= next_cleanup:
+                    self._cleanup()
+                    next_cleanup = time.monotonic() + options['cleanup_interval']
+
+                if self.broken and not running:
+                    # 子プロセスが異常終了するとプールが使えなくなるため作り直す
+                    pool.shutdown(wait=False)
+                    pool = self._new_pool(processes)
+                    self.broken = False
+
+                while not self.stopping and not self.broken and len(running) < processes:
+                    job = jobs.claim_next()
+                    if job is None:
+                        break
+                    self._submit(pool, running, job)
+
+                if not running:
+                    if self.stopping or (options['once'] and not self.broken):
+                        break
+                    if not self.broken:
+                        time.sleep(options['poll'])
+                    continue
+
+                done, _ = wait(running, timeout=options['poll'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    job, path, started = running.pop(future)
+                    self._finish(job, path, future, started)
+        finally:
+            pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS('出力ワーカーを終了しました'))
+
+    def _new_pool(self, processes):
+        return ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_render_process,
+        )
+
+    def _stop(self, signum, frame):
+        # 処理中のジョブを終えてから終了する
+        self.stopping = True
+
+    def _submit(self, pool, running, job):
+        try:
+            kind, data, base_url = jobs.prepare(job)
+        except Exception as e:
+            jobs.fail(job, e)
+            return
+        path = jobs.result_path(job)
+        try:
+            future = pool.submit(render_export, kind, data, base_url, str(path))
+        except BrokenProcessPool as e:
+            self.broken = True
+            jobs.fail(job, e)
+            return
+        running[future] = (job, path, time.monotonic())
+
+    def _finish(self, job, path, future, started):
+        try:
+            output_format = future.result()
+        except Exception as e:
+            self.broken = self.broken or isinstance(e, BrokenProcessPool)
+            jobs.fail(job, e)
+            self.stderr.write(f'ジョブ {job.pk} が失敗しました: {e}')
+            return
+        jobs.complete(job, path, output_format)
+        self.stdout.write(f'ジョブ {job.pk}（{job.kind}）を出力しました（{time.monotonic() - started:.1f}秒）')
+
+    def _cleanup(self):
+        requeued = jobs.requeue_stale()
+        removed = jobs.cleanup_expired()
+        # 画面からの PDF 出力のキャッシュ（棚の版ごとに増える）も、使われなくなったものを削除する
+        pdf_removed = cleanup_pdf_cache()
+        if requeued or removed or pdf_removed:
+            self.stdout.write(f'再登録 {requeued} 件 / 期限切れの削除 {removed} 件 / PDFキャッシュの削除 {pdf_removed} 件')
@@ -0,0 +1,219 @@
+# proposals/management/commands/run_sqlite_benchmark.py
+
+import json
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from config.database import get_config, is_locked_error, pragma_statements, retry_delays
+
+
+# 比較する設定: Django の既定（ロールバックジャーナル・BEGIN DEFERRED・再試行なし）と config/database.py の設定
+MODES = ('default', 'tuned')
+
+SCHEMA = [
+    'CREATE TABLE shelf (id INTEGER PRIMARY KEY, version INTEGER NOT NULL DEFAULT 1, placement_count INTEGER NOT NULL DEFAULT 0)',
+    'CREATE TABLE placement (id INTEGER PRIMARY KEY, shelf_id INTEGER NOT NULL, "row" INTEGER NOT NULL, "column" INTEGER NOT NULL, '
+    'product_id INTEGER NOT NULL, face_count INTEGER NOT NULL, UNIQUE (shelf_id, "row", "column"))',
+    'CREATE INDEX placement_shelf ON placement (shelf_id)',
+]
+
+
+def _percentile(values, fraction):
+    """最近傍順位法によるパーセンタイル"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'SQLite の同時書き込み性能を、Django の既定設定と config/database.py の設定（WAL・BEGIN IMMEDIATE・再試行）で比較します'
+        '（一時ファイルのデータベースに、棚の編集と同じ形の読み書きを複数スレッドから行います）'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=16, help='書き込みスレッド数（同時に編集する担当者）')
+        parser.add_argument('--readers', type=int, default=8, help='読み取りスレッド数（棚画面の表示）')
+        parser.add_argument('--duration', type=float, default=10.0, help='設定ごとの計測時間（秒）')
+        parser.add_argument('--shelves', type=int, default=20, help='棚数（少ないほど同じ棚への書き込みが重なる）')
+        parser.add_argument('--rows', type=int, default=10, help='棚の段数')
+        parser.add_argument('--columns', type=int, default=20, help='棚の列数')
+        parser.add_argument('--mode', choices=MODES, action='append', help='計測する設定（複数指定可。既定は両方）')
+        parser.add_argument('--output', help='結果をJSONで書き出すファイル')
+        parser.add_argument('--seed', type=int, default=0, help='乱数のシード')
+
+    def handle(self, *args, **options):
+        if options['writers'] < 1 or options['readers'] < 0 or options['duration'] <= 0:
+            raise CommandError('--writers は1以上、--readers は0以上、--duration は正の値で指定してください')
+
+        results = {}
+        for mode in options['mode'] or MODES:
+            with tempfile.TemporaryDirectory() as directory:
+                path = str(Path(directory) / 'benchmark.sqlite3')
+                self._create(path, mode, options)
+                results[mode] = self._run(path, mode, options)
+            self._print(mode, results[mode])
+
+        if {'default', 'tuned'} <= results.keys():
+            default, tuned = results['default'], results['tuned']
+            if default['writes_per_second']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"書き込みスループット {tuned['writes_per_second'] / default['writes_per_second']:.1f}倍 / "
+                    f"エラー {default['write_errors']} → {tuned['write_errors']} 件"
+                ))
+
+        if options['output']:
+            Path(options['output']).write_text(json.dumps({
+                'options': {key: options[key] for key in ('writers', 'readers', 'duration', 'shelves', 'rows', 'columns')},
+                'sqlite_tuning': {key: value for key, value in get_config().items()},
+                'modes': results,
+            }, ensure_ascii=False, indent=2))
+            self.stdout.write(f"結果を {options['output']} に書き出しました")
+
+    def _connect(self, path, mode):
+        # Django と同じく自動コミットで接続し、トランザクションは BEGIN で明示的に開始する
+        connection = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        if mode == 'tuned':
+            for statement in pragma_statements():
+                connection.execute(statement)
+        return connection
+
+    def _create(self, path, mode, options):
+        connection = self._connect(path, mode)
+        connection.execute('BEGIN')
+        for statement in SCHEMA:
+            connection.execute(statement)
+        rng = random.Random(options['seed'])
+        rows, columns = options['rows'], options['columns']
+        for shelf_id in range(1, options['shelves'] + 1):
+            cells = [(r, c) for r in range(rows) for c in range(columns) if rng.random() < 0.6]
+            connection.execute('INSERT INTO shelf (id, placement_count) VALUES (?, ?)', (shelf_id, len(cells)))
+            connection.executemany(
+                'INSERT INTO placement (shelf_id, "row", "column", product_id, face_count) VALUES (?, ?, ?, ?, ?)',
+                [(shelf_id, r, c, rng.randrange(1, 10000), rng.randint(1, 3)) for r, c in cells],
+            )
+        connection.execute('COMMIT')
+        connection.close()
+
+    def _edit(self, connection, mode, rng, options):
+        """棚の編集1回分（配置を読み込み、空きセルへの配置または既存配置の削除と、統計・バージョンの更新）"""
+        shelf_id = rng.randint(1, options['shelves'])
+        connection.execute('BEGIN IMMEDIATE' if mode == 'tuned' else 'BEGIN')
+        try:
+            occupied = connection.execute(
+                'SELECT id, "row", "column" FROM placement WHERE shelf_id = ?', (shelf_id,)
+            ).fetchall()
+            taken = {(row, column) for _, row, column in occupied}
+            free = [
+                (row, column)
+                for row in range(options['rows']) for column in range(options['columns'])
+                if (row, column) not in taken
+            ]
+            if free and (not occupied or rng.random() < 0.5):
+                row, column = rng.choice(free)
+                connection.execute(
+                    'INSERT INTO placement (shelf_id, "row", "column", product_id, face_count) VALUES (?, ?, ?, ?, 1)',
+                    (shelf_id, row, column, rng.randrange(1, 10000)),
+                )
+                delta = 1
+            else:
+                connection.execute('DELETE FROM placement WHERE id = ?', (rng.choice(occupied)[0],))
+                delta = -1
+            connection.execute(
+                'UPDATE shelf SET placement_count = placement_count + ?, version = version + 1 WHERE id = ?',
+                (delta, shelf_id),
+            )
+            connection.execute('COMMIT')
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            raise
+
+    def _writer(self, path, mode, options, seed, deadline, stats):
+        rng = random.Random(seed)
+        connection = self._connect(path, mode)
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            delays = retry_delays() if mode == 'tuned' else iter(())
+            while True:
+                try:
+                    self._edit(connection, mode, rng, options)
+                except sqlite3.OperationalError as e:
+                    delay = next(delays, None) if is_locked_error(e) else None
+                    if delay is None:
+                        stats['write_errors'] += 1
+                        break
+                    stats['retries'] += 1
+                    time.sleep(delay)
+                    continue
+                stats['write_ms'].append((time.perf_counter() - started) * 1000)
+                break
+        connection.close()
+
+    def _reader(self, path, mode, options, seed, deadline, stats):
+        rng = random.Random(seed)
+        connection = self._connect(path, mode)
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                connection.execute(
+                    'SELECT s.version, s.placement_count, p.id, p."row", p."column", p.product_id, p.face_count '
+                    'FROM shelf s JOIN placement p ON p.shelf_id = s.id WHERE s.id = ?',
+                    (rng.randint(1, options['shelves']),),
+                ).fetchall()
+            except sqlite3.OperationalError:
+                stats['read_errors'] += 1
+                continue
+            stats['read_ms'].append((time.perf_counter() - started) * 1000)
+        connection.close()
+
+    def _run(self, path, mode, options):
+        deadline = time.monotonic() + options['duration']
+        workers = []
+        for index in range(options['writers']):
+            stats = {'write_ms': [], 'write_errors': 0, 'retries': 0}
+            workers.append((stats, threading.Thread(
+                target=self._writer, args=(path, mode, options, options['seed'] * 1000 + index, deadline, stats),
+            )))
+        for index in range(options['readers']):
+            stats = {'read_ms': [], 'read_errors': 0}
+            workers.append((stats, threading.Thread(
+                target=self._reader, args=(path, mode, options, options['seed'] * 1000 + 500 + index, deadline, stats),
+            )))
+
+        started = time.monotonic()
+        for _, thread in workers:
+            thread.start()
+        for _, thread in workers:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        write_ms = [ms for stats, _ in workers for ms in stats.get('write_ms', ())]
+        read_ms = [ms for stats, _ in workers for ms in stats.get('read_ms', ())]
+        return {
+            'writes': len(write_ms),
+            'writes_per_second': round(len(write_ms) / elapsed, 1),
+            'write_errors': sum(stats.get('write_errors', 0) for stats, _ in workers),
+            'write_retries': sum(stats.get('retries', 0) for stats, _ in workers),
+            'write_p50_ms': round(statistics.median(write_ms), 2) if write_ms else None,
+            'write_p95_ms': round(_percentile(write_ms, 0.95), 2) if write_ms else None,
+            'reads': len(read_ms),
+            'reads_per_second': round(len(read_ms) / elapsed, 1),
+            'read_errors': sum(stats.get('read_errors', 0) for stats, _ in workers),
+            'read_p95_ms': round(_percentile(read_ms, 0.95), 2) if read_ms else None,
+        }
+
+    def _print(self, mode, result):
+        self.stdout.write(
+            f"{mode:<8} 書き込み {result['writes']} 件（{result['writes_per_second']}/秒, "
+            f"p50 {result['write_p50_ms']}ms, p95 {result['write_p95_ms']}ms, "
+            f"エラー {result['write_errors']} 件, 再試行 {result['write_retries']} 回） / "
+            f"読み取り {result['reads']} 件（p95 {result['read_p95_ms']}ms, エラー {result['read_errors']} 件）"
+        )
@@ -3,7 +3,8 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
-from shelves.models import Shelf, ShelfPlacement
+from shelves.models import Shelf
+from shelves.services.stats import get_shelf_stats
 
 
 class Customer(models.Model):
@@ -44,34 +45,108 @@ class Proposal(models.Model):
     created_at = models.DateTimeField('作成日時', auto_now_add=True)
     updated_at = models.DateTimeField('更新日時', auto_now=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='作成者')
+    # 提出時に固定した最新の棚割り（下書きに戻すと現在の棚を表示する）
+    snapshot = models.ForeignKey(
+        'ProposalSnapshot', on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='+', editable=False, verbose_name='最新スナップショット'
+    )
     
     class Meta:
         verbose_name = '提案'
         verbose_name_plural = '提案'
         ordering = ['-created_at']
+        indexes = [
+            # 一覧のキーセットページング（ステータスでの絞り込みを含む）
+            models.Index(fields=['created_at', 'id'], name='proposal_created_idx'),
+            models.Index(fields=['status', 'created_at', 'id'], name='proposal_status_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.title} - {self.customer.name}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 提出時のスナップショット作成用に読み込み時のステータスを保持
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+    
+    @property
+    def is_frozen(self):
+        """スナップショットの棚割りを表示するか（提出後の提案）"""
+        return self.status != 'draft' and self.snapshot_id is not None
+    
     def get_placement_stats(self):
-        """配置統計を取得"""
-        placements = ShelfPlacement.objects.filter(shelf=self.shelf)
-        total_cells = self.shelf.total_cells
-        occupied_cells = placements.count()
-        own_products = placements.filter(product__is_own_product=True)
-        competitor_products = placements.filter(product__is_own_product=False)
-        
-        own_faces = sum(p.face_count for p in own_products)
-        competitor_faces = sum(p.face_count for p in competitor_products)
-        total_faces = own_faces + competitor_faces
-        
-        return {
-            'total_cells': total_cells,
-            'occupied_cells': occupied_cells,
-            'occupancy_rate': round((occupied_cells / total_cells) * 100, 1) if total_cells > 0 else 0,
-            'own_products_count': own_products.count(),
-            'competitor_products_count': competitor_products.count(),
-            'own_faces': own_faces,
-            'competitor_faces': competitor_faces,
-            'own_share': round((own_faces / total_faces) * 100, 1) if total_faces > 0 else 0,
-        }
\ No newline at end of file
+        """配置統計を取得（棚ごとの集計済み統計を参照）"""
+        return get_shelf_stats(self.shelf).as_dict(self.shelf.total_cells)
+
+
+class ProposalSnapshot(models.Model):
+    """提案のスナップショット（ある時点の棚割りを配置・商品情報・統計ごと固定した版）"""
+    proposal = models.ForeignKey(Proposal, on_delete=models.CASCADE, related_name='snapshots', verbose_name='提案')
+    version = models.PositiveIntegerField('版')
+    shelf_version = models.PositiveBigIntegerField('棚バージョン')
+    layout = models.JSONField('棚割りデータ')
+    note = models.CharField('メモ', max_length=200, blank=True)
+    created_at = models.DateTimeField('作成日時', auto_now_add=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='作成者')
+    
+    class Meta:
+        verbose_name = '提案スナップショット'
+        verbose_name_plural = '提案スナップショット'
+        ordering = ['-version']
+        unique_together = ['proposal', 'version']
+    
+    def __str__(self):
+        return f"{self.proposal_id} 第{self.version}版"
+
+
+class ExportJob(models.Model):
+    """提案書の出力ジョブ（run_export_worker が処理し、結果ファイルを保存期間まで保持する）"""
+    KIND_CHOICES = [
+        ('pdf', 'PDF'),
+        ('xlsx', 'Excel'),
+        ('csv', 'CSV'),
+    ]
+    STATUS_CHOICES = [
+        ('queued', '待機中'),
+        ('running', '処理中'),
+        ('done', '完了'),
+        ('failed', '失敗'),
+    ]
+    
+    proposal = models.ForeignKey(Proposal, on_delete=models.CASCADE, related_name='export_jobs', verbose_name='提案')
+    snapshot = models.ForeignKey(
+        ProposalSnapshot, on_delete=models.CASCADE, null=True, blank=True, related_name='+', verbose_name='スナップショット'
+    )
+    kind = models.CharField('形式', max_length=10, choices=KIND_CHOICES)
+    status = models.CharField('状態', max_length=10, choices=STATUS_CHOICES, default='queued')
+    # 提案の状態・棚割りの版・形式のハッシュ（同じ内容の出力依頼は同じジョブを返す）
+    content_key = models.CharField('内容キー', max_length=64)
+    base_url = models.CharField('基準URL', max_length=200, blank=True)
+    attempts = models.PositiveSmallIntegerField('試行回数', default=0)
+    result_path = models.CharField('結果ファイル', max_length=255, blank=True)
+    filename = models.CharField('ファイル名', max_length=255, blank=True)
+    content_type = models.CharField('Content-Type', max_length=100, blank=True)
+    error = models.TextField('エラー', blank=True)
+    created_at = models.DateTimeField('作成日時', auto_now_add=True)
+    started_at = models.DateTimeField('開始日時', null=True, blank=True)
+    finished_at = models.DateTimeField('完了日時', null=True, blank=True)
+    expires_at = models.DateTimeField('保存期限', null=True, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='作成者')
+    
+    class Meta:
+        verbose_name = '出力ジョブ'
+        verbose_name_plural = '出力ジョブ'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['content_key', 'status']),
+        ]
+    
+    def __str__(self):
+        return f"{self.proposal_id} {self.get_kind_display()} ({self.get_status_display()})"
+    
+    @property
+    def is_finished(self):
+        return self.status in ('done', 'failed')
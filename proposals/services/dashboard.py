@@ -0,0 +1,100 @@
+# ==================== proposals/services/dashboard.py ====================
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+
+from products.models import Product
+from shelves.models import Shelf
+from proposals.models import Proposal
+
+
+DASHBOARD_CACHE_KEY = 'dashboard:summary'
+# 書き込み時にも破棄するが、シグナルを経由しない一括更新に備えて短めにする
+DASHBOARD_CACHE_TIMEOUT = 60
+RECENT_PRODUCTS_COUNT = 5
+
+
+def _percent(part, total):
+    return round((part / total) * 100, 1) if total else 0
+
+
+def product_summary():
+    """商品数（総数・自社・競合）を1クエリで集計"""
+    return Product.objects.filter(is_active=True).aggregate(
+        total_products=Count('id'),
+        own_products=Count('id', filter=Q(is_own_product=True)),
+        competitor_products=Count('id', filter=Q(is_own_product=False)),
+    )
+
+
+def shelf_summary():
+    """棚数・セル占有・フェースシェアを棚ごとの統計から1クエリで集計"""
+    totals = Shelf.objects.aggregate(
+        shelf_count=Count('id'),
+        total_cells=Sum(F('rows') * F('columns')),
+        occupied_cells=Sum('stats__occupied_cells'),
+        own_faces=Sum('stats__own_faces'),
+        competitor_faces=Sum('stats__competitor_faces'),
+    )
+    totals = {key: value or 0 for key, value in totals.items()}
+    total_faces = totals['own_faces'] + totals['competitor_faces']
+    totals['total_faces'] = total_faces
+    totals['occupancy_rate'] = _percent(totals['occupied_cells'], totals['total_cells'])
+    totals['own_share'] = _percent(totals['own_faces'], total_faces)
+    totals['competitor_share'] = _percent(totals['competitor_faces'], total_faces) if total_faces else 0
+    return totals
+
+
+def proposal_summary():
+    """提案数（総数・ステータス別）を1クエリで集計"""
+    totals = Proposal.objects.aggregate(
+        total_proposals=Count('id'),
+        **{status: Count('id', filter=Q(status=status)) for status, _ in Proposal.STATUS_CHOICES}
+    )
+    return {
+        'total_proposals': totals['total_proposals'],
+        'proposals_by_status': [
+            {'status': status, 'label': label, 'count': totals[status]}
+            for status, label in Proposal.STATUS_CHOICES
+        ],
+    }
+
+
+def recent_products():
+    rows = Product.objects.filter(is_active=True).order_by('-created_at').values(
+        'id', 'product_name', 'maker__name', 'is_own_product',
+    )[:RECENT_PRODUCTS_COUNT]
+    return [
+        {
+            'id': row['id'],
+            'product_name': row['product_name'],
+            'maker_name': row['maker__name'],
+            'is_own_product': row['is_own_product'],
+        }
+        for row in rows
+    ]
+
+
+def compute_summary():
+    summary = {}
+    summary.update(product_summary())
+    summary.update(shelf_summary())
+    summary.update(proposal_summary())
+    summary['recent_products'] = recent_products()
+    return summary
+
+
+def get_summary():
+    """ホーム画面の集計値（キャッシュ済みならDBを参照しない）"""
+    summary = cache.get(DASHBOARD_CACHE_KEY)
+    if summary is None:
+        summary = compute_summary()
+        cache.set(DASHBOARD_CACHE_KEY, summary, DASHBOARD_CACHE_TIMEOUT)
+    return summary
+
+
+def invalidate():
+    """集計値のキャッシュを破棄（トランザクション中はコミット後にも破棄する）"""
+    cache.delete(DASHBOARD_CACHE_KEY)
+    transaction.on_commit(lambda: cache.delete(DASHBOARD_CACHE_KEY))
@@ -0,0 +1,103 @@
+# ==================== proposals/services/export.py ====================
+
+import csv
+import signal
+import tempfile
+from pathlib import Path
+
+from .pdf import PdfUnavailable, html_to_pdf, write_atomic
+
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+EXPORT_HEADERS = ['位置', '商品名', 'JANコード', 'メーカー', 'ブランド', 'カテゴリ', 'フェース数', '区分']
+
+# レスポンスに書き出す1チャンクのバイト数
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+def placement_rows(placements):
+    """配置一覧の行を返す（画面・PDFと同じ棚グリッドの配置データを使う）"""
+    for placement in placements:
+        yield [
+            f"{placement['row']+1}段{placement['column']+1}列",
+            placement['product_name'],
+            placement['product_code'],
+            placement['maker_name'],
+            placement['brand_name'] or '-',
+            placement['category_name'],
+            placement['face_count'],
+            '自社' if placement['is_own_product'] else '競合',
+        ]
+
+
+class _Echo:
+    """csv.writer の書き込み先（書き込んだ値をそのまま返す）"""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    """CSVを1行ずつ生成"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_HEADERS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_xlsx(rows, sheet_title='商品配置一覧'):
+    """書き込み専用ワークブックでXLSXを生成し、一時ファイルからチャンク単位で返す
+
+    行はopenpyxlの書き込み専用モードでディスクへ逐次書き出すため、
+    配置件数が増えてもメモリ使用量は一定に保たれる。
+    """
+    from openpyxl import Workbook
+    
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(title=sheet_title[:31])
+    worksheet.append(EXPORT_HEADERS)
+    for row in rows:
+        worksheet.append(row)
+    
+    with tempfile.TemporaryFile() as output:
+        workbook.save(output)
+        output.seek(0)
+        while True:
+            block = output.read(STREAM_BLOCK_SIZE)
+            if not block:
+                break
+            yield block
+
+
+def init_render_process():
+    """出力ワーカーの子プロセスの初期化
+
+    子プロセスは spawn で起動する（親のDB接続を fork で引き継がない）ため、設定を読み込み直す。
+    モデルを読み込むモジュールは django.setup() の後でなければ import できないので、ここに置く。
+    """
+    import django
+    django.setup()
+    # Ctrl+C は親プロセスが受けて、処理中のジョブを終えてから終了する
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def render_export(kind, data, base_url, path):
+    """出力ファイルを生成して path に保存し、実際の形式（拡張子）を返す
+
+    DB を参照しないため、ProcessPoolExecutor の子プロセスで実行できる。
+    PDF は data に proposal_pdf.html の描画結果を、Excel・CSV は placement_rows の行を受け取る。
+    WeasyPrint が使えない環境では PDF の代わりに HTML を保存して 'html' を返す。
+    """
+    path = Path(path)
+    if kind == 'pdf':
+        try:
+            write_atomic(path, [html_to_pdf(data, base_url=base_url)])
+        except PdfUnavailable:
+            write_atomic(path, [data.encode('utf-8')])
+            return 'html'
+    elif kind == 'xlsx':
+        write_atomic(path, stream_xlsx(data))
+    else:
+        write_atomic(path, (line.encode('utf-8') for line in stream_csv(data)))
+    return kind
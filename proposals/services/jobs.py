@@ -0,0 +1,183 @@
+# ==================== proposals/services/jobs.py ====================
+
+import hashlib
+import logging
+import os
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from ..models import ExportJob, Proposal
+from . import snapshots
+from .export import XLSX_CONTENT_TYPE, placement_rows
+from .pdf import pdf_cache_key, pdf_context
+
+
+logger = logging.getLogger(__name__)
+
+# 形式ごとの (拡張子, Content-Type, ファイル名の接尾辞)
+FORMATS = {
+    'pdf': ('pdf', 'application/pdf', '提案書'),
+    'xlsx': ('xlsx', XLSX_CONTENT_TYPE, '商品配置一覧'),
+    'csv': ('csv', 'text/csv; charset=utf-8', '商品配置一覧'),
+}
+# WeasyPrint が使えない環境で PDF の代わりに出力する HTML
+HTML_FORMAT = ('html', 'text/html; charset=utf-8', '提案書')
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+def job_dir():
+    return Path(getattr(settings, 'EXPORT_JOB_DIR', Path(settings.BASE_DIR) / 'cache' / 'exports'))
+
+
+def retention():
+    """結果ファイルの保存期間"""
+    return timedelta(seconds=getattr(settings, 'EXPORT_JOB_RETENTION', 24 * 60 * 60))
+
+
+def job_timeout():
+    """処理中のままこの時間を過ぎたジョブは、ワーカーが停止したものとして再実行する"""
+    return timedelta(seconds=getattr(settings, 'EXPORT_JOB_TIMEOUT', 10 * 60))
+
+
+def max_attempts():
+    return getattr(settings, 'EXPORT_JOB_MAX_ATTEMPTS', 3)
+
+
+def content_key(proposal, snapshot, kind):
+    """提案の状態・棚割りの版・形式から出力内容のキーを求める（PDFキャッシュと同じ要素を使う）"""
+    layout_key = pdf_cache_key(proposal, snapshots.layout_version(proposal, snapshot))
+    return hashlib.sha256(f'{kind}:{layout_key}'.encode()).hexdigest()
+
+
+def enqueue(proposal, snapshot, kind, user=None, base_url=''):
+    """出力ジョブを登録して返す
+
+    同じ内容の待機中・処理中のジョブや、保存期間内の完了済みジョブがあればそれを返す。
+    """
+    if kind not in FORMATS:
+        raise ValueError(f'不明な形式です: {kind}')
+    key = content_key(proposal, snapshot, kind)
+    now = timezone.now()
+
+    for job in ExportJob.objects.filter(content_key=key, status__in=ACTIVE_STATUSES + ('done',)).order_by('-created_at'):
+        if job.status in ACTIVE_STATUSES:
+            return job
+        if job.expires_at > now and Path(job.result_path).exists():
+            return job
+
+    return ExportJob.objects.create(
+        proposal=proposal,
+        snapshot=snapshot,
+        kind=kind,
+        content_key=key,
+        base_url=base_url[:200],
+        created_by=user,
+    )
+
+
+def claim_next():
+    """最も古い待機中のジョブを処理中にして返す（無ければ None）
+
+    状態を条件にした UPDATE で取得するため、複数のワーカーが同じジョブを処理することはない。
+    """
+    while True:
+        job = ExportJob.objects.filter(status='queued').order_by('created_at', 'pk').first()
+        if job is None:
+            return None
+        now = timezone.now()
+        claimed = ExportJob.objects.filter(pk=job.pk, status='queued').update(
+            status='running', started_at=now, attempts=job.attempts + 1,
+        )
+        if claimed:
+            job.status, job.started_at, job.attempts = 'running', now, job.attempts + 1
+            return job
+
+
+def prepare(job):
+    """export.render_export に渡す入力 (形式, 入力データ, 基準URL) を作る（DB の参照はここで済ませる）"""
+    proposal = Proposal.objects.select_related('customer', 'shelf', 'snapshot').get(pk=job.proposal_id)
+    layout = snapshots.resolve_layout(proposal, job.snapshot)
+    if job.kind == 'pdf':
+        data = render_to_string('proposal_pdf.html', pdf_context(proposal, layout))
+    else:
+        data = list(placement_rows(layout.placements))
+    return job.kind, data, job.base_url or None
+
+
+def result_path(job):
+    return job_dir() / f'{job.pk}-{job.content_key[:16]}'
+
+
+def complete(job, path, output_format):
+    extension, content_type, suffix = HTML_FORMAT if output_format == 'html' else FORMATS[job.kind]
+    title = Proposal.objects.filter(pk=job.proposal_id).values_list('title', flat=True).first() or str(job.proposal_id)
+    now = timezone.now()
+    ExportJob.objects.filter(pk=job.pk).update(
+        status='done',
+        result_path=str(path),
+        filename=f'{title}_{suffix}.{extension}',
+        content_type=content_type,
+        error='',
+        finished_at=now,
+        expires_at=now + retention(),
+    )
+
+
+def fail(job, error):
+    """失敗したジョブを試行回数の上限まで再登録し、上限に達したら失敗にする"""
+    retry = job.attempts < max_attempts()
+    ExportJob.objects.filter(pk=job.pk).update(
+        status='queued' if retry else 'failed',
+        error=str(error)[:2000],
+        finished_at=None if retry else timezone.now(),
+        expires_at=None if retry else timezone.now() + retention(),
+    )
+    logger.warning('Export job %s failed (attempt %d): %s', job.pk, job.attempts, error)
+
+
+def requeue_stale():
+    """処理中のまま job_timeout() を過ぎたジョブを再登録する（試行回数の上限に達したものは失敗にする）"""
+    threshold = timezone.now() - job_timeout()
+    stale = ExportJob.objects.filter(status='running', started_at__lt=threshold)
+    with transaction.atomic():
+        failed = stale.filter(attempts__gte=max_attempts()).update(
+            status='failed', error='処理がタイムアウトしました',
+            finished_at=timezone.now(), expires_at=timezone.now() + retention(),
+        )
+        requeued = stale.update(status='queued')
+    return requeued + failed
+
+
+def cleanup_expired():
+    """保存期間を過ぎたジョブと結果ファイルを削除し、削除件数を返す"""
+    expired = list(ExportJob.objects.filter(
+        status__in=('done', 'failed'), expires_at__lt=timezone.now()
+    ).values_list('pk', 'result_path'))
+    for _, path in expired:
+        if path:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+    return ExportJob.objects.filter(pk__in=[job_id for job_id, _ in expired]).delete()[0] if expired else 0
+
+
+def serialize_job(job):
+    """ジョブの状態をJSONレスポンス用の辞書に変換"""
+    return {
+        'id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'filename': job.filename,
+        'error': job.error if job.status == 'failed' else '',
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'expires_at': job.expires_at.isoformat() if job.expires_at else None,
+    }
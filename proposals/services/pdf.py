@@ -0,0 +1,182 @@
+# ==================== proposals/services/pdf.py ====================
+
+import hashlib
+import logging
+import mimetypes
+import os
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.template.loader import render_to_string
+
+
+logger = logging.getLogger(__name__)
+
+# テンプレートやレンダリング方法を変えた場合に上げて、既存キャッシュを無効化する
+PDF_RENDER_REVISION = 1
+
+
+class PdfUnavailable(Exception):
+    """WeasyPrint が利用できない環境"""
+
+
+def pdf_cache_dir():
+    return Path(getattr(settings, 'PDF_CACHE_DIR', Path(settings.BASE_DIR) / 'cache' / 'pdf'))
+
+
+def pdf_cache_key(proposal, layout_version):
+    """提案の状態と棚割りの版から PDF のキャッシュキー（SHA-256）を求める
+
+    layout_version はスナップショットのID、または棚のバージョン（snapshots.layout_version）。
+    配置・商品の変更はいずれかに反映されるため、配置テーブルは参照しない。
+    """
+    digest = hashlib.sha256()
+    digest.update(repr((
+        PDF_RENDER_REVISION,
+        proposal.pk, proposal.title, proposal.customer.name, proposal.sales_rep,
+        proposal.proposal_date, proposal.status, proposal.description, proposal.updated_at,
+        layout_version,
+    )).encode())
+    return digest.hexdigest()
+
+
+def cached_pdf_path(key):
+    return pdf_cache_dir() / key[:2] / f'{key}.pdf'
+
+
+def mark_used(path):
+    """キャッシュの最終使用日時を記録する（アクセス日時に記録し、Last-Modified に使う更新日時は変えない）"""
+    try:
+        os.utime(path, (time.time(), path.stat().st_mtime))
+    except OSError:
+        pass
+
+
+def cleanup_pdf_cache(retention=None, max_bytes=None):
+    """使われなくなったキャッシュを削除し、削除件数を返す
+
+    最後に使われてから retention 秒を過ぎたものを削除し、残りの合計が max_bytes を超える場合は
+    最終使用日時の古いものから削除する。書き込み途中で残った一時ファイルも削除する。
+    """
+    retention = getattr(settings, 'PDF_CACHE_RETENTION', None) if retention is None else retention
+    max_bytes = getattr(settings, 'PDF_CACHE_MAX_BYTES', None) if max_bytes is None else max_bytes
+    now = time.time()
+    entries = []
+    removed = 0
+    for path in pdf_cache_dir().glob('*/*'):
+        try:
+            stat = path.stat()
+            last_used = max(stat.st_atime, stat.st_mtime)
+            if path.suffix == '.tmp':
+                expired = now - stat.st_mtime > 60 * 60
+            else:
+                expired = path.suffix == '.pdf' and retention is not None and now - last_used > retention
+            if expired:
+                path.unlink()
+                removed += 1
+            elif path.suffix == '.pdf':
+                entries.append((last_used, stat.st_size, path))
+        except FileNotFoundError:
+            continue
+
+    if max_bytes is not None:
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total <= max_bytes:
+                break
+            try:
+                path.unlink()
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+    return removed
+
+
+def last_modified(path):
+    """キャッシュファイルの更新日時（HTTPヘッダ用に秒単位）"""
+    return int(path.stat().st_mtime)
+
+
+def _media_url_fetcher(default_fetcher):
+    """MEDIA_URL 配下の画像はHTTPを経由せずストレージから直接読み込む"""
+    def fetcher(url, *args, **kwargs):
+        path = urlsplit(url).path
+        if path.startswith(settings.MEDIA_URL):
+            name = unquote(path[len(settings.MEDIA_URL):])
+            with default_storage.open(name, 'rb') as media_file:
+                return {
+                    'string': media_file.read(),
+                    'mime_type': mimetypes.guess_type(name)[0],
+                    'redirected_url': url,
+                }
+        return default_fetcher(url, *args, **kwargs)
+    return fetcher
+
+
+def pdf_context(proposal, layout):
+    """proposal_pdf.html のコンテキスト（layout は snapshots.resolve_layout の結果）"""
+    return {
+        'proposal': proposal,
+        'shelf': layout.shelf,
+        'grid': layout.grid.render_rows(),
+        'placements': layout.placements,
+        'stats': layout.stats,
+        'snapshot': layout.snapshot,
+        'export_date': datetime.now(),
+    }
+
+
+def html_to_pdf(html_string, base_url=None):
+    """HTML を WeasyPrint で PDF に変換（DB を参照しないため、出力ワーカーの子プロセスでも実行できる）"""
+    try:
+        from weasyprint import HTML, default_url_fetcher
+    except (ImportError, OSError) as e:
+        raise PdfUnavailable(str(e))
+    
+    return HTML(
+        string=html_string, base_url=base_url, url_fetcher=_media_url_fetcher(default_url_fetcher)
+    ).write_pdf()
+
+
+def render_pdf(context, base_url=None):
+    """proposal_pdf.html を WeasyPrint で PDF に変換"""
+    return html_to_pdf(render_to_string('proposal_pdf.html', context), base_url=base_url)
+
+
+def write_atomic(path, chunks):
+    """一時ファイルに書き込んでから os.replace で置き換える（書き込み途中のファイルは読まれない）"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as output:
+            for chunk in chunks:
+                output.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def get_or_render_pdf(key, context_factory, base_url=None):
+    """キャッシュ済みの PDF を返し、無ければ生成して保存する
+
+    保存は一時ファイルへの書き込み後に os.replace で行うため、
+    同時に生成された場合も途中のファイルが読まれることはない。
+    """
+    path = cached_pdf_path(key)
+    if path.exists():
+        mark_used(path)
+        return path
+    
+    pdf = render_pdf(context_factory(), base_url=base_url)
+    write_atomic(path, [pdf])
+    
+    logger.info('Rendered proposal PDF %s (%d bytes)', key, len(pdf))
+    return path
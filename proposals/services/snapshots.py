@@ -0,0 +1,111 @@
+# ==================== proposals/services/snapshots.py ====================
+
+from django.db import transaction
+from django.db.models import Max
+
+from shelves.models import Shelf
+from shelves.services.grid import build_grid, get_shelf_grid
+from shelves.services.stats import get_shelf_stats
+from proposals.models import Proposal, ProposalSnapshot
+
+
+# スナップショットの形式を変えた場合に上げる（読み込み時に判定する）
+SNAPSHOT_FORMAT = 1
+SHELF_FIELDS = ['id', 'name', 'width', 'height', 'depth', 'rows', 'columns']
+# 配置は項目名を繰り返さないよう、項目名の一覧と値の配列で保存する
+PLACEMENT_FIELDS = [
+    'id', 'row', 'column', 'face_count', 'span_rows', 'span_columns',
+    'product_id', 'product_name', 'product_code', 'maker_name', 'brand_name', 'category_name',
+    'is_own_product', 'image_url', 'print_image_url',
+]
+
+
+class SnapshotShelf:
+    """スナップショット時点の棚（テンプレートからは Shelf と同じ項目で参照できる）"""
+
+    def __init__(self, values):
+        for field in SHELF_FIELDS:
+            setattr(self, field, values.get(field))
+        self.pk = self.id
+
+    @property
+    def total_cells(self):
+        return self.rows * self.columns
+
+    def __str__(self):
+        return self.name
+
+
+class ProposalLayout:
+    """画面・出力に使う棚割り（スナップショットまたは現在の棚）"""
+
+    def __init__(self, shelf, grid, stats, snapshot=None):
+        self.shelf = shelf
+        self.grid = grid
+        self.stats = stats
+        self.snapshot = snapshot
+
+    @property
+    def placements(self):
+        return self.grid.placements
+
+
+def serialize_layout(shelf, grid, stats):
+    return {
+        'format': SNAPSHOT_FORMAT,
+        'shelf': {field: getattr(shelf, field) for field in SHELF_FIELDS},
+        'fields': PLACEMENT_FIELDS,
+        'placements': [[placement[field] for field in PLACEMENT_FIELDS] for placement in grid.placements],
+        'stats': stats,
+    }
+
+
+def load_layout(snapshot):
+    """スナップショットから棚割りを復元（DBを参照しない）"""
+    layout = snapshot.layout
+    shelf = SnapshotShelf(layout['shelf'])
+    fields = layout['fields']
+    placements = [dict(zip(fields, values)) for values in layout['placements']]
+    return ProposalLayout(shelf, build_grid(shelf.rows, shelf.columns, placements), layout['stats'], snapshot)
+
+
+def live_layout(proposal):
+    shelf = proposal.shelf
+    return ProposalLayout(shelf, get_shelf_grid(shelf), proposal.get_placement_stats())
+
+
+def current_snapshot(proposal):
+    """表示に使うスナップショット（下書き中、または未作成なら None）"""
+    return proposal.snapshot if proposal.is_frozen else None
+
+
+def resolve_layout(proposal, snapshot=None):
+    return load_layout(snapshot) if snapshot is not None else live_layout(proposal)
+
+
+def layout_version(proposal, snapshot=None):
+    """ETag・キャッシュキー用に、棚割りの版を表す値を返す"""
+    if snapshot is not None:
+        return ('snapshot', snapshot.pk)
+    return ('shelf', proposal.shelf.pk, proposal.shelf.version)
+
+
+def take_snapshot(proposal, user=None, note=''):
+    """現在の棚割りを新しい版として保存し、提案の最新スナップショットにする"""
+    with transaction.atomic():
+        shelf = Shelf.objects.get(pk=proposal.shelf_id)
+        grid = get_shelf_grid(shelf)
+        stats = get_shelf_stats(shelf).as_dict(shelf.total_cells)
+        last_version = proposal.snapshots.aggregate(last=Max('version'))['last'] or 0
+        snapshot = ProposalSnapshot.objects.create(
+            proposal=proposal,
+            version=last_version + 1,
+            shelf_version=shelf.version,
+            layout=serialize_layout(shelf, grid, stats),
+            note=note,
+            created_by=user,
+        )
+        # save() を経由すると提出時のスナップショット作成が再び走るため、直接更新する
+        Proposal.objects.filter(pk=proposal.pk).update(snapshot=snapshot)
+        proposal.snapshot = snapshot
+    return snapshot
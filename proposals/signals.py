@@ -0,0 +1,77 @@
+# ==================== proposals/signals.py ====================
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from products.models import Maker, Product
+from products.services import masters, search
+from products.signals import products_bulk_changed
+from shelves.models import Shelf, ShelfPlacement, ShelfStats
+from .models import Customer, Proposal
+from .services import dashboard, snapshots
+
+
+masters.register_master('customer', Customer, lambda: Customer.objects.order_by('name'))
+
+search.register_index('proposal', Proposal, [
+    ('title', 3),
+    ('customer__name', 2),
+])
+
+
+@receiver(post_save, sender=Proposal)
+def index_proposal(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_objects('proposal', [instance.pk])
+
+
+@receiver(post_save, sender=Proposal)
+def snapshot_on_submit(sender, instance, created, raw=False, **kwargs):
+    """提出時に棚割りのスナップショットを作成（以降の棚の編集は提出済みの提案に影響しない）"""
+    if raw or instance.status != 'submitted':
+        return
+    if created or getattr(instance, '_loaded_status', None) != 'submitted':
+        snapshots.take_snapshot(instance, user=instance.created_by, note='提出時')
+        instance._loaded_status = instance.status
+
+
+@receiver(post_delete, sender=Proposal)
+def unindex_proposal(sender, instance, **kwargs):
+    search.remove_objects('proposal', [instance.pk])
+
+
+@receiver(post_save, sender=Customer)
+def reindex_proposals_on_customer_rename(sender, instance, created, raw=False, **kwargs):
+    """得意先名の変更を提案の索引に反映"""
+    if raw or created:
+        return
+    search.index_objects('proposal', instance.proposal_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def invalidate_customer_cache(sender, **kwargs):
+    masters.invalidate('customer')
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Maker)
+@receiver(post_save, sender=Shelf)
+@receiver(post_delete, sender=Shelf)
+@receiver(post_save, sender=ShelfPlacement)
+@receiver(post_delete, sender=ShelfPlacement)
+# 一括更新（BatchPlacement）は配置を bulk_create / bulk_update で書き込むため、統計の保存で追従する
+@receiver(post_save, sender=ShelfStats)
+@receiver(post_delete, sender=ShelfStats)
+@receiver(post_save, sender=Proposal)
+@receiver(post_delete, sender=Proposal)
+def invalidate_dashboard(sender, raw=False, **kwargs):
+    """ホーム画面の集計に影響する書き込みで集計キャッシュを破棄"""
+    if not raw:
+        dashboard.invalidate()
+
+
+@receiver(products_bulk_changed)
+def invalidate_dashboard_on_bulk_change(sender, **kwargs):
+    dashboard.invalidate()
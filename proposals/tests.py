@@ -1,3 +1,408 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import time
+from io import StringIO
+from pathlib import Path
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from config import metrics
+from products.models import Category, Maker, Product
+from products.signals import products_bulk_changed
+from shelves.models import Shelf, ShelfPlacement
+from shelves.services.placements import BatchPlacement
+from .management.commands.generate_scale_data import jan_code
+from .models import Customer, ExportJob, Proposal, ProposalSnapshot
+from .services import dashboard, snapshots
+from .services.pdf import cached_pdf_path, cleanup_pdf_cache, last_modified, mark_used
+
+
+def create_proposal(title='提案', **fields):
+    customer = Customer.objects.create(name='テスト得意先')
+    shelf = Shelf.objects.create(name='テスト棚', width=60, height=40, depth=45, rows=4, columns=6)
+    return Proposal.objects.create(title=title, customer=customer, shelf=shelf, **fields)
+
+
+class ExportJobApiTests(TestCase):
+    """出力ジョブ登録API"""
+
+    def setUp(self):
+        self.proposal = create_proposal()
+        self.client = Client(enforce_csrf_checks=True)
+
+    def test_list_sets_csrf_cookie_for_export_button(self):
+        self.client.get(reverse('proposals:proposal_list'))
+        token = self.client.cookies['csrftoken'].value
+        response = self.client.post(
+            reverse('proposals:create_export_job', args=[self.proposal.pk]), {'kind': 'pdf'},
+            HTTP_X_CSRFTOKEN=token,
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(ExportJob.objects.filter(proposal=self.proposal, kind='pdf').count(), 1)
+
+    def test_invalid_kind(self):
+        self.client.get(reverse('proposals:proposal_list'))
+        response = self.client.post(
+            reverse('proposals:create_export_job', args=[self.proposal.pk]), {'kind': 'docx'},
+            HTTP_X_CSRFTOKEN=self.client.cookies['csrftoken'].value,
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class ProposalListTests(TestCase):
+    """提案一覧のページング（?cursor=）"""
+
+    def setUp(self):
+        first = create_proposal('夏の飲料提案 0')
+        self.proposals = [first] + [
+            Proposal.objects.create(
+                title=f'{"夏の飲料提案" if i % 2 else "冬の菓子提案"} {i}', customer=first.customer, shelf=first.shelf,
+                status='submitted' if i % 3 else 'draft',
+            )
+            for i in range(1, 30)
+        ]
+
+    def walk(self, **params):
+        ids, cursor = [], None
+        while True:
+            response = self.client.get(
+                reverse('proposals:proposal_list'), {'format': 'json', **params, **({'cursor': cursor} if cursor else {})},
+            ).json()
+            ids += [row['id'] for row in response['results']]
+            if not response['has_next']:
+                return ids
+            cursor = response['next_cursor']
+
+    def test_walk_with_status_filter(self):
+        ordered = sorted(self.proposals, key=lambda p: (p.created_at, p.pk), reverse=True)
+        expected = [p.pk for p in ordered if p.status == 'submitted']
+        self.assertEqual(self.walk(status='submitted'), expected)
+
+    def test_walk_search_results(self):
+        # 一致度・作成日時・id の順で、重複・欠落なく辿れる
+        ids = self.walk(search='夏')
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(set(ids), {p.pk for p in self.proposals if p.title.startswith('夏')})
+
+
+class DashboardTests(TestCase):
+    """ホーム画面の集計"""
+
+    def setUp(self):
+        cache.clear()
+        maker = Maker.objects.create(name='メーカー')
+        category = Category.objects.create(name='飲料')
+        self.products = [
+            Product.objects.create(
+                product_name=f'商品{i}', product_code=jan_code(i), maker=maker, category=category,
+                is_own_product=i < 2,
+            )
+            for i in range(5)
+        ]
+        self.proposal = create_proposal(status='draft')
+        self.shelf = self.proposal.shelf
+        BatchPlacement(self.shelf).apply([
+            {'op': 'place', 'product_id': product.id, 'row': 0, 'column': i, 'face_count': 2}
+            for i, product in enumerate(self.products[1:4])
+        ])
+
+    def test_aggregates(self):
+        summary = dashboard.compute_summary()
+        self.assertEqual(
+            (summary['total_products'], summary['own_products'], summary['competitor_products']), (5, 2, 3),
+        )
+        self.assertEqual((summary['shelf_count'], summary['total_cells'], summary['occupied_cells']), (1, 24, 3))
+        self.assertEqual((summary['own_faces'], summary['competitor_faces']), (2, 4))
+        self.assertEqual(summary['occupancy_rate'], 12.5)
+        self.assertEqual(summary['own_share'], 33.3)
+        self.assertEqual(summary['total_proposals'], 1)
+        self.assertEqual(
+            {row['status']: row['count'] for row in summary['proposals_by_status']}['draft'], 1,
+        )
+        self.assertEqual([row['id'] for row in summary['recent_products']][:1], [self.products[-1].id])
+
+    def test_one_query_per_table(self):
+        # 商品・棚・提案の集計と最近の商品の4クエリ（件数によらない）
+        with self.assertNumQueries(4):
+            dashboard.get_summary()
+        with self.assertNumQueries(0):
+            dashboard.get_summary()
+
+    def test_invalidated_by_writes(self):
+        dashboard.get_summary()
+        Product.objects.create(
+            product_name='新商品', product_code=jan_code(10), maker=self.products[0].maker,
+            category=self.products[0].category, is_own_product=True,
+        )
+        self.assertEqual(dashboard.get_summary()['own_products'], 3)
+
+        self.proposal.status = 'submitted'
+        self.proposal.save()
+        by_status = {row['status']: row['count'] for row in dashboard.get_summary()['proposals_by_status']}
+        self.assertEqual((by_status['draft'], by_status['submitted']), (0, 1))
+
+        BatchPlacement(self.shelf).apply([{'op': 'place', 'product_id': self.products[0].id, 'row': 1, 'column': 0}])
+        self.assertEqual(dashboard.get_summary()['occupied_cells'], 4)
+
+    def test_invalidated_by_bulk_import(self):
+        dashboard.get_summary()
+        Product.objects.filter(pk=self.products[0].pk).update(is_active=False)
+        products_bulk_changed.send(sender=Product, product_ids=[self.products[0].pk], ownership_changed_ids=[])
+        self.assertEqual(dashboard.get_summary()['total_products'], 4)
+
+    def test_home_page(self):
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_products'], 5)
+
+
+class ProposalSnapshotTests(TestCase):
+    """提出時の棚割りの固定"""
+
+    def setUp(self):
+        cache.clear()
+        maker = Maker.objects.create(name='メーカー')
+        category = Category.objects.create(name='飲料')
+        self.products = [
+            Product.objects.create(product_name=f'商品{i}', product_code=jan_code(i), maker=maker, category=category)
+            for i in range(3)
+        ]
+        self.proposal = create_proposal()
+        self.shelf = self.proposal.shelf
+        BatchPlacement(self.shelf).apply([
+            {'op': 'place', 'product_id': self.products[0].id, 'row': 0, 'column': 0, 'span_columns': 2},
+        ])
+
+    def submit(self):
+        self.proposal.status = 'submitted'
+        self.proposal.save()
+        return Proposal.objects.select_related('shelf', 'snapshot').get(pk=self.proposal.pk)
+
+    def layout(self, proposal, **params):
+        response = self.client.get(reverse('proposals:proposal_detail', args=[proposal.pk]), params)
+        return [(p['product_name'], p['column'], p['span_columns']) for p in response.context['placements']]
+
+    def test_submit_freezes_layout(self):
+        proposal = self.submit()
+        self.assertEqual(proposal.snapshot.version, 1)
+        self.assertEqual(proposal.snapshot.shelf_version, Shelf.objects.get(pk=self.shelf.pk).version)
+
+        # 提出後の棚の編集・商品名の変更は、提出済みの提案に影響しない
+        BatchPlacement(self.shelf).apply([{'op': 'place', 'product_id': self.products[1].id, 'row': 0, 'column': 3}])
+        self.products[0].product_name = '改名後'
+        self.products[0].save()
+        self.assertEqual(self.layout(proposal), [('商品0', 0, 2)])
+        self.assertEqual(snapshots.load_layout(proposal.snapshot).stats['occupied_cells'], 2)
+
+        # 下書きに戻すと現在の棚を表示する
+        Proposal.objects.filter(pk=proposal.pk).update(status='draft')
+        self.assertEqual(self.layout(proposal), [('改名後', 0, 2), ('商品1', 3, 1)])
+
+    def test_frozen_layout_does_not_read_placements(self):
+        proposal = self.submit()
+        for i in range(2):
+            ShelfPlacement.objects.create(shelf=self.shelf, product=self.products[1], row=1, column=i)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('proposals:proposal_detail', args=[proposal.pk])).status_code, 200)
+        self.assertFalse([q['sql'] for q in queries if 'shelves_shelfplacement' in q['sql']])
+
+    def test_versions(self):
+        proposal = self.submit()
+        BatchPlacement(self.shelf).apply([{'op': 'place', 'product_id': self.products[1].id, 'row': 1, 'column': 0}])
+        second = snapshots.take_snapshot(proposal, note='再提出')
+        self.assertEqual(second.version, 2)
+        self.assertEqual(Proposal.objects.get(pk=proposal.pk).snapshot_id, second.pk)
+        proposal = Proposal.objects.select_related('shelf', 'snapshot').get(pk=proposal.pk)
+        self.assertEqual(len(self.layout(proposal)), 2)
+        self.assertEqual(self.layout(proposal, version=1), [('商品0', 0, 2)])
+        self.assertEqual(
+            self.client.get(reverse('proposals:proposal_detail', args=[proposal.pk]), {'version': 9}).status_code, 404,
+        )
+
+    def test_resubmitting_does_not_duplicate(self):
+        proposal = self.submit()
+        proposal.title = '変更'
+        proposal.save()
+        self.assertEqual(ProposalSnapshot.objects.filter(proposal=proposal).count(), 1)
+
+
+@override_settings(REQUEST_METRICS={**settings.REQUEST_METRICS, 'SAMPLE_RATE': 1.0})
+class RequestMetricsTests(TestCase):
+    """リクエスト計測とクエリ数の上限"""
+
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+        maker = Maker.objects.create(name='メーカー')
+        category = Category.objects.create(name='飲料')
+        products = [
+            Product.objects.create(
+                product_name=f'商品{i}', product_code=jan_code(i), maker=maker, category=category, is_own_product=i % 2 == 0,
+            )
+            for i in range(20)
+        ]
+        self.proposal = create_proposal()
+        BatchPlacement(self.proposal.shelf).apply([
+            {'op': 'place', 'product_id': product.id, 'row': i // 6, 'column': i % 6}
+            for i, product in enumerate(products)
+        ])
+
+    def recorded(self, view_name):
+        return {view['view']: view for view in metrics.registry.snapshot()['views']}[view_name]
+
+    def test_records_queries_and_server_timing(self):
+        response = self.client.get(reverse('products:product_list'))
+        view = self.recorded('products:product_list')
+        self.assertEqual(view['count'], 1)
+        self.assertGreater(view['max_queries'], 0)
+        self.assertIn(f'desc="{view["max_queries"]} queries"', response['Server-Timing'])
+
+    def test_budgeted_views_stay_within_query_budget(self):
+        # 設定した上限（REQUEST_METRICS['BUDGETS']）をクエリ数で超えないこと（キャッシュが空の状態で計測）
+        urls = {
+            'index': reverse('index'),
+            'products:product_list': reverse('products:product_list'),
+            'shelves:shelf_detail': reverse('shelves:shelf_detail', args=[self.proposal.shelf.pk]),
+            'proposals:proposal_detail': reverse('proposals:proposal_detail', args=[self.proposal.pk]),
+        }
+        for view_name, url in urls.items():
+            with self.subTest(view=view_name):
+                self.assertEqual(self.client.get(url).status_code, 200)
+                budget = settings.REQUEST_METRICS['BUDGETS'][view_name]['queries']
+                self.assertLessEqual(self.recorded(view_name)['max_queries'], budget)
+        self.assertEqual([issue['view'] for issue in metrics.registry.snapshot()['issues'] if issue['exceeded'].get('queries')], [])
+
+    def test_exceeded_budget_is_logged(self):
+        config = {**settings.REQUEST_METRICS, 'SAMPLE_RATE': 1.0, 'BUDGETS': {'products:product_list': {'queries': 1}}}
+        with override_settings(REQUEST_METRICS=config), self.assertLogs('config.metrics', 'WARNING') as logs:
+            self.client.get(reverse('products:product_list'))
+        self.assertIn('products:product_list', logs.output[0])
+        issue, = metrics.registry.snapshot()['issues']
+        self.assertEqual(issue['exceeded']['queries'][1], 1)
+
+    def test_duplicate_queries_detected(self):
+        with metrics.record_queries() as recorder:
+            for product in Product.objects.all()[:6]:
+                Maker.objects.get(pk=product.maker_id)
+        shape, count = recorder.duplicates(5)[0]
+        self.assertEqual(count, 6)
+        # パラメーターの値を除いた形で数える
+        self.assertIn('"products_maker"', shape)
+
+    def test_metrics_page_requires_staff(self):
+        self.assertEqual(self.client.get(reverse('request_metrics')).status_code, 302)
+        self.client.force_login(User.objects.create_user('staff', password='x', is_staff=True))
+        self.client.get(reverse('products:product_list'))
+        response = self.client.get(reverse('request_metrics'), {'format': 'json'}).json()
+        self.assertIn('products:product_list', [view['view'] for view in response['views']])
+
+
+class PdfCacheCleanupTests(TestCase):
+    """PDFキャッシュの削除"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(PDF_CACHE_DIR=Path(directory.name))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def write(self, key, size=10, used_ago=0):
+        path = cached_pdf_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'x' * size)
+        now = time.time()
+        os.utime(path, (now - used_ago, now - used_ago))
+        return path
+
+    def test_removes_entries_unused_beyond_retention(self):
+        old = self.write('aa' + '0' * 62, used_ago=3600)
+        recent = self.write('bb' + '0' * 62, used_ago=10)
+        self.assertEqual(cleanup_pdf_cache(retention=600, max_bytes=None), 1)
+        self.assertFalse(old.exists())
+        self.assertTrue(recent.exists())
+
+    def test_size_cap_removes_least_recently_used(self):
+        oldest = self.write('aa' + '0' * 62, size=100, used_ago=300)
+        middle = self.write('bb' + '0' * 62, size=100, used_ago=200)
+        newest = self.write('cc' + '0' * 62, size=100, used_ago=100)
+        self.assertEqual(cleanup_pdf_cache(retention=None, max_bytes=250), 1)
+        self.assertEqual([path.exists() for path in (oldest, middle, newest)], [False, True, True])
+
+    def test_mark_used_keeps_last_modified(self):
+        path = self.write('aa' + '0' * 62, used_ago=3600)
+        modified = last_modified(path)
+        mark_used(path)
+        self.assertEqual(last_modified(path), modified)
+        # 使われたものは保存期間内として残る
+        self.assertEqual(cleanup_pdf_cache(retention=600, max_bytes=None), 0)
+        self.assertTrue(path.exists())
+
+    def test_removes_abandoned_temporary_files(self):
+        path = self.write('aa' + '0' * 62)
+        abandoned = path.with_name('tmpabc.tmp')
+        abandoned.write_bytes(b'x')
+        old = time.time() - 2 * 60 * 60
+        os.utime(abandoned, (old, old))
+        cleanup_pdf_cache(retention=600, max_bytes=None)
+        self.assertFalse(abandoned.exists())
+        self.assertTrue(path.exists())
+
+
+class GenerateScaleDataTests(TestCase):
+    """負荷試験用データの生成"""
+
+    def generate(self, products):
+        call_command(
+            'generate_scale_data', products=products, shelves=3, proposals=2, customers=2, skip_index=True,
+            fill=1.0, stdout=StringIO(),
+        )
+
+    def test_existing_products_are_not_reused(self):
+        # 生成データと同じ形式のコードを持つ既存商品があっても、採番が重ならず作成した商品にも含まれない
+        existing = Product.objects.create(
+            product_name='店内商品', product_code=jan_code(3),
+            maker=Maker.objects.create(name='既存メーカー'), category=Category.objects.create(name='既存カテゴリ'),
+        )
+        self.generate(20)
+        self.assertEqual(Product.objects.count(), 21)
+        self.assertFalse(ShelfPlacement.objects.filter(product=existing).exists())
+        self.assertEqual(
+            set(Product.objects.exclude(pk=existing.pk).values_list('product_code', flat=True)),
+            {jan_code(number) for number in range(4, 24)},
+        )
+
+
+@override_settings(ALLOWED_HOSTS=['localhost'])
+class RunBenchmarkTests(TransactionTestCase):
+    """ベンチマークの実行（ASGI は別スレッドの接続を使うため TransactionTestCase）"""
+
+    def setUp(self):
+        call_command(
+            'generate_scale_data', products=20, shelves=2, proposals=2, customers=1, skip_index=True,
+            stdout=StringIO(),
+        )
+
+    def run_benchmark(self, *args):
+        stdout = StringIO()
+        call_command('run_benchmark', *args, requests=3, warmup=1, stdout=stdout, stderr=StringIO())
+        return json.loads(stdout.getvalue())['scenarios']
+
+    def test_editor_over_asgi(self):
+        result = self.run_benchmark('editor', 'product_list', '--interface', 'asgi')
+        self.assertEqual(result['editor']['errors'], 0)
+        self.assertEqual(result['product_list']['errors'], 0)
+
+    def test_disallowed_host_counted_as_error(self):
+        for interface in ('wsgi', 'asgi'):
+            with self.subTest(interface=interface):
+                result = self.run_benchmark('editor', '--interface', interface, '--host', 'example.com')
+                self.assertEqual(result['editor']['errors'], 3)
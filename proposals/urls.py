@@ -12,8 +12,12 @@ urlpatterns = [
     path('<int:pk>/', views.proposal_detail, name='proposal_detail'),
     path('<int:pk>/edit/', views.ProposalUpdateView.as_view(), name='proposal_edit'),
     path('<int:pk>/delete/', views.ProposalDeleteView.as_view(), name='proposal_delete'),
+    path('<int:pk>/snapshots/', views.create_snapshot, name='create_snapshot'),
     
     # 出力機能
     path('<int:pk>/export/pdf/', views.export_pdf, name='export_pdf'),
     path('<int:pk>/export/excel/', views.export_excel, name='export_excel'),
+    path('<int:pk>/export/jobs/', views.create_export_job, name='create_export_job'),
+    path('export/jobs/<int:job_id>/', views.export_job_status, name='export_job_status'),
+    path('export/jobs/<int:job_id>/download/', views.export_job_download, name='export_job_download'),
 ]
\ No newline at end of file
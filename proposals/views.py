@@ -1,38 +1,46 @@
 # ==================== proposals/views.py ====================
 
-from datetime import datetime
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, FileResponse, Http404
+from django.utils.http import content_disposition_header
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView
-from django.urls import reverse_lazy
-from django.db.models import Q
+from django.urls import reverse, reverse_lazy
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import ensure_csrf_cookie
+from django.views.decorators.http import require_POST
 from django.template.loader import render_to_string
-from shelves.models import ShelfPlacement
+from config.pagination import CursorPaginationMixin
+from shelves.services import versions
+from products.services import masters, search as search_index
 
-from .models import Proposal, Customer
+from .models import Proposal, ProposalSnapshot, ExportJob
 from .forms import ProposalForm
+from .services import jobs, snapshots
+from .services.export import XLSX_CONTENT_TYPE, placement_rows, stream_csv, stream_xlsx
+from .services.pdf import (
+    PdfUnavailable, pdf_cache_key, pdf_context, cached_pdf_path, get_or_render_pdf, last_modified, mark_used,
+)
 
 
-class ProposalListView(ListView):
-    """提案一覧"""
+# 出力ボタン（base.html の data-export-job）が POST で送る CSRF トークンを Cookie に用意する
+@method_decorator(ensure_csrf_cookie, name='dispatch')
+class ProposalListView(CursorPaginationMixin, ListView):
+    """提案一覧（?cursor= でページ送り、?format=json でJSON）"""
     model = Proposal
     template_name = 'proposal_list.html'
     context_object_name = 'proposals'
     paginate_by = 12
 
     def get_queryset(self):
-        queryset = Proposal.objects.select_related('customer', 'shelf')
+        queryset = Proposal.objects.select_related('customer', 'shelf', 'shelf__stats')
         
         search = self.request.GET.get('search')
         status = self.request.GET.get('status')
         customer = self.request.GET.get('customer')
         
         if search:
-            queryset = queryset.filter(
-                Q(title__icontains=search) |
-                Q(customer__name__icontains=search)
-            )
+            queryset = search_index.search(queryset, 'proposal', search)
         
         if status:
             queryset = queryset.filter(status=status)
@@ -40,6 +48,8 @@ class ProposalListView(ListView):
         if customer:
             queryset = queryset.filter(customer_id=customer)
         
+        if search:
+            return queryset.order_by('-search_rank', '-created_at')
         return queryset.order_by('-created_at')
 
     def get_context_data(self, **kwargs):
@@ -47,10 +57,22 @@ class ProposalListView(ListView):
         context['search'] = self.request.GET.get('search', '')
         context['status_choices'] = Proposal.STATUS_CHOICES
         context['selected_status'] = self.request.GET.get('status', '')
-        context['customers'] = Customer.objects.all()
+        context['customers'] = masters.objects('customer')
         context['selected_customer'] = self.request.GET.get('customer', '')
         return context
 
+    def serialize_object(self, proposal):
+        return {
+            'id': proposal.id,
+            'title': proposal.title,
+            'customer_name': proposal.customer.name,
+            'shelf_name': proposal.shelf.name,
+            'status': proposal.status,
+            'status_display': proposal.get_status_display(),
+            'proposal_date': proposal.proposal_date.isoformat(),
+            'created_at': proposal.created_at.isoformat(),
+        }
+
 
 class ProposalCreateView(CreateView):
     """提案作成"""
@@ -99,107 +121,165 @@ class ProposalDeleteView(DeleteView):
         return super().delete(request, *args, **kwargs)
 
 
+def _proposal_queryset():
+    return Proposal.objects.select_related('customer', 'shelf', 'snapshot')
+
+
+def _requested_snapshot(request, proposal):
+    """表示・出力するスナップショット（?version=N で過去の版、既定は提出後の最新版）"""
+    version = request.GET.get('version')
+    if not version:
+        return snapshots.current_snapshot(proposal)
+    if not version.isdigit():
+        raise Http404('版の指定が不正です')
+    if proposal.snapshot is not None and proposal.snapshot.version == int(version):
+        return proposal.snapshot
+    return get_object_or_404(ProposalSnapshot, proposal=proposal, version=version)
+
+
+def _proposal_validators(request, proposal, snapshot, *extra):
+    """提案画面・出力用の ETag / Last-Modified（スナップショットまたは棚のバージョンで配置の変更を検知する）"""
+    etag = versions.make_etag(
+        'proposal', proposal.pk, proposal.updated_at, proposal.customer.name,
+        snapshots.layout_version(proposal, snapshot), request.user.pk, *extra
+    )
+    changed_at = snapshot.created_at if snapshot is not None else proposal.shelf.updated_at
+    return etag, versions.timestamp(proposal.updated_at, changed_at)
+
+
 def proposal_detail(request, pk):
-    """提案詳細"""
-    proposal = get_object_or_404(Proposal, pk=pk)
-    shelf = proposal.shelf
-    
-    # 棚配置データを取得
-    placements = ShelfPlacement.objects.filter(shelf=shelf).select_related('product', 'product__maker')
+    """提案詳細（提出後はスナップショットを表示。変わっていなければ 304 を返す）"""
+    proposal = get_object_or_404(_proposal_queryset(), pk=pk)
+    snapshot = _requested_snapshot(request, proposal)
     
-    # グリッド形式でのデータ構築
-    grid = [[None for _ in range(shelf.columns)] for _ in range(shelf.rows)]
-    for placement in placements:
-        if placement.row < shelf.rows and placement.column < shelf.columns:
-            grid[placement.row][placement.column] = placement
+    etag, last_modified = _proposal_validators(request, proposal, snapshot)
+    not_modified = versions.not_modified(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
     
-    # 統計情報
-    stats = proposal.get_placement_stats()
+    layout = snapshots.resolve_layout(proposal, snapshot)
     
     context = {
         'proposal': proposal,
-        'shelf': shelf,
-        'grid': grid,
-        'placements': placements,
-        'stats': stats,
+        'shelf': layout.shelf,
+        'grid': layout.grid.render_rows(),
+        'placements': layout.placements,
+        'stats': layout.stats,
+        'snapshot': snapshot,
+        'snapshot_versions': proposal.snapshots.values('version', 'note', 'created_at'),
     }
-    return render(request, 'proposal_detail.html', context)
+    return versions.set_validators(render(request, 'proposal_detail.html', context), etag, last_modified)
 
 
-def export_pdf(request, pk):
-    """PDF出力"""
+@require_POST
+def create_snapshot(request, pk):
+    """現在の棚割りを提案の新しい版として保存"""
     proposal = get_object_or_404(Proposal, pk=pk)
-    shelf = proposal.shelf
-    
-    # 棚配置データを取得
-    placements = ShelfPlacement.objects.filter(shelf=shelf).select_related('product', 'product__maker')
-    
-    # グリッド形式でのデータ構築
-    grid = [[None for _ in range(shelf.columns)] for _ in range(shelf.rows)]
-    for placement in placements:
-        if placement.row < shelf.rows and placement.column < shelf.columns:
-            grid[placement.row][placement.column] = placement
+    snapshot = snapshots.take_snapshot(
+        proposal,
+        user=request.user if request.user.is_authenticated else None,
+        note=request.POST.get('note', '')[:200],
+    )
+    messages.success(request, f'第{snapshot.version}版として保存しました。')
+    return redirect(f"{reverse('proposals:proposal_detail', args=[proposal.pk])}?version={snapshot.version}")
+
+
+def export_pdf(request, pk):
+    """PDF出力
+
+    提案の状態と棚割りの版（スナップショットまたは棚のバージョン）のハッシュをキーに
+    生成済みPDFをディスクにキャッシュし、ETag / Last-Modified による条件付きGETに対応する。
+    """
+    proposal = get_object_or_404(_proposal_queryset(), pk=pk)
+    snapshot = _requested_snapshot(request, proposal)
+    key = pdf_cache_key(proposal, snapshots.layout_version(proposal, snapshot))
+    etag = f'"{key}"'
     
-    # 統計情報
-    stats = proposal.get_placement_stats()
+    path = cached_pdf_path(key)
+    if path.exists():
+        not_modified = versions.not_modified(request, etag, last_modified(path))
+        if not_modified is not None:
+            mark_used(path)
+            return not_modified
     
-    context = {
-        'proposal': proposal,
-        'shelf': shelf,
-        'grid': grid,
-        'placements': placements,
-        'stats': stats,
-        'export_date': datetime.now(),
-    }
+    def context_factory():
+        return pdf_context(proposal, snapshots.resolve_layout(proposal, snapshot))
     
-    # HTMLテンプレートをレンダリング
-    html_string = render_to_string('proposal_pdf.html', context)
+    try:
+        path = get_or_render_pdf(key, context_factory, base_url=request.build_absolute_uri('/'))
+    except PdfUnavailable:
+        # WeasyPrint が使えない環境ではHTMLを出力する
+        response = HttpResponse(render_to_string('proposal_pdf.html', context_factory()), content_type='text/html')
+        response['Content-Disposition'] = content_disposition_header(True, f'{proposal.title}_提案書.html')
+        return response
     
-    # 実際のPDF生成処理（WeasyPrintやReportLabを使用）
-    # ここでは簡易版として HTMLResponseを返す
-    response = HttpResponse(html_string, content_type='text/html')
-    response['Content-Disposition'] = f'attachment; filename="{proposal.title}_提案書.html"'
-    return response
+    response = FileResponse(
+        open(path, 'rb'), as_attachment=True,
+        filename=f'{proposal.title}_提案書.pdf', content_type='application/pdf'
+    )
+    return versions.set_validators(response, etag, last_modified(path))
 
 
 def export_excel(request, pk):
-    """Excel出力"""
-    proposal = get_object_or_404(Proposal, pk=pk)
-    shelf = proposal.shelf
-    
-    # 棚配置データを取得
-    placements = ShelfPlacement.objects.filter(shelf=shelf).select_related(
-        'product', 'product__maker', 'product__brand', 'product__category'
-    )
+    """Excel出力（?format=csv でCSV出力。提出後はスナップショットを出力し、変わっていなければ 304 を返す）"""
+    proposal = get_object_or_404(_proposal_queryset(), pk=pk)
+    snapshot = _requested_snapshot(request, proposal)
+    export_format = 'csv' if request.GET.get('format') == 'csv' else 'xlsx'
     
-    # 実際のExcel生成処理（openpyxlを使用）
-    # ここでは簡易版としてCSV形式で返す
-    import csv
-    from io import StringIO
+    etag, last_modified = _proposal_validators(request, proposal, snapshot, export_format)
+    not_modified = versions.not_modified(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
     
-    output = StringIO()
-    writer = csv.writer(output)
+    rows = placement_rows(snapshots.resolve_layout(proposal, snapshot).placements)
     
-    # ヘッダー
-    writer.writerow([
-        '位置', '商品名', 'JANコード', 'メーカー', 'ブランド', 
-        'カテゴリ', 'フェース数', '区分'
-    ])
+    if export_format == 'csv':
+        response = StreamingHttpResponse(stream_csv(rows), content_type='text/csv; charset=utf-8')
+        filename = f'{proposal.title}_商品配置一覧.csv'
+    else:
+        response = StreamingHttpResponse(stream_xlsx(rows), content_type=XLSX_CONTENT_TYPE)
+        filename = f'{proposal.title}_商品配置一覧.xlsx'
     
-    # データ
-    for placement in placements:
-        writer.writerow([
-            f"{placement.row+1}段{placement.column+1}列",
-            placement.product.product_name,
-            placement.product.product_code,
-            placement.product.maker.name,
-            placement.product.brand.name if placement.product.brand else '-',
-            placement.product.category.name,
-            placement.face_count,
-            '自社' if placement.product.is_own_product else '競合'
-        ])
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return versions.set_validators(response, etag, last_modified)
+
+
+@require_POST
+def create_export_job(request, pk):
+    """出力ジョブ登録API（生成は run_export_worker が行い、リクエストは登録だけで返す）
+
+    パラメーター: kind（pdf / xlsx / csv）、version（省略時は提出後の最新版）
+    """
+    proposal = get_object_or_404(_proposal_queryset(), pk=pk)
+    snapshot = _requested_snapshot(request, proposal)
+    kind = request.POST.get('kind') or request.GET.get('kind', 'pdf')
+    if kind not in jobs.FORMATS:
+        return JsonResponse({'success': False, 'error': '出力形式が不正です'}, status=400)
     
-    output.seek(0)
-    response = HttpResponse(output.getvalue(), content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="{proposal.title}_商品配置一覧.csv"'
-    return response
+    job = jobs.enqueue(
+        proposal, snapshot, kind,
+        user=request.user if request.user.is_authenticated else None,
+        base_url=request.build_absolute_uri('/'),
+    )
+    return JsonResponse({
+        'success': True,
+        'job': jobs.serialize_job(job),
+        'status_url': reverse('proposals:export_job_status', args=[job.pk]),
+        'download_url': reverse('proposals:export_job_download', args=[job.pk]),
+    }, status=202)
+
+
+def export_job_status(request, job_id):
+    """出力ジョブの状態取得API"""
+    job = get_object_or_404(ExportJob, pk=job_id)
+    return JsonResponse({'success': True, 'job': jobs.serialize_job(job)})
+
+
+def export_job_download(request, job_id):
+    """出力ジョブの結果ファイルのダウンロード（保存期間を過ぎたものは 404）"""
+    job = get_object_or_404(ExportJob, pk=job_id, status='done')
+    try:
+        result = open(job.result_path, 'rb')
+    except (FileNotFoundError, ValueError):
+        raise Http404('出力ファイルの保存期間が過ぎています')
+    return FileResponse(result, as_attachment=True, filename=job.filename, content_type=job.content_type)
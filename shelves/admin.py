@@ -1,6 +1,6 @@
 # shelves/admin.py
 from django.contrib import admin
-from .models import Shelf, ShelfPlacement
+from .models import Shelf, ShelfPlacement, ShelfStats, SalesFloor, FloorShelf
 
 
 @admin.register(Shelf)
@@ -17,3 +17,25 @@ class ShelfPlacementAdmin(admin.ModelAdmin):
     list_filter = ('shelf', 'product__is_own_product', 'created_at')
     search_fields = ('shelf__name', 'product__product_name')
     readonly_fields = ('created_at',)
+
+
+@admin.register(ShelfStats)
+class ShelfStatsAdmin(admin.ModelAdmin):
+    list_display = ('shelf', 'occupied_cells', 'own_products_count', 'competitor_products_count', 'own_faces', 'competitor_faces', 'updated_at')
+    search_fields = ('shelf__name',)
+    readonly_fields = ('updated_at',)
+
+
+class FloorShelfInline(admin.TabularInline):
+    model = FloorShelf
+    extra = 1
+    autocomplete_fields = ('shelf',)
+
+
+@admin.register(SalesFloor)
+class SalesFloorAdmin(admin.ModelAdmin):
+    list_display = ('name', 'created_at', 'updated_at')
+    list_filter = ('created_at',)
+    search_fields = ('name', 'description')
+    readonly_fields = ('created_at', 'updated_at')
+    inlines = [FloorShelfInline]
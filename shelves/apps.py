@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ShelvesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shelves'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        # SQLite の接続ごとの PRAGMA 設定（config/database.py）を登録する
+        from config import database  # noqa: F401
@@ -2,8 +2,9 @@
 
 from django import forms
 from django.core.exceptions import ValidationError
-from .models import Shelf, ShelfPlacement
+from .models import Shelf, ShelfPlacement, SalesFloor
 from products.models import Product
+from .services.occupancy import ShelfOccupancy
 
 
 class ShelfForm(forms.ModelForm):
@@ -23,6 +24,18 @@ class ShelfForm(forms.ModelForm):
         }
 
 
+class SalesFloorForm(forms.ModelForm):
+    """売場フォーム"""
+    
+    class Meta:
+        model = SalesFloor
+        fields = ['name', 'description']
+        widgets = {
+            'name': forms.TextInput(attrs={'class': 'form-control'}),
+            'description': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
+        }
+
+
 class ShelfSearchForm(forms.Form):
     """棚検索フォーム"""
     search = forms.CharField(
@@ -64,6 +77,11 @@ class ShelfPlacementForm(forms.Form):
                 if row + span_rows > shelf.rows or column + span_columns > shelf.columns:
                     raise ValidationError('占有サイズが棚の範囲を超えています。')
                 
+                # 複数セル占有を含めた重なりチェック
+                occupancy = ShelfOccupancy.for_shelf(shelf)
+                if not occupancy.is_free(row, column, span_rows, span_columns):
+                    raise ValidationError('指定された範囲には既に商品が配置されています。')
+                
             except Shelf.DoesNotExist:
                 raise ValidationError('指定された棚が見つかりません。')
         
@@ -0,0 +1,17 @@
+# shelves/management/commands/rebuild_shelf_stats.py
+
+from django.core.management.base import BaseCommand
+from shelves.services.stats import rebuild_shelf_stats
+
+
+class Command(BaseCommand):
+    help = '棚の配置統計を配置データから再集計します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('shelf_ids', nargs='*', type=int, help='対象の棚ID（省略時は全棚）')
+        parser.add_argument('--batch-size', type=int, default=1000, help='一括書き込みの件数')
+
+    def handle(self, *args, **options):
+        shelf_ids = options['shelf_ids'] or None
+        count = rebuild_shelf_stats(shelf_ids, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{count} 件の棚統計を再集計しました'))
@@ -13,6 +13,8 @@ class Shelf(models.Model):
     depth = models.FloatField('奥行(cm)', validators=[MinValueValidator(1)])
     rows = models.IntegerField('段数', validators=[MinValueValidator(1), MaxValueValidator(20)])
     columns = models.IntegerField('列数', validators=[MinValueValidator(1), MaxValueValidator(20)])
+    # 配置・棚・表示中の商品が変わるたびに進める（グリッドのキャッシュキーとETagに使う）
+    version = models.PositiveBigIntegerField('バージョン', default=1, editable=False)
     created_at = models.DateTimeField('作成日時', auto_now_add=True)
     updated_at = models.DateTimeField('更新日時', auto_now=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='作成者')
@@ -21,10 +23,25 @@ class Shelf(models.Model):
         verbose_name = '棚'
         verbose_name_plural = '棚'
         ordering = ['-created_at']
+        indexes = [
+            # 一覧のキーセットページング
+            models.Index(fields=['created_at', 'id'], name='shelf_created_idx'),
+        ]
     
     def __str__(self):
         return self.name
     
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            # 同時に更新されても取りこぼさないよう、DB側で加算する
+            self.version = models.F('version') + 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'version'}
+        super().save(*args, **kwargs)
+        if isinstance(self.version, models.expressions.Combinable):
+            self.refresh_from_db(fields=['version'])
+    
     @property
     def total_cells(self):
         return self.rows * self.columns
@@ -49,4 +66,88 @@ class ShelfPlacement(models.Model):
     
     def __str__(self):
         return f"{self.shelf.name} - {self.product.product_name} ({self.row+1}段{self.column+1}列)"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 統計の差分更新用に読み込み時の値を保持
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+    
+    @property
+    def cell_count(self):
+        return self.span_rows * self.span_columns
+
+
+class ShelfStats(models.Model):
+    """棚の配置統計（配置の追加・更新・削除時に差分更新する）"""
+    shelf = models.OneToOneField(Shelf, on_delete=models.CASCADE, related_name='stats', verbose_name='棚')
+    occupied_cells = models.IntegerField('占有セル数', default=0)
+    own_products_count = models.IntegerField('自社商品数', default=0)
+    competitor_products_count = models.IntegerField('競合商品数', default=0)
+    own_faces = models.IntegerField('自社フェース数', default=0)
+    competitor_faces = models.IntegerField('競合フェース数', default=0)
+    updated_at = models.DateTimeField('更新日時', auto_now=True)
+    
+    class Meta:
+        verbose_name = '棚配置統計'
+        verbose_name_plural = '棚配置統計'
+    
+    def __str__(self):
+        return f"{self.shelf_id} の配置統計"
+    
+    @property
+    def total_faces(self):
+        return self.own_faces + self.competitor_faces
+    
+    @property
+    def own_share(self):
+        total_faces = self.total_faces
+        return round((self.own_faces / total_faces) * 100, 1) if total_faces > 0 else 0
+    
+    def as_dict(self, total_cells):
+        return {
+            'total_cells': total_cells,
+            'occupied_cells': self.occupied_cells,
+            'occupancy_rate': round((self.occupied_cells / total_cells) * 100, 1) if total_cells > 0 else 0,
+            'own_products_count': self.own_products_count,
+            'competitor_products_count': self.competitor_products_count,
+            'own_faces': self.own_faces,
+            'competitor_faces': self.competitor_faces,
+            'own_share': self.own_share,
+        }
+
 
+
+class SalesFloor(models.Model):
+    """売場（複数の棚を通路ごとに並べて売場全体を再現する）"""
+    name = models.CharField('売場名', max_length=100)
+    description = models.TextField('説明', blank=True)
+    created_at = models.DateTimeField('作成日時', auto_now_add=True)
+    updated_at = models.DateTimeField('更新日時', auto_now=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='作成者')
+    
+    class Meta:
+        verbose_name = '売場'
+        verbose_name_plural = '売場'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return self.name
+
+
+class FloorShelf(models.Model):
+    """売場内の棚の位置（通路ごとに並び順の小さい方から左に並べる）"""
+    floor = models.ForeignKey(SalesFloor, on_delete=models.CASCADE, related_name='floor_shelves', verbose_name='売場')
+    shelf = models.ForeignKey(Shelf, on_delete=models.CASCADE, related_name='floor_positions', verbose_name='棚')
+    aisle = models.PositiveIntegerField('通路', default=0)
+    position = models.PositiveIntegerField('並び順', default=0)
+    
+    class Meta:
+        verbose_name = '売場の棚'
+        verbose_name_plural = '売場の棚'
+        ordering = ['aisle', 'position']
+        unique_together = [['floor', 'shelf'], ['floor', 'aisle', 'position']]
+    
+    def __str__(self):
+        return f"{self.floor_id} - {self.shelf_id} (通路{self.aisle+1} {self.position+1}番目)"
@@ -0,0 +1,77 @@
+# ==================== shelves/services/floor.py ====================
+
+from itertools import groupby
+
+from django.db.models import Max
+
+from shelves.models import FloorShelf
+from .grid import get_shelf_grids
+
+
+class FloorSection:
+    """売場に並べた棚1台分（棚・売場内の位置・グリッド）"""
+    __slots__ = ('entry', 'shelf', 'grid')
+
+    def __init__(self, entry, grid):
+        self.entry = entry
+        self.shelf = entry.shelf
+        self.grid = grid
+
+
+class FloorLayout:
+    """売場全体の棚割り（通路ごとの棚の並びと売場全体の集計）"""
+
+    def __init__(self, floor, sections):
+        self.floor = floor
+        self.sections = sections
+
+    @property
+    def aisles(self):
+        """[(通路番号, [FloorSection, ...]), ...]（並び順に整列済み）"""
+        return [
+            (aisle, list(sections))
+            for aisle, sections in groupby(self.sections, key=lambda section: section.entry.aisle)
+        ]
+
+    @property
+    def shelf_count(self):
+        return len(self.sections)
+
+    def summary(self):
+        """配置済みの棚グリッドから売場全体の統計を計算（DBを参照しない）"""
+        totals = {
+            'total_cells': 0, 'occupied_cells': 0,
+            'own_products_count': 0, 'competitor_products_count': 0,
+            'own_faces': 0, 'competitor_faces': 0,
+        }
+        for section in self.sections:
+            grid = section.grid
+            totals['total_cells'] += grid.rows * grid.columns
+            totals['occupied_cells'] += sum(1 for index in grid.cells if index >= 0)
+            for placement in grid.placements:
+                prefix = 'own' if placement['is_own_product'] else 'competitor'
+                totals[f'{prefix}_products_count'] += 1
+                totals[f'{prefix}_faces'] += placement['face_count']
+        total_faces = totals['own_faces'] + totals['competitor_faces']
+        totals['occupancy_rate'] = (
+            round((totals['occupied_cells'] / totals['total_cells']) * 100, 1) if totals['total_cells'] else 0
+        )
+        totals['own_share'] = round((totals['own_faces'] / total_faces) * 100, 1) if total_faces else 0
+        return totals
+
+
+def load_floor(floor):
+    """売場の棚とグリッドを取得
+
+    棚の位置は棚付きの1クエリ、配置はキャッシュに無い棚の分をまとめた1クエリで取得し、
+    グリッドはメモリ上で組み立てるため、棚の台数によらずクエリ数は一定になる。
+    """
+    entries = list(FloorShelf.objects.filter(floor=floor).select_related('shelf').order_by('aisle', 'position'))
+    grids = get_shelf_grids([entry.shelf for entry in entries])
+    return FloorLayout(floor, [FloorSection(entry, grids[entry.shelf_id]) for entry in entries])
+
+
+def next_position(floor, aisle):
+    """通路の末尾の並び順"""
+    last = FloorShelf.objects.filter(floor=floor, aisle=aisle).aggregate(last=Max('position'))['last']
+    return 0 if last is None else last + 1
@@ -0,0 +1,178 @@
+# ==================== shelves/services/grid.py ====================
+
+from array import array
+from collections import namedtuple
+
+from django.core.cache import cache
+
+from products.models import Product
+from shelves.models import ShelfPlacement
+
+
+GRID_CACHE_TIMEOUT = 60 * 60
+EMPTY = -1
+
+# 描画用のセル（covered は結合セルに覆われて描画を省くセル）
+GridCell = namedtuple('GridCell', ['row', 'column', 'placement', 'rowspan', 'colspan', 'covered'])
+
+
+def _grid_cache_key(shelf):
+    return f'shelves:grid:{shelf.pk}:{shelf.version}'
+
+
+RECORD_VALUES = (
+    'id', 'row', 'column', 'face_count', 'span_rows', 'span_columns',
+    'product_id', 'product__product_name', 'product__product_code', 'product__is_own_product',
+    'product__image', 'product__image_thumb', 'product__image_print',
+    'product__maker__name', 'product__brand__name', 'product__category__full_name',
+)
+# 複数棚の配置をまとめて取得する際の IN 句の最大件数
+SHELF_BATCH_SIZE = 500
+
+
+def _to_record(row, url):
+    return {
+        'id': row['id'],
+        'row': row['row'],
+        'column': row['column'],
+        'face_count': row['face_count'],
+        'span_rows': row['span_rows'],
+        'span_columns': row['span_columns'],
+        'product_id': row['product_id'],
+        'product_name': row['product__product_name'],
+        'product_code': row['product__product_code'],
+        'maker_name': row['product__maker__name'],
+        'brand_name': row['product__brand__name'],
+        'category_name': row['product__category__full_name'],
+        'is_own_product': row['product__is_own_product'],
+        'image_url': url(row['product__image_thumb'], row['product__image']),
+        'print_image_url': url(row['product__image_print'], row['product__image']),
+    }
+
+
+def _image_url_resolver():
+    storage = Product._meta.get_field('image').storage
+
+    def url(*names):
+        for name in names:
+            if name:
+                return storage.url(name)
+        return None
+
+    return url
+
+
+def placement_records(shelf):
+    """棚の配置を描画・出力用の辞書のリストとして取得（段・列順、1クエリ）"""
+    rows = ShelfPlacement.objects.filter(shelf=shelf).order_by('row', 'column').values(*RECORD_VALUES)
+    url = _image_url_resolver()
+    return [_to_record(row, url) for row in rows]
+
+
+def placement_records_by_shelf(shelf_ids):
+    """複数棚の配置を棚IDごとの辞書のリストとして取得（SHELF_BATCH_SIZE 棚ごとに1クエリ）"""
+    shelf_ids = list(shelf_ids)
+    url = _image_url_resolver()
+    records = {shelf_id: [] for shelf_id in shelf_ids}
+    for start in range(0, len(shelf_ids), SHELF_BATCH_SIZE):
+        rows = ShelfPlacement.objects.filter(
+            shelf_id__in=shelf_ids[start:start + SHELF_BATCH_SIZE]
+        ).order_by('shelf_id', 'row', 'column').values('shelf_id', *RECORD_VALUES)
+        for row in rows:
+            records[row['shelf_id']].append(_to_record(row, url))
+    return records
+
+
+class ShelfGrid:
+    """棚グリッドのコンパクトな表現
+
+    セルは行優先の整数配列で、各要素は占有する配置の添字（空きは -1）。
+    結合セル（span_rows / span_columns）は覆う全セルに同じ添字を持つ。
+    """
+    __slots__ = ('rows', 'columns', 'placements', 'cells')
+
+    def __init__(self, rows, columns, placements):
+        self.rows = rows
+        self.columns = columns
+        self.placements = placements
+        self.cells = array('i', [EMPTY]) * (rows * columns)
+
+        for index, placement in enumerate(placements):
+            row, column = placement['row'], placement['column']
+            if not (0 <= row < rows and 0 <= column < columns) or self.cells[row * columns + column] != EMPTY:
+                continue
+            # 棚の外にはみ出す部分と、既に占有済みのセルは覆わない
+            for r in range(row, min(row + placement['span_rows'], rows)):
+                for c in range(column, min(column + placement['span_columns'], columns)):
+                    if self.cells[r * columns + c] == EMPTY:
+                        self.cells[r * columns + c] = index
+
+    def placement_at(self, row, column):
+        index = self.cells[row * self.columns + column]
+        return self.placements[index] if index != EMPTY else None
+
+    @property
+    def placement_count(self):
+        return len(self.placements)
+
+    def render_rows(self):
+        """描画用の行（セルごとの rowspan / colspan と、結合で覆われるセルの判定を含む）"""
+        rows = []
+        for row in range(self.rows):
+            cells = []
+            for column in range(self.columns):
+                index = self.cells[row * self.columns + column]
+                if index == EMPTY:
+                    cells.append(GridCell(row, column, None, 1, 1, False))
+                    continue
+                placement = self.placements[index]
+                if placement['row'] != row or placement['column'] != column:
+                    cells.append(GridCell(row, column, None, 1, 1, True))
+                    continue
+                rowspan = min(placement['span_rows'], self.rows - row)
+                colspan = min(placement['span_columns'], self.columns - column)
+                cells.append(GridCell(row, column, placement, rowspan, colspan, False))
+            rows.append(cells)
+        return rows
+
+
+def build_grid(rows, columns, placements):
+    return ShelfGrid(rows, columns, placements)
+
+
+def get_shelf_grid(shelf):
+    """棚グリッドを取得（棚のバージョンごとにキャッシュし、キャッシュ済みなら配置テーブルを参照しない）"""
+    key = _grid_cache_key(shelf)
+    grid = cache.get(key)
+    if grid is None:
+        grid = build_grid(shelf.rows, shelf.columns, placement_records(shelf))
+        cache.set(key, grid, GRID_CACHE_TIMEOUT)
+    return grid
+
+
+def get_shelf_grids(shelves):
+    """複数棚のグリッドを棚IDごとに取得
+
+    キャッシュは1回の get_many で参照し、キャッシュに無い棚の配置はまとめて取得するため、
+    棚の数によらずクエリ数は一定になる。
+    """
+    keys = {shelf.pk: _grid_cache_key(shelf) for shelf in shelves}
+    cached = cache.get_many(list(keys.values()))
+    grids = {}
+    missing = []
+    for shelf in shelves:
+        grid = cached.get(keys[shelf.pk])
+        if grid is None:
+            missing.append(shelf)
+        else:
+            grids[shelf.pk] = grid
+
+    if missing:
+        records = placement_records_by_shelf(shelf.pk for shelf in missing)
+        built = {}
+        for shelf in missing:
+            grid = build_grid(shelf.rows, shelf.columns, records[shelf.pk])
+            grids[shelf.pk] = grid
+            built[keys[shelf.pk]] = grid
+        cache.set_many(built, GRID_CACHE_TIMEOUT)
+    return grids
@@ -0,0 +1,167 @@
+# ==================== shelves/services/live.py ====================
+
+import asyncio
+import json
+import threading
+import uuid
+from collections import deque
+
+from django.db import transaction
+
+
+# 棚ごとに保持する直近の差分の件数（再接続時に Last-Event-ID 以降を再送する）
+HISTORY_SIZE = 200
+# 接続維持のためのコメント行を送る間隔（秒）
+HEARTBEAT_SECONDS = 15
+# ブラウザが再接続するまでの待ち時間（ミリ秒）
+RETRY_MILLISECONDS = 3000
+# WSGI で画面が差分を取りに来る間隔（ミリ秒）。ストリームはワーカーを占有するため ASGI でのみ使う
+POLL_MILLISECONDS = 5000
+
+
+class Subscription:
+    """購読1件分の受信キュー（イベントループのキュー）"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+    def put(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+        except RuntimeError:
+            # 接続を閉じた後のイベントループには送らない
+            pass
+
+
+class ShelfBroker:
+    """プロセス内で棚ごとの配置差分を配信する
+
+    外部サービスを使わないため、配信先は同じプロセスで接続している画面に限られる
+    （複数プロセスで動かす場合は、同じ棚を編集する画面が同じプロセスにつながるようにする）。
+    イベントIDは「起動ごとのID-棚ごとの通し番号」で、別プロセス・再起動後のIDを受け取った場合は再同期を求める。
+    """
+
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._sequences = {}
+        self._subscribers = {}
+        self._history = {}
+
+    def event_id(self, sequence):
+        return f'{self.epoch}-{sequence}'
+
+    def last_event_id(self, shelf_id):
+        """棚に配信した最後のイベントID（画面の初回接続時に渡し、それ以降の差分を受け取る）"""
+        return self.event_id(self._sequences.get(shelf_id, 0))
+
+    def publish(self, shelf_id, payload):
+        data = json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+        with self._lock:
+            sequence = self._sequences[shelf_id] = self._sequences.get(shelf_id, 0) + 1
+            self._history.setdefault(shelf_id, deque(maxlen=HISTORY_SIZE)).append((sequence, data))
+            subscribers = list(self._subscribers.get(shelf_id, ()))
+        event = (self.event_id(sequence), data)
+        for subscription in subscribers:
+            subscription.put(event)
+
+    def subscribe(self, shelf_id, last_event_id, loop):
+        """購読を開始し、(購読, 取りこぼした差分) を返す（取りこぼしを再送できない場合は差分が None）"""
+        subscription = Subscription(loop)
+        with self._lock:
+            self._subscribers.setdefault(shelf_id, set()).add(subscription)
+            history = list(self._history.get(shelf_id, ()))
+        return subscription, self._missed(history, last_event_id)
+
+    def changes_since(self, shelf_id, last_event_id):
+        """購読せずに取りこぼした差分を返す（WSGI のポーリング用。再送できない場合は None）"""
+        with self._lock:
+            history = list(self._history.get(shelf_id, ()))
+        return self._missed(history, last_event_id)
+
+    def unsubscribe(self, shelf_id, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(shelf_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[shelf_id]
+
+    def subscriber_count(self, shelf_id):
+        with self._lock:
+            return len(self._subscribers.get(shelf_id, ()))
+
+    def _missed(self, history, last_event_id):
+        if not last_event_id:
+            return []
+        epoch, _, sequence = last_event_id.partition('-')
+        if epoch != self.epoch or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        # 通し番号は棚ごとのため、最古の差分より前から途切れていれば履歴からあふれた差分がある
+        if history and history[0][0] > sequence + 1:
+            return None
+        return [(self.event_id(number), data) for number, data in history if number > sequence]
+
+
+broker = ShelfBroker()
+
+
+def publish_changes(shelf_id, changed=(), removed=()):
+    """配置の差分をコミット後に配信する
+
+    changed: 変更・作成された配置（serialize_placement の形式）
+    removed: 削除・他の棚へ移動した配置ID
+    """
+    payload = {'changed': list(changed), 'removed': list(removed)}
+    if payload['changed'] or payload['removed']:
+        transaction.on_commit(lambda: broker.publish(shelf_id, payload))
+
+
+def _format(event_id, data, event='placements'):
+    return f'id: {event_id}\nevent: {event}\ndata: {data}\n\n'
+
+
+def _opening(shelf_id, missed):
+    yield f'retry: {RETRY_MILLISECONDS}\n\n'
+    if missed is None:
+        # 取りこぼしを再送できないため、画面に配置全体の再取得を求める
+        yield _format(broker.last_event_id(shelf_id), '{}', event='resync')
+    else:
+        for event_id, data in missed:
+            yield _format(event_id, data)
+
+
+async def astream(shelf_id, last_event_id=None):
+    """Server-Sent Events のストリーム（ASGI 用。待機中はスレッドを使わない）"""
+    subscription, missed = broker.subscribe(shelf_id, last_event_id, loop=asyncio.get_running_loop())
+    try:
+        for chunk in _opening(shelf_id, missed):
+            yield chunk
+        while True:
+            try:
+                event_id, data = await asyncio.wait_for(subscription.queue.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ': ping\n\n'
+                continue
+            yield _format(event_id, data)
+    finally:
+        broker.unsubscribe(shelf_id, subscription)
+
+
+
+def poll(shelf_id, last_event_id):
+    """WSGI 用に、取りこぼした差分と次回に渡すイベントIDを返す
+
+    ストリームはワーカーを占有するため、WSGI では画面が POLL_MILLISECONDS ごとに差分を取りに来る。
+    差分を再送できない場合は resync を返し、画面に配置全体の再取得を求める。
+    """
+    missed = broker.changes_since(shelf_id, last_event_id)
+    if missed is None:
+        return {'resync': True, 'events': [], 'last_event_id': broker.last_event_id(shelf_id)}
+    return {
+        'resync': False,
+        'events': [json.loads(data) for _, data in missed],
+        'last_event_id': missed[-1][0] if missed else last_event_id or broker.last_event_id(shelf_id),
+    }
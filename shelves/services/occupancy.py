@@ -0,0 +1,89 @@
+# ==================== shelves/services/occupancy.py ====================
+
+from ..models import ShelfPlacement
+
+
+class ShelfOccupancy:
+    """棚のセル占有インデックス
+
+    段ごとの占有ビットマスクと、セル→配置の対応表を保持する。
+    「矩形が空いているか」は占有段数分のビット演算、
+    「このセルを占有している配置は何か」は配列参照で判定できる。
+    """
+
+    def __init__(self, rows, columns):
+        self.rows = rows
+        self.columns = columns
+        self._row_masks = [0] * rows
+        self._cells = [None] * (rows * columns)
+
+    @classmethod
+    def for_shelf(cls, shelf):
+        """棚の配置を1クエリで読み込んでインデックスを構築（値は配置ID）"""
+        occupancy = cls(shelf.rows, shelf.columns)
+        placements = ShelfPlacement.objects.filter(shelf=shelf).values_list(
+            'id', 'row', 'column', 'span_rows', 'span_columns'
+        )
+        for placement_id, row, column, span_rows, span_columns in placements:
+            occupancy.add(placement_id, row, column, span_rows, span_columns)
+        return occupancy
+
+    def _span_mask(self, column, span_columns):
+        return ((1 << span_columns) - 1) << column
+
+    def _clip(self, row, column, span_rows, span_columns):
+        """棚の範囲内に収まる部分だけを返す"""
+        last_row = min(row + span_rows, self.rows)
+        last_column = min(column + span_columns, self.columns)
+        return range(max(row, 0), last_row), max(column, 0), max(last_column - max(column, 0), 0)
+
+    def in_bounds(self, row, column, span_rows=1, span_columns=1):
+        return (
+            row >= 0 and column >= 0
+            and row + span_rows <= self.rows
+            and column + span_columns <= self.columns
+        )
+
+    def add(self, owner, row, column, span_rows=1, span_columns=1):
+        rows, column, width = self._clip(row, column, span_rows, span_columns)
+        mask = self._span_mask(column, width)
+        for r in rows:
+            self._row_masks[r] |= mask
+            offset = r * self.columns
+            for c in range(column, column + width):
+                self._cells[offset + c] = owner
+
+    def remove(self, owner, row, column, span_rows=1, span_columns=1):
+        rows, column, width = self._clip(row, column, span_rows, span_columns)
+        for r in rows:
+            offset = r * self.columns
+            for c in range(column, column + width):
+                if self._cells[offset + c] == owner:
+                    self._cells[offset + c] = None
+                    self._row_masks[r] &= ~(1 << c)
+
+    def is_free(self, row, column, span_rows=1, span_columns=1, ignore=None):
+        """矩形が棚の範囲内かつ空いているか（ignore の配置が占有するセルは空きとみなす）"""
+        if not self.in_bounds(row, column, span_rows, span_columns):
+            return False
+        mask = self._span_mask(column, span_columns)
+        for r in range(row, row + span_rows):
+            if not self._row_masks[r] & mask:
+                continue
+            if ignore is None:
+                return False
+            offset = r * self.columns
+            for c in range(column, column + span_columns):
+                occupant = self._cells[offset + c]
+                if occupant is not None and occupant != ignore:
+                    return False
+        return True
+
+    def covering(self, row, column):
+        """セルを占有している配置（なければ None）"""
+        if 0 <= row < self.rows and 0 <= column < self.columns:
+            return self._cells[row * self.columns + column]
+        return None
+
+    def occupied_count(self):
+        return sum(bin(mask).count('1') for mask in self._row_masks)
@@ -0,0 +1,376 @@
+# ==================== shelves/services/optimizer.py ====================
+
+import math
+import random
+import time
+from collections import namedtuple
+
+from django.core.exceptions import ValidationError
+
+from products.models import Category, Product
+from ..models import ShelfPlacement
+from .occupancy import ShelfOccupancy
+from .placements import BatchPlacement
+
+
+DEFAULT_TIME_BUDGET_MS = 300
+MAX_TIME_BUDGET_MS = 3000
+DEFAULT_MAX_FACES = 4
+MAX_CANDIDATES = 10000
+
+# 評価値の重み（充填率を基準に、シェア目標からの乖離とブロックの分断を減点する）
+WEIGHT_FILL = 1.0
+WEIGHT_LINEAR = 0.5
+WEIGHT_SHARE = 1.0
+WEIGHT_FRAGMENT = 0.05
+
+# 配置候補（span_rows × span_columns セルに faces フェースを並べる）
+Candidate = namedtuple('Candidate', [
+    'product_id', 'is_own', 'maker_id', 'brand_id', 'category_key',
+    'span_rows', 'span_columns', 'faces', 'linear_cm', 'fill_ratio',
+])
+# 配置案の1件
+PlannedPlacement = namedtuple('PlannedPlacement', ['candidate', 'row', 'column'])
+
+
+def load_candidates(shelf, product_ids=None, category_id=None, maker_id=None, exclude_ids=(), max_faces=DEFAULT_MAX_FACES):
+    """候補商品を読み込み、棚のセル寸法から占有セル数とフェース数を決める（1クエリ）
+
+    高さ・奥行が棚に収まらない商品は除外する。幅・高さが未登録の商品は1セル1フェースとみなす。
+    """
+    queryset = Product.objects.filter(is_active=True)
+    if product_ids is not None:
+        queryset = queryset.filter(id__in=product_ids)
+    if category_id:
+        queryset = queryset.filter(Category.subtree_q(category_id))
+    if maker_id:
+        queryset = queryset.filter(maker_id=maker_id)
+    if exclude_ids:
+        queryset = queryset.exclude(id__in=exclude_ids)
+
+    cell_width = shelf.width / shelf.columns
+    cell_height = shelf.height / shelf.rows
+    candidates = []
+    rows = queryset.order_by('id').values_list(
+        'id', 'width', 'height', 'depth', 'is_own_product', 'maker_id', 'brand_id', 'category__path',
+    )[:MAX_CANDIDATES]
+    for product_id, width, height, depth, is_own, maker, brand, category_path in rows:
+        if (height and height > shelf.height) or (depth and depth > shelf.depth):
+            continue
+        span_rows = max(1, math.ceil(height / cell_height)) if height else 1
+        span_columns = max(1, math.ceil(width / cell_width)) if width else 1
+        if span_rows > shelf.rows or span_columns > shelf.columns:
+            continue
+        footprint_width = cell_width * span_columns
+        faces = max(1, min(max_faces, int(footprint_width // width))) if width else 1
+        linear_cm = faces * (width or cell_width)
+        candidates.append(Candidate(
+            product_id, is_own, maker, brand if brand is not None else 0, category_path or '',
+            span_rows, span_columns, faces, linear_cm, min(linear_cm / footprint_width, 1.0),
+        ))
+    return candidates
+
+
+class ShelfOptimizer:
+    """棚の自動配置
+
+    1. 候補を充填効率の順に並べ、自社シェア目標を満たすよう自社・競合を交互に選ぶ（貪欲法）
+    2. カテゴリ・ブランド順に並べ替え、蛇行順（偶数段は左から、奇数段は右から）に詰める
+       → 同じカテゴリ・ブランドが隣り合うブロックになる
+    3. 残りの時間予算で選定を入れ替える局所探索を行い、評価値が上がった案を採用する
+    時間予算内に改善が無ければ貪欲法の案をそのまま返す。
+    """
+
+    def __init__(self, shelf, candidates, own_share_target=None, brand_blocking=True,
+                 category_adjacency=True, fixed_areas=(), seed=None):
+        self.shelf = shelf
+        self.rows = shelf.rows
+        self.columns = shelf.columns
+        self.own_share_target = own_share_target
+        self.brand_blocking = brand_blocking
+        self.category_adjacency = category_adjacency
+        self.fixed_areas = list(fixed_areas)
+        self.random = random.Random(shelf.pk if seed is None else seed)
+
+        # 充填効率の高い順（同率なら小さい占有・商品ID順）
+        def efficiency(candidate):
+            return (-candidate.fill_ratio, candidate.span_rows * candidate.span_columns, candidate.product_id)
+
+        self.own_pool = sorted((c for c in candidates if c.is_own), key=efficiency)
+        self.competitor_pool = sorted((c for c in candidates if not c.is_own), key=efficiency)
+        self.free_cells = self.rows * self.columns - sum(area[2] * area[3] for area in self.fixed_areas)
+
+        # 蛇行順のセル位置
+        self.snake = [
+            (row, column)
+            for row in range(self.rows)
+            for column in (range(self.columns) if row % 2 == 0 else reversed(range(self.columns)))
+        ]
+
+    # ---------- 選定 ----------
+
+    def _select(self, own_pool, competitor_pool):
+        """空きセル数の範囲で候補を選ぶ（自社シェア目標があればフェース比で自社・競合を選び分ける）"""
+        selected = []
+        used = own_faces = total_faces = 0
+        pools = {True: list(own_pool), False: list(competitor_pool)}
+        positions = {True: 0, False: 0}
+
+        def next_fitting(is_own):
+            pool = pools[is_own]
+            while positions[is_own] < len(pool):
+                candidate = pool[positions[is_own]]
+                positions[is_own] += 1
+                if candidate.span_rows * candidate.span_columns <= self.free_cells - used:
+                    return candidate
+            return None
+
+        while used < self.free_cells:
+            if self.own_share_target is None:
+                # 目標が無い場合は両方の先頭から効率の良い方を選ぶ
+                heads = [
+                    pools[flag][positions[flag]] for flag in (True, False) if positions[flag] < len(pools[flag])
+                ]
+                if not heads:
+                    break
+                want_own = min(heads, key=lambda c: (-c.fill_ratio, c.product_id)).is_own
+            else:
+                want_own = (own_faces * 100 < self.own_share_target * total_faces) or total_faces == 0 and self.own_share_target > 0
+            candidate = next_fitting(want_own) or next_fitting(not want_own)
+            if candidate is None:
+                break
+            selected.append(candidate)
+            used += candidate.span_rows * candidate.span_columns
+            total_faces += candidate.faces
+            if candidate.is_own:
+                own_faces += candidate.faces
+        return selected
+
+    # ---------- 配置 ----------
+
+    def _order(self, selected):
+        """カテゴリ隣接・ブランドブロックの順に並べる（高さのある商品は各ブロックの先頭に置く）"""
+        def key(candidate):
+            return (
+                candidate.category_key if self.category_adjacency else '',
+                candidate.brand_id if self.brand_blocking else 0,
+                candidate.maker_id if self.brand_blocking else 0,
+                -candidate.span_rows,
+                -candidate.span_columns,
+                candidate.product_id,
+            )
+        return sorted(selected, key=key)
+
+    def _pack(self, ordered):
+        """蛇行順に先頭から詰める（前方に入らない商品は手前の空きを探す）"""
+        occupancy = ShelfOccupancy(self.rows, self.columns)
+        for area in self.fixed_areas:
+            occupancy.add(None, *area)
+        plan = []
+        unplaced = []
+        cursor = head = 0
+        # 入らなかった大きさ（これ以上の大きさの商品も入らない）
+        failed = []
+        for candidate in ordered:
+            size = (candidate.span_rows, candidate.span_columns)
+            if any(size[0] >= rows and size[1] >= columns for rows, columns in failed):
+                unplaced.append(candidate)
+                continue
+            index = self._find(occupancy, candidate, cursor, len(self.snake))
+            if index is None:
+                # 先頭の空きセルより前には入らないため、そこから探す
+                while head < cursor and occupancy.covering(*self.snake[head]) is not None:
+                    head += 1
+                index = self._find(occupancy, candidate, head, cursor)
+                if index is None:
+                    failed.append(size)
+                    unplaced.append(candidate)
+                    continue
+            else:
+                cursor = index + 1
+            row, column = self._anchor(index, candidate)
+            occupancy.add(candidate, row, column, candidate.span_rows, candidate.span_columns)
+            plan.append(PlannedPlacement(candidate, row, column))
+        return plan, unplaced
+
+    def _anchor(self, index, candidate):
+        """蛇行順の位置から左上のセルを求める（右から詰める段では左に伸ばす）"""
+        row, column = self.snake[index]
+        if row % 2 == 1:
+            column = column - candidate.span_columns + 1
+        return row, column
+
+    def _find(self, occupancy, candidate, start, stop):
+        span_rows, span_columns = candidate.span_rows, candidate.span_columns
+        last_row = self.rows - span_rows
+        for index in range(start, stop):
+            row, column = self.snake[index]
+            if row > last_row:
+                break
+            if row % 2 == 1:
+                column -= span_columns - 1
+            if column >= 0 and occupancy.is_free(row, column, span_rows, span_columns):
+                return index
+        return None
+
+    # ---------- 評価 ----------
+
+    def _brand_key(self, candidate):
+        # カテゴリを隣接させる場合は、カテゴリ内でブランドがまとまっているかを見る
+        brand = (candidate.maker_id, candidate.brand_id)
+        return (candidate.category_key, brand) if self.category_adjacency else brand
+
+    def _cell_owners(self, plan):
+        """セル → 配置案の番号（空きセルは -1）"""
+        owners = [-1] * (self.rows * self.columns)
+        for index, placement in enumerate(plan):
+            for row in range(placement.row, placement.row + placement.candidate.span_rows):
+                offset = row * self.columns
+                for column in range(placement.column, placement.column + placement.candidate.span_columns):
+                    owners[offset + column] = index
+        return owners
+
+    def _fragments(self, plan, owners, key):
+        """同じ値の商品が上下左右に隣接するまとまりの数から値の種類数を引いた値（0なら各値が1ブロック）"""
+        keys = [key(placement.candidate) for placement in plan]
+        parent = list(range(len(plan)))
+
+        def find(index):
+            while parent[index] != index:
+                parent[index] = parent[parent[index]]
+                index = parent[index]
+            return index
+
+        columns = self.columns
+        for cell, owner in enumerate(owners):
+            if owner < 0:
+                continue
+            for neighbour in (cell + 1 if (cell + 1) % columns else -1, cell + columns):
+                if 0 <= neighbour < len(owners):
+                    other = owners[neighbour]
+                    if other >= 0 and other != owner and keys[other] == keys[owner]:
+                        parent[find(other)] = find(owner)
+        components = len({find(index) for index in range(len(plan))})
+        return components - len(set(keys))
+
+    def score(self, plan):
+        owners = self._cell_owners(plan)
+        cells = sum(p.candidate.span_rows * p.candidate.span_columns for p in plan)
+        faces = sum(p.candidate.faces for p in plan)
+        own_faces = sum(p.candidate.faces for p in plan if p.candidate.is_own)
+        linear = sum(p.candidate.linear_cm * p.candidate.span_rows for p in plan)
+        own_share = own_faces / faces * 100 if faces else 0
+        result = {
+            'fill_rate': round(cells / self.free_cells * 100, 1) if self.free_cells else 0,
+            'linear_rate': round(min(linear / (self.shelf.width * self.rows), 1.0) * 100, 1),
+            'own_share': round(own_share, 1),
+            'brand_fragments': self._fragments(plan, owners, self._brand_key),
+            'category_fragments': self._fragments(plan, owners, lambda c: c.category_key),
+        }
+        value = WEIGHT_FILL * result['fill_rate'] / 100 + WEIGHT_LINEAR * result['linear_rate'] / 100
+        if self.own_share_target is not None:
+            value -= WEIGHT_SHARE * abs(own_share - self.own_share_target) / 100
+        if self.brand_blocking:
+            value -= WEIGHT_FRAGMENT * result['brand_fragments']
+        if self.category_adjacency:
+            value -= WEIGHT_FRAGMENT * result['category_fragments']
+        result['value'] = round(value, 4)
+        return result
+
+    # ---------- 探索 ----------
+
+    def _mutate(self, selected):
+        """選定済みの1件を、同じ区分の未選定の候補と入れ替える"""
+        index = self.random.randrange(len(selected))
+        removed = selected[index]
+        pool = self.own_pool if removed.is_own else self.competitor_pool
+        chosen = {c.product_id for c in selected}
+        for _ in range(8):
+            replacement = pool[self.random.randrange(len(pool))]
+            if replacement.product_id not in chosen:
+                mutated = list(selected)
+                mutated[index] = replacement
+                return mutated
+        return None
+
+    def optimize(self, time_budget_ms=DEFAULT_TIME_BUDGET_MS):
+        started = time.perf_counter()
+        deadline = started + time_budget_ms / 1000
+
+        selected = self._select(self.own_pool, self.competitor_pool)
+        plan, unplaced = self._pack(self._order(selected))
+        best = (self.score(plan), plan, selected)
+        iterations = improvements = 0
+
+        while selected and time.perf_counter() < deadline:
+            iterations += 1
+            mutated = self._mutate(best[2])
+            if mutated is None:
+                continue
+            plan, _ = self._pack(self._order(mutated))
+            score = self.score(plan)
+            if score['value'] > best[0]['value']:
+                best = (score, plan, mutated)
+                improvements += 1
+
+        score, plan, _ = best
+        return {
+            'plan': plan,
+            'score': score,
+            'candidates': len(self.own_pool) + len(self.competitor_pool),
+            'iterations': iterations,
+            'improvements': improvements,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+        }
+
+
+def plan_to_operations(plan):
+    return [
+        {
+            'op': 'place',
+            'product_id': p.candidate.product_id,
+            'row': p.row,
+            'column': p.column,
+            'span_rows': p.candidate.span_rows,
+            'span_columns': p.candidate.span_columns,
+            'face_count': p.candidate.faces,
+        }
+        for p in plan
+    ]
+
+
+def auto_arrange(shelf, product_ids=None, category_id=None, maker_id=None, own_share_target=None,
+                 brand_blocking=True, category_adjacency=True, replace=True, max_faces=DEFAULT_MAX_FACES,
+                 time_budget_ms=DEFAULT_TIME_BUDGET_MS, apply=False, user=None):
+    """棚の自動配置案を作成し、apply=True なら一括更新で書き込む
+
+    replace=True なら既存の配置をすべて置き換え、False なら空きセルにだけ配置する。
+    """
+    if own_share_target is not None and not 0 <= own_share_target <= 100:
+        raise ValidationError('自社シェア目標は0〜100で指定してください')
+    time_budget_ms = min(max(int(time_budget_ms), 0), MAX_TIME_BUDGET_MS)
+
+    existing = list(ShelfPlacement.objects.filter(shelf=shelf).values_list(
+        'id', 'product_id', 'row', 'column', 'span_rows', 'span_columns',
+    ))
+    fixed_areas = [] if replace else [area[2:] for area in existing]
+    candidates = load_candidates(
+        shelf, product_ids=product_ids, category_id=category_id, maker_id=maker_id,
+        exclude_ids=[] if replace else [placement[1] for placement in existing], max_faces=max_faces,
+    )
+    if not candidates:
+        raise ValidationError('配置できる候補商品がありません')
+
+    result = ShelfOptimizer(
+        shelf, candidates, own_share_target=own_share_target, brand_blocking=brand_blocking,
+        category_adjacency=category_adjacency, fixed_areas=fixed_areas,
+    ).optimize(time_budget_ms)
+
+    operations = plan_to_operations(result['plan'])
+    result['plan'] = operations
+    result['applied'] = False
+    if apply and operations:
+        removals = [{'op': 'remove', 'placement_id': placement[0]} for placement in existing] if replace else []
+        result.update(BatchPlacement(shelf, user=user).apply(removals + operations))
+        result['applied'] = True
+    return result
@@ -0,0 +1,226 @@
+# ==================== shelves/services/placements.py ====================
+
+from django.core.exceptions import ValidationError
+
+from config.database import write_transaction
+from products.models import Product
+from ..models import ShelfPlacement
+from .occupancy import ShelfOccupancy
+from . import live, stats, versions
+
+
+PLACEMENT_FIELDS = ['row', 'column', 'face_count', 'span_rows', 'span_columns']
+
+BATCH_OPERATIONS = ('place', 'move', 'remove', 'resize', 'face_count')
+
+
+def serialize_placement(placement):
+    """配置をJSONレスポンス用の辞書に変換"""
+    product = placement.product
+    return {
+        'id': placement.id,
+        'product_id': product.id,
+        'product_name': product.product_name,
+        'maker_name': product.maker.name,
+        'is_own_product': product.is_own_product,
+        'row': placement.row,
+        'column': placement.column,
+        'face_count': placement.face_count,
+        'span_rows': placement.span_rows,
+        'span_columns': placement.span_columns,
+        'image_url': product.thumbnail_url,
+    }
+
+
+def _area(placement):
+    return placement.row, placement.column, placement.span_rows, placement.span_columns
+
+
+def _int_value(operation, key, default=None, minimum=1):
+    value = operation.get(key, default)
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError(f'{key} が不正です')
+    if value < minimum:
+        raise ValidationError(f'{key} は{minimum}以上で指定してください')
+    return value
+
+
+class BatchPlacement:
+    """棚配置の一括更新
+
+    配置の読み込みから、操作のメモリ上での検証・適用、削除・一括作成・一括更新の書き込みまでを
+    1トランザクションで行う。
+    """
+
+    def __init__(self, shelf, user=None):
+        self.shelf = shelf
+        self.user = user
+
+    def _load(self):
+        """棚の現在の配置と占有状況を読み込む（apply のトランザクション内で呼ぶ）"""
+        self.shelf.refresh_from_db(fields=['rows', 'columns'])
+        self.placements = {
+            placement.id: placement
+            for placement in ShelfPlacement.objects.filter(shelf=self.shelf).select_related('product', 'product__maker')
+        }
+        self.occupancy = ShelfOccupancy(self.shelf.rows, self.shelf.columns)
+        for placement in self.placements.values():
+            self.occupancy.add(placement, *_area(placement))
+        self.created = []
+        self.updated = {}
+        self.moved = set()
+        self.removed = set()
+
+    def _get_placement(self, operation):
+        placement_id = _int_value(operation, 'placement_id')
+        placement = self.placements.get(placement_id)
+        if placement is None:
+            raise ValidationError('指定された配置が見つかりません')
+        return placement
+
+    def _check_area(self, row, column, span_rows, span_columns, ignore=None):
+        if row >= self.shelf.rows or column >= self.shelf.columns:
+            raise ValidationError('配置位置が範囲外です')
+        if row + span_rows > self.shelf.rows or column + span_columns > self.shelf.columns:
+            raise ValidationError('占有サイズが棚の範囲を超えています')
+        if not self.occupancy.is_free(row, column, span_rows, span_columns, ignore=ignore):
+            raise ValidationError('この位置には既に商品が配置されています')
+
+    def _mark_updated(self, placement):
+        if placement.id is not None:
+            self.updated[placement.id] = placement
+
+    def place(self, operation, products):
+        product = products.get(_int_value(operation, 'product_id'))
+        if product is None:
+            raise ValidationError('指定された商品が見つかりません')
+        row = _int_value(operation, 'row', minimum=0)
+        column = _int_value(operation, 'column', minimum=0)
+        span_rows = _int_value(operation, 'span_rows', 1)
+        span_columns = _int_value(operation, 'span_columns', 1)
+        self._check_area(row, column, span_rows, span_columns)
+
+        placement = ShelfPlacement(
+            shelf=self.shelf,
+            product=product,
+            row=row,
+            column=column,
+            face_count=_int_value(operation, 'face_count', 1),
+            span_rows=span_rows,
+            span_columns=span_columns,
+            created_by=self.user,
+        )
+        self.occupancy.add(placement, row, column, span_rows, span_columns)
+        self.created.append(placement)
+
+    def move(self, operation, products):
+        placement = self._get_placement(operation)
+        row = _int_value(operation, 'row', minimum=0)
+        column = _int_value(operation, 'column', minimum=0)
+        self._check_area(row, column, placement.span_rows, placement.span_columns, ignore=placement)
+
+        self.occupancy.remove(placement, *_area(placement))
+        placement.row = row
+        placement.column = column
+        self.occupancy.add(placement, *_area(placement))
+        if placement.id is not None:
+            self.moved.add(placement.id)
+        self._mark_updated(placement)
+
+    def remove(self, operation, products):
+        placement = self._get_placement(operation)
+        self.occupancy.remove(placement, *_area(placement))
+        del self.placements[placement.id]
+        self.updated.pop(placement.id, None)
+        self.moved.discard(placement.id)
+        self.removed.add(placement.id)
+
+    def resize(self, operation, products):
+        placement = self._get_placement(operation)
+        span_rows = _int_value(operation, 'span_rows', placement.span_rows)
+        span_columns = _int_value(operation, 'span_columns', placement.span_columns)
+        self._check_area(placement.row, placement.column, span_rows, span_columns, ignore=placement)
+
+        self.occupancy.remove(placement, *_area(placement))
+        placement.span_rows = span_rows
+        placement.span_columns = span_columns
+        self.occupancy.add(placement, *_area(placement))
+        self._mark_updated(placement)
+
+    def face_count(self, operation, products):
+        placement = self._get_placement(operation)
+        placement.face_count = _int_value(operation, 'face_count')
+        self._mark_updated(placement)
+
+    def apply(self, operations):
+        """操作リストを検証・適用して書き込む
+
+        検証エラーは ValidationError（params['index'] に操作番号）として送出し、
+        その場合は何も書き込まない。
+        """
+        if not isinstance(operations, list) or not operations:
+            raise ValidationError('操作が指定されていません')
+
+        result = self._apply(operations)
+        # 同じ棚を開いている他の画面へ差分を配信（コミット後）
+        live.publish_changes(self.shelf.pk, result['changed'], result['removed'])
+        return result
+
+    @write_transaction
+    def _apply(self, operations):
+        # 配置の読み込みから検証・書き込みまでを1トランザクション（SQLite では BEGIN IMMEDIATE）で行う。
+        # 読み込みをトランザクション外で行うと、同時に実行された一括更新が互いに古い占有状況で検証し、
+        # 複数セルを占有する配置が重なったまま書き込まれる
+        self._load()
+        product_ids = {
+            operation.get('product_id')
+            for operation in operations
+            if isinstance(operation, dict) and operation.get('op') == 'place'
+        }
+        products = Product.objects.filter(id__in=[pid for pid in product_ids if pid], is_active=True).select_related('maker')
+        products = {product.id: product for product in products}
+
+        for index, operation in enumerate(operations):
+            op = operation.get('op') if isinstance(operation, dict) else None
+            if op not in BATCH_OPERATIONS:
+                raise ValidationError(f'{index + 1}件目: 不明な操作です', params={'index': index})
+            try:
+                getattr(self, op)(operation, products)
+            except ValidationError as e:
+                raise ValidationError(f'{index + 1}件目: {e.messages[0]}', params={'index': index})
+
+        self._save()
+        return {
+            'changed': [serialize_placement(p) for p in self.created + list(self.updated.values())],
+            'removed': sorted(self.removed),
+        }
+
+    def _save(self):
+        # 配置の書き込み中はシグナルによる差分更新を止め、最後に統計をまとめて保存する
+        with stats.stats_suspended():
+            self._write_placements()
+        stats.save_stats(self.shelf, stats.compute_stats(list(self.placements.values()) + self.created))
+        versions.bump_versions([self.shelf.pk])
+
+    def _write_placements(self):
+        if self.removed:
+            ShelfPlacement.objects.filter(shelf=self.shelf, id__in=self.removed).delete()
+
+        if self.moved:
+            # (shelf, row, column) の一意制約に入れ替え途中で抵触しないよう、
+            # 移動する配置を一旦棚外の仮座標に退避してから最終位置へ更新する
+            moved = [self.updated[placement_id] for placement_id in self.moved]
+            targets = [(p.row, p.column) for p in moved]
+            for offset, placement in enumerate(moved, start=1):
+                placement.row = placement.column = -offset
+            ShelfPlacement.objects.bulk_update(moved, ['row', 'column'])
+            for placement, (row, column) in zip(moved, targets):
+                placement.row, placement.column = row, column
+
+        if self.updated:
+            ShelfPlacement.objects.bulk_update(list(self.updated.values()), PLACEMENT_FIELDS)
+
+        if self.created:
+            self.created = ShelfPlacement.objects.bulk_create(self.created)
@@ -0,0 +1,211 @@
+# ==================== shelves/services/simulation.py ====================
+
+import numpy as np
+
+from products.services import masters
+from shelves.models import Shelf, ShelfPlacement
+
+
+# 棚をまとめて読み込む際の IN 句の最大件数
+SHELF_BATCH_SIZE = 500
+# ブランド未設定など、IDが無い項目の値
+NO_ID = -1
+
+GROUPS = {
+    'maker': ('maker_ids', 'maker'),
+    'brand': ('brand_ids', 'brand'),
+    'category': ('category_ids', 'category'),
+}
+
+
+class PlacementArrays:
+    """配置1件を1要素とする NumPy 配列の集まり（棚の情報は shelf_index で参照する）
+
+    集計はすべて配列演算（bincount 等）で行うため、数百棚分でも数ミリ秒で終わる。
+    """
+
+    def __init__(self, shelves, rows):
+        self.shelf_ids = np.array([shelf[0] for shelf in shelves], dtype=np.int64)
+        self.shelf_width = np.array([shelf[1] for shelf in shelves], dtype=np.float64)
+        self.shelf_rows = np.array([shelf[2] for shelf in shelves], dtype=np.int64)
+        shelf_columns = np.array([shelf[3] for shelf in shelves], dtype=np.int64)
+        position = {shelf_id: index for index, shelf_id in enumerate(self.shelf_ids.tolist())}
+
+        count = len(rows)
+        columns = list(zip(*rows)) if rows else [()] * 12
+        self.placement_ids = np.array(columns[0], dtype=np.int64)
+        self.shelf_index = np.fromiter((position[shelf_id] for shelf_id in columns[1]), dtype=np.int64, count=count)
+        self.row = np.array(columns[2], dtype=np.int64)
+        self.span_rows = np.array(columns[3], dtype=np.int64)
+        span_columns = np.array(columns[4], dtype=np.int64)
+        self.face_count = np.array(columns[5], dtype=np.int64)
+        self.product_ids = np.array(columns[6], dtype=np.int64)
+        self.maker_ids = np.array(columns[7], dtype=np.int64)
+        self.brand_ids = np.array([NO_ID if value is None else value for value in columns[8]], dtype=np.int64)
+        self.category_ids = np.array(columns[9], dtype=np.int64)
+        self.own = np.array(columns[10], dtype=bool)
+        width = np.array([np.nan if value is None else value for value in columns[11]], dtype=np.float64)
+
+        # 商品幅が未登録の場合は、占有セルの幅をフェース数で割った値を1フェースの幅とみなす
+        cell_width = self.shelf_width[self.shelf_index] / shelf_columns[self.shelf_index] * span_columns
+        fallback = cell_width / np.maximum(self.face_count, 1)
+        self.unit_width = np.where(np.isnan(width), fallback, width)
+
+    def __len__(self):
+        return len(self.placement_ids)
+
+    def linear_cm(self, face_count=None):
+        """配置ごとの直線cm（商品幅 × フェース数）"""
+        return self.unit_width * (self.face_count if face_count is None else face_count)
+
+
+def load_placements(shelf_ids):
+    """複数棚の配置を配列に読み込む（棚と配置をそれぞれ SHELF_BATCH_SIZE 棚ごとに1クエリ）"""
+    shelf_ids = list(dict.fromkeys(shelf_ids))
+    shelves = []
+    rows = []
+    for start in range(0, len(shelf_ids), SHELF_BATCH_SIZE):
+        batch = shelf_ids[start:start + SHELF_BATCH_SIZE]
+        shelves.extend(Shelf.objects.filter(pk__in=batch).order_by('pk').values_list('pk', 'width', 'rows', 'columns'))
+        rows.extend(ShelfPlacement.objects.filter(shelf_id__in=batch).values_list(
+            'id', 'shelf_id', 'row', 'span_rows', 'span_columns', 'face_count',
+            'product_id', 'product__maker_id', 'product__brand_id', 'product__category_id',
+            'product__is_own_product', 'product__width',
+        ))
+    return PlacementArrays(shelves, rows)
+
+
+def _group_totals(keys, weights):
+    """キーごとの合計（np.unique + bincount）"""
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return unique, np.bincount(inverse, weights=weights, minlength=len(unique))
+
+
+def _label(kind, pk):
+    obj = masters.get(kind, pk)
+    if obj is None:
+        return '未設定' if pk == NO_ID else str(pk)
+    return getattr(obj, 'full_name', None) or obj.name
+
+
+def share_by(data, group, face_count=None):
+    """メーカー・ブランド・カテゴリ別の直線cmシェア（直線cmの大きい順）"""
+    attr, kind = GROUPS[group]
+    linear = data.linear_cm(face_count)
+    total = linear.sum()
+    keys, totals = _group_totals(getattr(data, attr), linear)
+    order = np.argsort(-totals, kind='stable')
+    return [
+        {
+            'id': int(keys[index]) if keys[index] != NO_ID else None,
+            'name': _label(kind, int(keys[index])),
+            'linear_cm': round(float(totals[index]), 1),
+            'share': round(float(totals[index] / total * 100), 1) if total else 0,
+        }
+        for index in order
+    ]
+
+
+def own_share(data, face_count=None):
+    """自社・競合の直線cmとフェースのシェア"""
+    faces = data.face_count if face_count is None else face_count
+    linear = data.linear_cm(faces)
+    own_linear = float(linear[data.own].sum())
+    total_linear = float(linear.sum())
+    own_faces = int(faces[data.own].sum())
+    total_faces = int(faces.sum())
+    return {
+        'own_linear_cm': round(own_linear, 1),
+        'competitor_linear_cm': round(total_linear - own_linear, 1),
+        'own_linear_share': round(own_linear / total_linear * 100, 1) if total_linear else 0,
+        'own_faces': own_faces,
+        'competitor_faces': total_faces - own_faces,
+        'own_face_share': round(own_faces / total_faces * 100, 1) if total_faces else 0,
+    }
+
+
+def row_fill(data, face_count=None):
+    """段ごとの充填率（段に並ぶ直線cm ÷ 棚幅）を [棚, 段] の配列で返す
+
+    複数段を占有する配置は、占有する各段に同じ幅を計上する。
+    """
+    max_rows = int(data.shelf_rows.max()) if len(data.shelf_rows) else 0
+    fill = np.zeros((len(data.shelf_ids), max_rows))
+    if len(data):
+        linear = data.linear_cm(face_count)
+        repeats = np.maximum(data.span_rows, 1)
+        # 占有する段の数だけ配置を繰り返し、各段の位置を求める
+        offsets = np.arange(repeats.sum()) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        rows = np.repeat(data.row, repeats) + offsets
+        shelves = np.repeat(data.shelf_index, repeats)
+        valid = rows < data.shelf_rows[shelves]
+        np.add.at(fill, (shelves[valid], rows[valid]), np.repeat(linear, repeats)[valid])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fill = np.where(data.shelf_width[:, None] > 0, fill / data.shelf_width[:, None], 0)
+    # 棚の段数を超える位置は対象外
+    fill[np.arange(max_rows)[None, :] >= data.shelf_rows[:, None]] = np.nan
+    return fill
+
+
+def _row_fill_summary(data, fill):
+    return [
+        {
+            'shelf_id': int(shelf_id),
+            'rows': [round(float(value) * 100, 1) for value in fill[index, :data.shelf_rows[index]]],
+            'overflow_rows': [int(row) for row in np.flatnonzero(fill[index, :data.shelf_rows[index]] > 1)],
+        }
+        for index, shelf_id in enumerate(data.shelf_ids)
+    ]
+
+
+SCENARIO_OPS = ('add_faces', 'set_faces', 'remove')
+
+
+def apply_changes(data, changes):
+    """フェース数変更のシナリオを適用したフェース数の配列を返す（元の配列は変更しない）
+
+    changes: [{"op": "add_faces", "product_id": 1, "faces": 2, "shelf_id": 任意}, ...]
+    op は add_faces（増減）/ set_faces（指定数に変更）/ remove（配置を外す）。
+    product_id（と shelf_id）に一致するすべての配置に適用する。
+    """
+    faces = data.face_count.copy()
+    for index, change in enumerate(changes):
+        if not isinstance(change, dict):
+            raise ValueError(f'{index + 1}件目: 操作の形式が不正です')
+        op = change.get('op')
+        if op not in SCENARIO_OPS:
+            raise ValueError(f'{index + 1}件目: 不明な操作です: {op}')
+        try:
+            mask = data.product_ids == int(change['product_id'])
+            if change.get('shelf_id') is not None:
+                mask &= data.shelf_ids[data.shelf_index] == int(change['shelf_id'])
+            value = int(change.get('faces', 0))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f'{index + 1}件目: 商品・フェース数の指定が不正です')
+        if op == 'add_faces':
+            faces[mask] += value
+        elif op == 'set_faces':
+            faces[mask] = value
+        else:
+            faces[mask] = 0
+    return np.maximum(faces, 0)
+
+
+def summarize(data, face_count=None, group='maker'):
+    return {
+        'placements': int(np.count_nonzero(data.face_count if face_count is None else face_count)),
+        'own': own_share(data, face_count),
+        'share': share_by(data, group, face_count),
+        'row_fill': _row_fill_summary(data, row_fill(data, face_count)),
+    }
+
+
+def simulate(shelf_ids, changes=(), group='maker'):
+    """棚割りシミュレーション（現状と、シナリオ適用後の直線cmシェア・段ごとの充填率）"""
+    if group not in GROUPS:
+        raise ValueError(f'不明な集計単位です: {group}')
+    data = load_placements(shelf_ids)
+    result = {'shelf_count': len(data.shelf_ids), 'baseline': summarize(data, group=group)}
+    if changes:
+        result['scenario'] = summarize(data, apply_changes(data, changes), group=group)
+    return result
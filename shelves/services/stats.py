@@ -0,0 +1,123 @@
+# ==================== shelves/services/stats.py ====================
+
+import threading
+from contextlib import contextmanager
+
+from django.db.models import Count, F, Q, Sum
+
+from ..models import Shelf, ShelfPlacement, ShelfStats
+
+
+STATS_FIELDS = [
+    'occupied_cells', 'own_products_count', 'competitor_products_count',
+    'own_faces', 'competitor_faces',
+]
+
+_state = threading.local()
+
+
+@contextmanager
+def stats_suspended():
+    """シグナルによる差分更新を一時停止（一括処理で最後にまとめて書き込む場合）"""
+    previous = getattr(_state, 'suspended', False)
+    _state.suspended = True
+    try:
+        yield
+    finally:
+        _state.suspended = previous
+
+
+def is_suspended():
+    return getattr(_state, 'suspended', False)
+
+
+def placement_delta(is_own_product, face_count, cell_count, sign=1):
+    """配置1件分の統計差分"""
+    delta = dict.fromkeys(STATS_FIELDS, 0)
+    delta['occupied_cells'] = sign * cell_count
+    if is_own_product:
+        delta['own_products_count'] = sign
+        delta['own_faces'] = sign * face_count
+    else:
+        delta['competitor_products_count'] = sign
+        delta['competitor_faces'] = sign * face_count
+    return delta
+
+
+def apply_delta(shelf_id, delta):
+    """統計に差分を加算
+
+    統計行が無い棚は何もしない（次回参照時に get_shelf_stats で集計される）。
+    """
+    changes = {field: F(field) + value for field, value in delta.items() if value}
+    if changes:
+        ShelfStats.objects.filter(shelf_id=shelf_id).update(**changes)
+
+
+def invalidate(shelf_id):
+    """統計行を破棄して次回参照時に再集計させる"""
+    ShelfStats.objects.filter(shelf_id=shelf_id).delete()
+
+
+def compute_stats(placements):
+    """読み込み済みの配置（product付き）から統計値を計算"""
+    totals = dict.fromkeys(STATS_FIELDS, 0)
+    for placement in placements:
+        delta = placement_delta(placement.product.is_own_product, placement.face_count, placement.cell_count)
+        for field, value in delta.items():
+            totals[field] += value
+    return totals
+
+
+def save_stats(shelf, values):
+    """計算済みの統計値で上書き保存"""
+    ShelfStats.objects.update_or_create(shelf=shelf, defaults=values)
+
+
+def rebuild_shelf_stats(shelf_ids=None, batch_size=1000):
+    """配置テーブルから統計を再集計（shelf_ids 未指定なら全棚）
+
+    棚ごとの集計は GROUP BY の1クエリで行い、一括作成・一括更新で書き込む。
+    """
+    own = Q(product__is_own_product=True)
+    competitor = Q(product__is_own_product=False)
+
+    placements = ShelfPlacement.objects.all()
+    shelves = Shelf.objects.all()
+    if shelf_ids is not None:
+        placements = placements.filter(shelf_id__in=shelf_ids)
+        shelves = shelves.filter(id__in=shelf_ids)
+
+    aggregates = {
+        row.pop('shelf_id'): row
+        for row in placements.values('shelf_id').annotate(
+            occupied_cells=Sum(F('span_rows') * F('span_columns')),
+            own_products_count=Count('id', filter=own),
+            competitor_products_count=Count('id', filter=competitor),
+            own_faces=Sum('face_count', filter=own),
+            competitor_faces=Sum('face_count', filter=competitor),
+        ).order_by()
+    }
+    existing = {stats.shelf_id: stats for stats in ShelfStats.objects.filter(shelf_id__in=shelves.values('id'))}
+
+    to_create = []
+    to_update = []
+    for shelf_id in shelves.values_list('id', flat=True).iterator():
+        values = aggregates.get(shelf_id, {})
+        stats = existing.get(shelf_id) or ShelfStats(shelf_id=shelf_id)
+        for field in STATS_FIELDS:
+            setattr(stats, field, values.get(field) or 0)
+        (to_update if stats.pk else to_create).append(stats)
+
+    ShelfStats.objects.bulk_create(to_create, batch_size=batch_size)
+    ShelfStats.objects.bulk_update(to_update, STATS_FIELDS, batch_size=batch_size)
+    return len(to_create) + len(to_update)
+
+
+def get_shelf_stats(shelf):
+    """棚の統計を取得（未作成なら集計して作成）"""
+    try:
+        return ShelfStats.objects.get(shelf=shelf)
+    except ShelfStats.DoesNotExist:
+        rebuild_shelf_stats([shelf.id])
+        return ShelfStats.objects.get(shelf=shelf)
@@ -0,0 +1,50 @@
+# ==================== shelves/services/versions.py ====================
+
+import hashlib
+
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from shelves.models import Shelf
+
+
+# 画面・出力のテンプレートを変えた場合に上げて、ブラウザが保持している応答を無効化する
+ETAG_REVISION = 1
+
+
+def bump_versions(shelf_ids):
+    """棚のバージョンを進める（配置・棚・表示中の商品が変わったときに呼び出す）"""
+    shelf_ids = {shelf_id for shelf_id in shelf_ids if shelf_id is not None}
+    if shelf_ids:
+        Shelf.objects.filter(pk__in=shelf_ids).update(version=F('version') + 1, updated_at=timezone.now())
+
+
+def make_etag(*parts):
+    """バージョン等の値から強いETagを作る"""
+    digest = hashlib.sha1(repr((ETAG_REVISION,) + parts).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def timestamp(*datetimes):
+    """Last-Modified 用に、最も新しい日時を秒単位で返す"""
+    return int(max(value for value in datetimes if value is not None).timestamp())
+
+
+def not_modified(request, etag, last_modified):
+    """条件付きGETが一致すれば 304 応答を返す（一致しなければ None）"""
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified):
+    """ETag / Last-Modified を付与し、毎回の再検証を求める"""
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # ログインユーザーごとにCSRFトークン等が異なるため、共有キャッシュには載せない
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Cookie'])
+    return response
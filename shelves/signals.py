@@ -0,0 +1,197 @@
+# ==================== shelves/signals.py ====================
+
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from products.models import Maker, Brand, Category, Product
+from products.services import search
+from products.signals import products_bulk_changed
+from .models import Shelf, ShelfPlacement, ShelfStats
+from .services import live, stats, versions
+from .services.placements import serialize_placement
+
+
+search.register_index('shelf', Shelf, [
+    ('name', 3),
+    ('description', 1),
+])
+
+
+def _is_own_product(product_id, placement=None):
+    if placement is not None and ShelfPlacement.product.is_cached(placement) and placement.product_id == product_id:
+        return placement.product.is_own_product
+    return Product.objects.filter(id=product_id).values_list('is_own_product', flat=True).first()
+
+
+def _remember_values(placement):
+    placement._loaded_values = {
+        'shelf_id': placement.shelf_id,
+        'product_id': placement.product_id,
+        'face_count': placement.face_count,
+        'span_rows': placement.span_rows,
+        'span_columns': placement.span_columns,
+    }
+
+
+@receiver(post_save, sender=Shelf)
+def create_shelf_stats(sender, instance, created, raw=False, **kwargs):
+    """棚作成時に空の統計を作成"""
+    if created and not raw:
+        ShelfStats.objects.get_or_create(shelf=instance)
+
+
+def _bump_versions_for_products(product_filter):
+    shelf_ids = ShelfPlacement.objects.filter(product_filter).values_list('shelf_id', flat=True).distinct()
+    versions.bump_versions(list(shelf_ids))
+
+
+@receiver(post_save, sender=ShelfPlacement)
+@receiver(post_delete, sender=ShelfPlacement)
+def bump_version_on_placement_change(sender, instance, raw=False, **kwargs):
+    """配置の変更時に棚のバージョンを進める（統計の受け手より先に、変更前の棚も対象にする）
+
+    一括更新中（stats_suspended）は BatchPlacement が最後に1回だけ進めるため何もしない。
+    """
+    if raw or stats.is_suspended():
+        return
+    shelf_ids = [instance.shelf_id]
+    original = getattr(instance, '_loaded_values', None)
+    if original and original.get('shelf_id'):
+        shelf_ids.append(original['shelf_id'])
+    versions.bump_versions(shelf_ids)
+
+
+@receiver(post_save, sender=ShelfPlacement)
+def publish_placement_save(sender, instance, raw=False, **kwargs):
+    """個別の配置変更を、同じ棚を開いている画面へ配信（一括変更は BatchPlacement がまとめて配信する）"""
+    if raw or stats.is_suspended():
+        return
+    live.publish_changes(instance.shelf_id, changed=[serialize_placement(instance)])
+    original = getattr(instance, '_loaded_values', None)
+    if original and original.get('shelf_id') and original['shelf_id'] != instance.shelf_id:
+        live.publish_changes(original['shelf_id'], removed=[instance.pk])
+
+
+@receiver(post_delete, sender=ShelfPlacement)
+def publish_placement_delete(sender, instance, **kwargs):
+    if not stats.is_suspended():
+        live.publish_changes(instance.shelf_id, removed=[instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def bump_versions_on_product_change(sender, instance, created, raw=False, **kwargs):
+    """商品名・画像などの変更を、その商品を配置している棚に反映"""
+    if not created and not raw:
+        _bump_versions_for_products(Q(product=instance))
+
+
+@receiver(post_save, sender=Maker)
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+def bump_versions_on_master_rename(sender, instance, created, raw=False, **kwargs):
+    if created or raw:
+        return
+    if sender is Category:
+        _bump_versions_for_products(Category.subtree_q(instance.pk, field='product__category'))
+    else:
+        _bump_versions_for_products(Q(**{f'product__{sender._meta.model_name}': instance}))
+
+
+@receiver(products_bulk_changed)
+def bump_versions_on_bulk_change(sender, product_ids=(), **kwargs):
+    if product_ids:
+        _bump_versions_for_products(Q(product_id__in=list(product_ids)))
+
+
+@receiver(post_save, sender=ShelfPlacement)
+def update_stats_on_save(sender, instance, created, raw=False, **kwargs):
+    """配置の作成・更新時に統計を差分更新"""
+    if raw or stats.is_suspended():
+        return
+    
+    new_delta = stats.placement_delta(
+        _is_own_product(instance.product_id, instance), instance.face_count, instance.cell_count
+    )
+    
+    if created:
+        stats.apply_delta(instance.shelf_id, new_delta)
+    else:
+        original = getattr(instance, '_loaded_values', None)
+        required = ('shelf_id', 'product_id', 'face_count', 'span_rows', 'span_columns')
+        if original is None or any(key not in original for key in required):
+            # 変更前の値が不明な場合は棚単位で再集計
+            stats.rebuild_shelf_stats([instance.shelf_id])
+        else:
+            old_delta = stats.placement_delta(
+                _is_own_product(original['product_id'], instance),
+                original['face_count'],
+                original['span_rows'] * original['span_columns'],
+                sign=-1,
+            )
+            if original['shelf_id'] == instance.shelf_id:
+                stats.apply_delta(instance.shelf_id, {
+                    field: new_delta[field] + old_delta[field] for field in stats.STATS_FIELDS
+                })
+            else:
+                stats.apply_delta(original['shelf_id'], old_delta)
+                stats.apply_delta(instance.shelf_id, new_delta)
+    
+    _remember_values(instance)
+
+
+@receiver(post_delete, sender=ShelfPlacement)
+def update_stats_on_delete(sender, instance, **kwargs):
+    """配置の削除時に統計を差分更新"""
+    if stats.is_suspended():
+        return
+    
+    is_own_product = _is_own_product(instance.product_id, instance)
+    if is_own_product is None:
+        # 商品ごと削除された場合は次回参照時に再集計
+        stats.invalidate(instance.shelf_id)
+        return
+    
+    stats.apply_delta(instance.shelf_id, stats.placement_delta(
+        is_own_product, instance.face_count, instance.cell_count, sign=-1
+    ))
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_ownership(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        instance._was_own_product = Product.objects.filter(pk=instance.pk).values_list(
+            'is_own_product', flat=True
+        ).first()
+
+
+@receiver(post_save, sender=Product)
+def rebuild_stats_on_ownership_change(sender, instance, created, raw=False, **kwargs):
+    """自社/競合区分の変更時は、その商品を配置している棚の統計を再集計"""
+    if created or raw:
+        return
+    was_own_product = getattr(instance, '_was_own_product', None)
+    if was_own_product is not None and was_own_product != instance.is_own_product:
+        shelf_ids = ShelfPlacement.objects.filter(product=instance).values_list('shelf_id', flat=True).distinct()
+        stats.rebuild_shelf_stats(list(shelf_ids))
+
+
+@receiver(products_bulk_changed)
+def rebuild_stats_on_bulk_ownership_change(sender, ownership_changed_ids=(), **kwargs):
+    """一括取り込みで自社/競合区分が変わった商品を配置している棚の統計を再集計"""
+    if ownership_changed_ids:
+        shelf_ids = ShelfPlacement.objects.filter(product_id__in=ownership_changed_ids).values_list(
+            'shelf_id', flat=True
+        ).distinct()
+        stats.rebuild_shelf_stats(list(shelf_ids))
+
+
+@receiver(post_save, sender=Shelf)
+def index_shelf(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_objects('shelf', [instance.pk])
+
+
+@receiver(post_delete, sender=Shelf)
+def unindex_shelf(sender, instance, **kwargs):
+    search.remove_objects('shelf', [instance.pk])
@@ -1,3 +1,818 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from products.models import Brand, Category, Maker, Product
+from .models import FloorShelf, SalesFloor, Shelf, ShelfPlacement
+from .services import floor as floor_service, live, optimizer
+from .services.grid import build_grid, get_shelf_grid, get_shelf_grids
+from .services.occupancy import ShelfOccupancy
+from .services.placements import BatchPlacement
+from .services.stats import STATS_FIELDS, get_shelf_stats, rebuild_shelf_stats
+from .views import _create_placement
+
+
+# 削除・作成を含む一括更新のクエリ数（配置の件数によらない）
+QUERIES_PER_BATCH = 13
+
+
+def create_products(count, own_every=2):
+    maker = Maker.objects.create(name='テストメーカー')
+    category = Category.objects.create(name='飲料')
+    return [
+        Product.objects.create(
+            product_name=f'商品{i}', product_code=f'4900000{i:06d}', maker=maker, category=category,
+            is_own_product=i % own_every == 0,
+        )
+        for i in range(count)
+    ]
+
+
+def create_shelf(rows=4, columns=6):
+    return Shelf.objects.create(name='テスト棚', width=columns * 10, height=rows * 10, depth=45, rows=rows, columns=columns)
+
+
+class ShelfOccupancyTests(TestCase):
+    """セル占有インデックス"""
+
+    def setUp(self):
+        self.occupancy = ShelfOccupancy(4, 6)
+        self.occupancy.add('a', 0, 1, span_rows=2, span_columns=3)
+
+    def test_span_covers_every_cell(self):
+        covered = {
+            (row, column) for row in range(4) for column in range(6) if self.occupancy.covering(row, column) == 'a'
+        }
+        self.assertEqual(covered, {(0, 1), (0, 2), (0, 3), (1, 1), (1, 2), (1, 3)})
+        self.assertEqual(self.occupancy.occupied_count(), 6)
+
+    def test_is_free(self):
+        self.assertTrue(self.occupancy.is_free(0, 0))
+        self.assertTrue(self.occupancy.is_free(2, 0, span_rows=2, span_columns=6))
+        # 左上が空いていても占有範囲の一部と重なれば不可
+        self.assertFalse(self.occupancy.is_free(1, 0, span_columns=2))
+        self.assertFalse(self.occupancy.is_free(1, 3))
+        self.assertTrue(self.occupancy.is_free(0, 4, span_rows=4, span_columns=2))
+
+    def test_bounds(self):
+        self.assertFalse(self.occupancy.is_free(3, 5, span_rows=2))
+        self.assertFalse(self.occupancy.is_free(0, 5, span_columns=2))
+        self.assertFalse(self.occupancy.is_free(-1, 0))
+        self.assertIsNone(self.occupancy.covering(4, 0))
+
+    def test_ignore_own_area(self):
+        # 自身の占有セルは空きとみなし、他の配置のセルは空きとみなさない
+        self.assertTrue(self.occupancy.is_free(1, 2, span_rows=2, span_columns=3, ignore='a'))
+        self.occupancy.add('b', 2, 4)
+        self.assertFalse(self.occupancy.is_free(1, 2, span_rows=2, span_columns=3, ignore='a'))
+
+    def test_remove(self):
+        self.occupancy.add('b', 2, 1)
+        self.occupancy.remove('a', 0, 1, span_rows=2, span_columns=3)
+        self.assertTrue(self.occupancy.is_free(0, 0, span_rows=2, span_columns=6))
+        self.assertEqual(self.occupancy.covering(2, 1), 'b')
+        self.assertEqual(self.occupancy.occupied_count(), 1)
+
+    def test_remove_keeps_cells_of_other_owner(self):
+        self.occupancy.remove('b', 0, 1)
+        self.assertEqual(self.occupancy.covering(0, 1), 'a')
+
+    def test_for_shelf(self):
+        products = create_products(2)
+        shelf = create_shelf()
+        placement = ShelfPlacement.objects.create(shelf=shelf, product=products[0], row=1, column=1, span_rows=2, span_columns=2)
+        occupancy = ShelfOccupancy.for_shelf(shelf)
+        self.assertEqual(occupancy.covering(2, 2), placement.id)
+        self.assertFalse(occupancy.is_free(2, 2))
+        self.assertTrue(occupancy.is_free(0, 0, span_columns=6))
+
+
+class ShelfGridTests(TestCase):
+    """結合セルに対応した棚グリッド"""
+
+    def setUp(self):
+        # グリッドは棚ID・バージョンでキャッシュされ、ロールバックで再利用される棚IDと重なるため
+        cache.clear()
+
+    def placement(self, index, row, column, span_rows=1, span_columns=1):
+        return {'id': index, 'row': row, 'column': column, 'span_rows': span_rows, 'span_columns': span_columns}
+
+    def test_render_rows_with_spans(self):
+        grid = build_grid(3, 4, [self.placement(1, 0, 0, 2, 2), self.placement(2, 2, 3)])
+        rows = grid.render_rows()
+        self.assertEqual((rows[0][0].rowspan, rows[0][0].colspan), (2, 2))
+        # 結合で覆われるセルは描画を省く
+        self.assertEqual([cell.covered for cell in rows[0]], [False, True, False, False])
+        self.assertEqual([cell.covered for cell in rows[1]], [True, True, False, False])
+        self.assertEqual(rows[2][3].placement['id'], 2)
+        self.assertEqual(grid.placement_at(1, 1)['id'], 1)
+        self.assertIsNone(grid.placement_at(2, 0))
+
+    def test_clips_spans_and_skips_overlaps(self):
+        # 棚の外にはみ出す部分は切り詰め、先に置かれた配置と重なる配置は無視する
+        grid = build_grid(2, 3, [self.placement(1, 1, 2, 2, 2), self.placement(2, 0, 0, 2, 1), self.placement(3, 1, 0)])
+        rows = grid.render_rows()
+        self.assertEqual((rows[1][2].rowspan, rows[1][2].colspan), (1, 1))
+        self.assertEqual(grid.placement_at(1, 0)['id'], 2)
+        self.assertNotIn(3, [cell.placement['id'] for row in rows for cell in row if cell.placement])
+
+    def test_cached_per_shelf_version(self):
+        products = create_products(2)
+        shelf = create_shelf()
+        BatchPlacement(shelf).apply([{'op': 'place', 'product_id': products[0].id, 'row': 0, 'column': 0, 'span_columns': 2}])
+        shelf.refresh_from_db()
+        with self.assertNumQueries(1):
+            grid = get_shelf_grid(shelf)
+        with self.assertNumQueries(0):
+            get_shelf_grid(shelf)
+        self.assertEqual(grid.placement_at(0, 1)['product_id'], products[0].id)
+
+        BatchPlacement(shelf).apply([{'op': 'place', 'product_id': products[1].id, 'row': 1, 'column': 0}])
+        shelf.refresh_from_db()
+        self.assertEqual(get_shelf_grid(shelf).placement_count, 2)
+
+    def test_many_shelves_in_one_query(self):
+        products = create_products(1)
+        shelves = [create_shelf() for _ in range(5)]
+        for shelf in shelves:
+            ShelfPlacement.objects.create(shelf=shelf, product=products[0], row=0, column=0)
+        shelves = list(Shelf.objects.filter(pk__in=[shelf.pk for shelf in shelves]))
+        with self.assertNumQueries(1):
+            grids = get_shelf_grids(shelves)
+        self.assertEqual([grids[shelf.pk].placement_count for shelf in shelves], [1] * 5)
+        with self.assertNumQueries(0):
+            get_shelf_grids(shelves)
+
+    def test_shelf_page_renders_spans(self):
+        products = create_products(1)
+        shelf = create_shelf()
+        BatchPlacement(shelf).apply([
+            {'op': 'place', 'product_id': products[0].id, 'row': 0, 'column': 0, 'span_rows': 2, 'span_columns': 3},
+        ])
+        response = self.client.get(reverse('shelves:shelf_detail', args=[shelf.pk]))
+        self.assertContains(response, 'grid-row: 1 / span 2; grid-column: 1 / span 3;')
+        self.assertContains(response, 'data-span-rows="2" data-span-columns="3"')
+
+
+class SalesFloorTests(TestCase):
+    """売場（複数の棚を一定のクエリ数で読み込む）"""
+
+    def setUp(self):
+        cache.clear()
+        self.products = create_products(4)
+        self.floor = SalesFloor.objects.create(name='テスト売場')
+
+    def add_shelves(self, count, aisle=0):
+        shelves = []
+        for _ in range(count):
+            shelf = create_shelf()
+            for column, product in enumerate(self.products[:3]):
+                ShelfPlacement.objects.create(shelf=shelf, product=product, row=0, column=column, face_count=2)
+            position = floor_service.next_position(self.floor, aisle)
+            FloorShelf.objects.create(floor=self.floor, shelf=shelf, aisle=aisle, position=position)
+            shelves.append(shelf)
+        return shelves
+
+    def test_queries_do_not_grow_with_shelves(self):
+        # 棚の位置（棚付き）と、キャッシュに無い棚の配置をまとめて取得する2クエリ
+        self.add_shelves(2)
+        with self.assertNumQueries(2):
+            floor_service.load_floor(self.floor)
+        self.add_shelves(6, aisle=1)
+        cache.clear()
+        with self.assertNumQueries(2):
+            layout = floor_service.load_floor(self.floor)
+        self.assertEqual(layout.shelf_count, 8)
+        # グリッドがキャッシュ済みなら配置テーブルを参照しない
+        with self.assertNumQueries(1):
+            floor_service.load_floor(self.floor)
+
+    def test_aisles_and_summary(self):
+        first, second = self.add_shelves(2)
+        third, = self.add_shelves(1, aisle=2)
+        layout = floor_service.load_floor(self.floor)
+        self.assertEqual(
+            [(aisle, [section.shelf.pk for section in sections]) for aisle, sections in layout.aisles],
+            [(0, [first.pk, second.pk]), (2, [third.pk])],
+        )
+        summary = layout.summary()
+        self.assertEqual((summary['total_cells'], summary['occupied_cells']), (72, 9))
+        # create_products は偶数番目が自社商品（1棚に自社2・競合1）
+        self.assertEqual((summary['own_faces'], summary['competitor_faces']), (12, 6))
+        self.assertEqual(summary['own_share'], 66.7)
+
+    def test_layout_api_queries_do_not_grow_with_shelves(self):
+        url = reverse('shelves:floor_layout', args=[self.floor.pk])
+        self.add_shelves(2)
+        with self.assertNumQueries(3):
+            self.client.get(url)
+        self.add_shelves(5)
+        cache.clear()
+        with self.assertNumQueries(3):
+            response = self.client.get(url).json()
+        self.assertEqual(len(response['aisles'][0]['shelves']), 7)
+        self.assertEqual(len(response['aisles'][0]['shelves'][0]['placements']), 3)
+
+    def test_floor_page_queries_do_not_grow_with_shelves(self):
+        url = reverse('shelves:floor_detail', args=[self.floor.pk])
+        self.add_shelves(2)
+        with self.assertNumQueries(4):
+            self.client.get(url)
+        self.add_shelves(5, aisle=1)
+        cache.clear()
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(response.context['shelf_count'], 7)
+
+    def test_add_and_remove_shelf(self):
+        shelf, = self.add_shelves(1)
+        other = create_shelf()
+        response = self.client.post(reverse('shelves:add_floor_shelf'), {
+            'floor_id': self.floor.pk, 'shelf_id': other.pk, 'aisle': 0,
+        }).json()
+        self.assertEqual(response['floor_shelf']['position'], 1)
+        duplicate = self.client.post(reverse('shelves:add_floor_shelf'), {
+            'floor_id': self.floor.pk, 'shelf_id': shelf.pk, 'aisle': 1,
+        }).json()
+        self.assertFalse(duplicate['success'])
+
+        self.client.post(reverse('shelves:remove_floor_shelf'), {'floor_shelf_id': response['floor_shelf']['id']})
+        self.assertTrue(Shelf.objects.filter(pk=other.pk).exists())
+        self.assertEqual(list(FloorShelf.objects.filter(floor=self.floor).values_list('shelf_id', flat=True)), [shelf.pk])
+
+
+class BatchPlacementTests(TestCase):
+    """配置一括更新（BatchPlacement）"""
+
+    def setUp(self):
+        self.products = create_products(6)
+        self.shelf = create_shelf()
+
+    def place(self, product, row, column, **fields):
+        return ShelfPlacement.objects.create(shelf=self.shelf, product=product, row=row, column=column, **fields)
+
+    def apply(self, *operations):
+        return BatchPlacement(self.shelf).apply(list(operations))
+
+    def positions(self):
+        return {
+            placement.product_id: (placement.row, placement.column, placement.span_rows, placement.span_columns)
+            for placement in ShelfPlacement.objects.filter(shelf=self.shelf)
+        }
+
+    def test_place_creates_placements(self):
+        result = self.apply(
+            {'op': 'place', 'product_id': self.products[0].id, 'row': 0, 'column': 0, 'span_columns': 2},
+            {'op': 'place', 'product_id': self.products[1].id, 'row': 0, 'column': 2},
+        )
+        self.assertEqual(len(result['changed']), 2)
+        self.assertEqual(self.positions(), {
+            self.products[0].id: (0, 0, 1, 2),
+            self.products[1].id: (0, 2, 1, 1),
+        })
+
+    def test_place_rejects_cell_covered_by_span(self):
+        self.place(self.products[0], 0, 0, span_rows=2, span_columns=2)
+        with self.assertRaises(ValidationError) as raised:
+            self.apply({'op': 'place', 'product_id': self.products[1].id, 'row': 1, 'column': 1})
+        self.assertEqual(raised.exception.params['index'], 0)
+
+    def test_place_rejects_span_overlapping_later_operation(self):
+        with self.assertRaises(ValidationError) as raised:
+            self.apply(
+                {'op': 'place', 'product_id': self.products[0].id, 'row': 0, 'column': 1},
+                {'op': 'place', 'product_id': self.products[1].id, 'row': 0, 'column': 0, 'span_columns': 2},
+            )
+        self.assertEqual(raised.exception.params['index'], 1)
+        # 検証エラー時は何も書き込まない
+        self.assertFalse(ShelfPlacement.objects.filter(shelf=self.shelf).exists())
+
+    def test_place_rejects_span_beyond_shelf(self):
+        with self.assertRaises(ValidationError):
+            self.apply({'op': 'place', 'product_id': self.products[0].id, 'row': 3, 'column': 5, 'span_rows': 2})
+
+    def test_swap_by_moves(self):
+        first = self.place(self.products[0], 0, 0)
+        second = self.place(self.products[1], 0, 1)
+        # 1件目を空きセルへ逃がさずに入れ替える（一意制約に途中で抵触しないこと）
+        self.apply(
+            {'op': 'remove', 'placement_id': first.id},
+            {'op': 'move', 'placement_id': second.id, 'row': 0, 'column': 0},
+            {'op': 'place', 'product_id': self.products[0].id, 'row': 0, 'column': 1},
+        )
+        self.assertEqual(self.positions(), {
+            self.products[1].id: (0, 0, 1, 1),
+            self.products[0].id: (0, 1, 1, 1),
+        })
+
+    def test_move_into_own_area(self):
+        placement = self.place(self.products[0], 0, 0, span_columns=2)
+        self.apply({'op': 'move', 'placement_id': placement.id, 'row': 0, 'column': 1})
+        self.assertEqual(self.positions(), {self.products[0].id: (0, 1, 1, 2)})
+
+    def test_chained_moves(self):
+        first = self.place(self.products[0], 0, 0)
+        second = self.place(self.products[1], 0, 1)
+        self.apply(
+            {'op': 'move', 'placement_id': second.id, 'row': 0, 'column': 2},
+            {'op': 'move', 'placement_id': first.id, 'row': 0, 'column': 1},
+        )
+        self.assertEqual(self.positions(), {
+            self.products[0].id: (0, 1, 1, 1),
+            self.products[1].id: (0, 2, 1, 1),
+        })
+
+    def test_resize_checks_neighbours(self):
+        placement = self.place(self.products[0], 0, 0)
+        self.place(self.products[1], 0, 2)
+        self.apply({'op': 'resize', 'placement_id': placement.id, 'span_columns': 2})
+        with self.assertRaises(ValidationError):
+            self.apply({'op': 'resize', 'placement_id': placement.id, 'span_columns': 3})
+        self.assertEqual(self.positions()[self.products[0].id], (0, 0, 1, 2))
+
+    def test_remove_frees_span(self):
+        placement = self.place(self.products[0], 0, 0, span_rows=2, span_columns=2)
+        self.apply(
+            {'op': 'remove', 'placement_id': placement.id},
+            {'op': 'place', 'product_id': self.products[1].id, 'row': 1, 'column': 1},
+        )
+        self.assertEqual(self.positions(), {self.products[1].id: (1, 1, 1, 1)})
+
+    def test_unknown_operation(self):
+        with self.assertRaises(ValidationError):
+            self.apply({'op': 'explode'})
+        with self.assertRaises(ValidationError):
+            BatchPlacement(self.shelf).apply([])
+
+    def test_query_count_does_not_grow_with_removals(self):
+        def remove_all_and_place(product):
+            operations = [
+                {'op': 'remove', 'placement_id': placement_id}
+                for placement_id in ShelfPlacement.objects.filter(shelf=self.shelf).values_list('id', flat=True)
+            ]
+            operations.append({'op': 'place', 'product_id': product.id, 'row': 3, 'column': 5})
+            return operations
+
+        ShelfPlacement.objects.bulk_create([
+            ShelfPlacement(shelf=self.shelf, product=self.products[0], row=row, column=column)
+            for row in range(2) for column in range(2)
+        ])
+        operations = remove_all_and_place(self.products[1])
+        with self.assertNumQueries(QUERIES_PER_BATCH):
+            self.apply(*operations)
+
+        ShelfPlacement.objects.bulk_create([
+            ShelfPlacement(shelf=self.shelf, product=self.products[0], row=row, column=column)
+            for row in range(3) for column in range(5)
+        ])
+        version = Shelf.objects.get(pk=self.shelf.pk).version
+        operations = remove_all_and_place(self.products[2])
+        with self.assertNumQueries(QUERIES_PER_BATCH):
+            self.apply(*operations)
+        # 棚のバージョンは配置ごとではなく一括更新ごとに1回だけ進む
+        self.assertEqual(Shelf.objects.get(pk=self.shelf.pk).version, version + 1)
+
+
+class OptimizerTests(TestCase):
+    """自動配置（time_budget_ms=0 で貪欲法の案のみ）"""
+
+    def setUp(self):
+        self.shelf = create_shelf()
+        self.maker = Maker.objects.create(name='テストメーカー')
+        self.category = Category.objects.create(name='飲料')
+        self.number = 0
+
+    def add_products(self, count, is_own=False, brand=None, category=None, **dimensions):
+        products = []
+        for _ in range(count):
+            self.number += 1
+            products.append(Product.objects.create(
+                product_name=f'商品{self.number}', product_code=f'4900000{self.number:06d}', maker=self.maker,
+                brand=brand, category=category or self.category, is_own_product=is_own, **dimensions,
+            ))
+        return products
+
+    def arrange(self, **options):
+        return optimizer.auto_arrange(self.shelf, time_budget_ms=0, **options)
+
+    def assert_no_overlap(self, plan):
+        occupancy = ShelfOccupancy(self.shelf.rows, self.shelf.columns)
+        for placement in plan:
+            area = (placement['row'], placement['column'], placement['span_rows'], placement['span_columns'])
+            self.assertTrue(occupancy.is_free(*area), placement)
+            occupancy.add(placement, *area)
+
+    def test_fills_shelf(self):
+        self.add_products(30, width=8, height=9, depth=20)
+        result = self.arrange()
+        self.assertEqual(len(result['plan']), 24)
+        self.assertEqual(result['score']['fill_rate'], 100)
+        self.assert_no_overlap(result['plan'])
+        self.assertFalse(result['applied'])
+        self.assertFalse(ShelfPlacement.objects.exists())
+
+    def test_spans_and_faces_from_dimensions(self):
+        wide, = self.add_products(1, width=6, height=15, depth=20)
+        self.add_products(1, width=5, height=50, depth=20)
+        self.add_products(1, width=5, height=10, depth=60)
+        result = self.arrange()
+        # 高さ・奥行が棚に収まらない商品は除外し、2段分の高さの商品は2段を占有する
+        self.assertEqual(result['candidates'], 1)
+        placement, = result['plan']
+        self.assertEqual(
+            (placement['product_id'], placement['span_rows'], placement['span_columns'], placement['face_count']),
+            (wide.id, 2, 1, 1),
+        )
+
+    def test_own_share_target(self):
+        self.add_products(20, is_own=True, width=10, height=10)
+        self.add_products(20, width=10, height=10)
+        for target in (25, 50, 75):
+            with self.subTest(target=target):
+                score = self.arrange(own_share_target=target)['score']
+                self.assertEqual(score['own_share'], target)
+        with self.assertRaises(ValidationError):
+            self.arrange(own_share_target=120)
+
+    def test_brand_blocks(self):
+        brands = [Brand.objects.create(maker=self.maker, name=f'ブランド{i}') for i in range(3)]
+        for brand in brands:
+            self.add_products(8, brand=brand, width=10, height=10)
+        result = self.arrange()
+        self.assertEqual(result['score']['brand_fragments'], 0)
+        by_brand = {}
+        brand_of = dict(Product.objects.values_list('id', 'brand_id'))
+        for placement in result['plan']:
+            by_brand.setdefault(brand_of[placement['product_id']], set()).add(placement['row'])
+        # 24セルを3ブランドで分け合い、各ブランドは連続した段に並ぶ
+        self.assertEqual(sorted(len(rows) for rows in by_brand.values()), [2, 2, 2])
+
+    def test_keeps_existing_placements(self):
+        placed, = self.add_products(1, width=10, height=10)
+        existing = ShelfPlacement.objects.create(shelf=self.shelf, product=placed, row=0, column=0, span_columns=2)
+        self.add_products(30, width=10, height=10)
+        result = self.arrange(replace=False, apply=True)
+        self.assertTrue(result['applied'])
+        self.assertNotIn(placed.id, [placement['product_id'] for placement in result['plan']])
+        self.assertTrue(ShelfPlacement.objects.filter(pk=existing.pk, row=0, column=0).exists())
+        self.assertEqual(ShelfPlacement.objects.filter(shelf=self.shelf).count(), 23)
+        self.assertEqual(get_shelf_stats(self.shelf).occupied_cells, 24)
+
+    def test_replace_and_apply(self):
+        old, = self.add_products(1, width=10, height=10, category=Category.objects.create(name='菓子'))
+        ShelfPlacement.objects.create(shelf=self.shelf, product=old, row=3, column=5)
+        self.add_products(10, width=10, height=10)
+        result = self.arrange(category_id=self.category.pk, apply=True)
+        placed = set(ShelfPlacement.objects.filter(shelf=self.shelf).values_list('product_id', flat=True))
+        self.assertEqual(placed, {placement['product_id'] for placement in result['plan']})
+        self.assertNotIn(old.id, placed)
+
+    def test_api_returns_plan(self):
+        self.add_products(5, width=10, height=10)
+        response = self.client.post(
+            reverse('shelves:auto_arrange'),
+            json.dumps({'shelf_id': self.shelf.pk, 'time_budget_ms': 0}), content_type='application/json',
+        ).json()
+        self.assertTrue(response['success'])
+        self.assertEqual(len(response['plan']), 5)
+        self.assertFalse(ShelfPlacement.objects.exists())
+
+
+class ShelfStatsTests(TestCase):
+    """統計の差分更新が、配置テーブルからの再集計と一致すること"""
+
+    def setUp(self):
+        self.products = create_products(4)
+        self.shelf = create_shelf()
+        self.other_shelf = create_shelf()
+
+    def assert_matches_rebuild(self, *shelves):
+        for shelf in shelves or (self.shelf,):
+            incremental = get_shelf_stats(shelf)
+            rebuild_shelf_stats([shelf.id])
+            rebuilt = get_shelf_stats(shelf)
+            self.assertEqual(
+                {field: getattr(incremental, field) for field in STATS_FIELDS},
+                {field: getattr(rebuilt, field) for field in STATS_FIELDS},
+            )
+
+    def place(self, product, row, column, **fields):
+        return ShelfPlacement.objects.create(shelf=self.shelf, product=product, row=row, column=column, **fields)
+
+    def test_create_update_delete(self):
+        own = self.place(self.products[0], 0, 0, face_count=2, span_columns=2)
+        competitor = self.place(self.products[1], 1, 0, face_count=3)
+        self.assert_matches_rebuild()
+        self.assertEqual(get_shelf_stats(self.shelf).occupied_cells, 3)
+
+        own.face_count = 5
+        own.span_rows = 2
+        own.save()
+        self.assert_matches_rebuild()
+
+        competitor.product = self.products[2]
+        competitor.save()
+        self.assert_matches_rebuild()
+
+        competitor.delete()
+        self.assert_matches_rebuild()
+        self.assertEqual(get_shelf_stats(self.shelf).occupied_cells, 4)
+
+    def test_move_to_other_shelf(self):
+        placement = self.place(self.products[0], 0, 0, face_count=2)
+        get_shelf_stats(self.other_shelf)
+        placement.shelf = self.other_shelf
+        placement.save()
+        self.assert_matches_rebuild(self.shelf, self.other_shelf)
+        self.assertEqual(get_shelf_stats(self.shelf).occupied_cells, 0)
+
+    def test_ownership_change(self):
+        self.place(self.products[1], 0, 0, face_count=2)
+        self.products[1].is_own_product = True
+        self.products[1].save()
+        self.assert_matches_rebuild()
+        self.assertEqual(get_shelf_stats(self.shelf).own_faces, 2)
+
+    def test_product_deleted(self):
+        self.place(self.products[0], 0, 0)
+        self.place(self.products[1], 0, 1)
+        self.products[0].delete()
+        self.assert_matches_rebuild()
+        self.assertEqual(get_shelf_stats(self.shelf).occupied_cells, 1)
+
+    def test_batch(self):
+        placement = self.place(self.products[0], 0, 0)
+        removed = self.place(self.products[3], 3, 5)
+        BatchPlacement(self.shelf).apply([
+            {'op': 'place', 'product_id': self.products[1].id, 'row': 1, 'column': 0, 'span_columns': 3, 'face_count': 3},
+            {'op': 'resize', 'placement_id': placement.id, 'span_columns': 2},
+            {'op': 'face_count', 'placement_id': placement.id, 'face_count': 4},
+            {'op': 'remove', 'placement_id': removed.id},
+        ])
+        self.assert_matches_rebuild()
+        self.assertEqual(get_shelf_stats(self.shelf).occupied_cells, 5)
+
+
+class PlacementApiTests(TestCase):
+    """配置API"""
+
+    def setUp(self):
+        self.products = create_products(2)
+        self.shelf = create_shelf()
+
+    def post_place(self, product, row, column, **fields):
+        return self.client.post(reverse('shelves:place_product'), {
+            'shelf_id': self.shelf.id, 'product_id': product.id, 'row': row, 'column': column, **fields,
+        }).json()
+
+    def test_place_product_rejects_span_overlap(self):
+        self.assertTrue(self.post_place(self.products[0], 0, 0, span_rows=2, span_columns=2)['success'])
+        response = self.post_place(self.products[1], 1, 1)
+        self.assertFalse(response['success'])
+        self.assertEqual(ShelfPlacement.objects.filter(shelf=self.shelf).count(), 1)
+
+    def test_place_product_outside_shelf(self):
+        self.assertFalse(self.post_place(self.products[0], 0, 5, span_columns=2)['success'])
+
+
+class ShelfDetailTests(TestCase):
+    """棚詳細画面の条件付きGET"""
+
+    def setUp(self):
+        self.products = create_products(2)
+        self.shelf = create_shelf()
+        self.url = reverse('shelves:shelf_detail', args=[self.shelf.pk])
+
+    def revalidate(self):
+        etag = self.client.get(self.url)['ETag']
+        return self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_not_modified_while_unchanged(self):
+        self.assertEqual(self.revalidate().status_code, 304)
+
+    def test_lists_categories_with_active_products_and_their_parents(self):
+        parent = Category.objects.create(name='食品')
+        child = Category.objects.create(name='菓子', parent=parent)
+        Category.objects.create(name='空のカテゴリ')
+        self.products[0].category = child
+        self.products[0].save()
+        names = [category.full_name for category in self.client.get(self.url).context['categories']]
+        self.assertEqual(names, sorted(['飲料', parent.full_name, child.full_name]))
+
+    def test_category_change_invalidates_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        category = Category.objects.get(name='飲料')
+        category.name = '清涼飲料'
+        category.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '清涼飲料')
+
+    def test_product_activation_invalidates_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        Product.objects.create(
+            product_name='菓子', product_code='4900000999999', maker=self.products[0].maker,
+            category=Category.objects.create(name='菓子'),
+        )
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '菓子')
+
+
+class LiveEventsTests(TestCase):
+    """配置差分の配信（テストクライアントは WSGI のためポーリング）"""
+
+    def setUp(self):
+        self.products = create_products(2)
+        self.shelf = create_shelf()
+        self.other = create_shelf()
+        self.broker = live.ShelfBroker()
+        patcher = mock.patch.object(live, 'broker', self.broker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def poll(self, last_event_id):
+        return self.client.get(
+            reverse('shelves:shelf_events', args=[self.shelf.pk]), {'last_event_id': last_event_id},
+        ).json()
+
+    def test_sequence_is_per_shelf(self):
+        last_event_id = self.broker.last_event_id(self.shelf.pk)
+        # 他の棚の差分が履歴の上限を超えても、この棚の画面は再同期しなくてよい
+        for _ in range(live.HISTORY_SIZE + 1):
+            self.broker.publish(self.other.pk, {'changed': [], 'removed': [1]})
+        self.assertEqual(self.broker.changes_since(self.shelf.pk, last_event_id), [])
+        self.broker.publish(self.shelf.pk, {'changed': [], 'removed': [2]})
+        self.assertEqual(len(self.broker.changes_since(self.shelf.pk, last_event_id)), 1)
+
+    def test_overflowed_history_requires_resync(self):
+        last_event_id = self.broker.last_event_id(self.shelf.pk)
+        for _ in range(live.HISTORY_SIZE + 1):
+            self.broker.publish(self.shelf.pk, {'changed': [], 'removed': [1]})
+        self.assertIsNone(self.broker.changes_since(self.shelf.pk, last_event_id))
+
+    def test_poll_returns_changes_since_last_event(self):
+        last_event_id = self.broker.last_event_id(self.shelf.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            BatchPlacement(self.shelf).apply([{'op': 'place', 'product_id': self.products[0].id, 'row': 0, 'column': 0}])
+        response = self.poll(last_event_id)
+        self.assertFalse(response['resync'])
+        self.assertEqual([event['changed'][0]['product_id'] for event in response['events']], [self.products[0].id])
+        # 返されたイベントID以降は差分なし
+        self.assertEqual(self.poll(response['last_event_id'])['events'], [])
+
+    def test_poll_with_unknown_epoch_resyncs(self):
+        self.assertTrue(self.poll('restarted-3')['resync'])
+
+    def test_shelf_page_polls_under_wsgi(self):
+        response = self.client.get(reverse('shelves:shelf_detail', args=[self.shelf.pk]))
+        self.assertContains(response, 'const LIVE_STREAMING = false;')
+
+
+class ProductPaletteTests(TestCase):
+    """商品パレットAPI"""
+
+    def setUp(self):
+        self.products = create_products(5)
+
+    def get(self, **params):
+        return self.client.get(reverse('shelves:product_palette'), params)
+
+    def test_filters_and_paging(self):
+        category = self.products[0].category
+        response = self.get(category=category.id, maker=self.products[0].maker_id, page_size=2).json()
+        self.assertTrue(response['success'])
+        self.assertEqual(len(response['results']), 2)
+        self.assertTrue(response['has_next'])
+        self.assertEqual(len(self.get(is_own='true').json()['results']), 3)
+
+    def test_invalid_filters(self):
+        for params in ({'category': 'abc'}, {'maker': 'abc'}, {'page': 'x'}, {'page_size': '1.5'}):
+            with self.subTest(params=params):
+                response = self.get(**params)
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(response.json()['success'])
+
+
+class SimulationApiTests(TestCase):
+    """棚割りシミュレーションAPI"""
+
+    def setUp(self):
+        self.products = create_products(2)
+        self.shelf = create_shelf()
+        ShelfPlacement.objects.create(shelf=self.shelf, product=self.products[0], row=0, column=0, face_count=2)
+        ShelfPlacement.objects.create(shelf=self.shelf, product=self.products[1], row=0, column=1, face_count=2)
+
+    def post(self, payload):
+        return self.client.post(reverse('shelves:simulate_shelves'), json.dumps(payload), content_type='application/json')
+
+    def test_simulate_with_changes(self):
+        response = self.post({
+            'shelf_ids': [self.shelf.id],
+            'changes': [{'op': 'add_faces', 'product_id': self.products[0].id, 'faces': 2}],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['success'])
+
+    def test_malformed_changes(self):
+        for changes in ({'a': 1}, ['add_faces'], [1], 'x'):
+            with self.subTest(changes=changes):
+                response = self.post({'shelf_ids': [self.shelf.id], 'changes': changes})
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(response.json()['success'])
+        self.assertEqual(self.post([self.shelf.id]).status_code, 400)
+
+
+class ConcurrentPlacementTests(TransactionTestCase):
+    """同じ棚への同時書き込みで、占有範囲が重なった配置が書き込まれないこと"""
+
+    def setUp(self):
+        self.products = create_products(2)
+        self.shelf = create_shelf()
+
+    def run_concurrently(self, functions):
+        """各関数を別スレッド（別接続）で同時に実行し、(成功数, 例外のリスト) を返す"""
+        outcomes = []
+        barrier = threading.Barrier(len(functions))
+
+        def target(function):
+            try:
+                barrier.wait()
+                function()
+                outcomes.append(None)
+            except Exception as e:
+                outcomes.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=target, args=(function,)) for function in functions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outcomes.count(None), [outcome for outcome in outcomes if outcome is not None]
+
+    def assert_no_overlap(self):
+        cells = []
+        for placement in ShelfPlacement.objects.filter(shelf=self.shelf):
+            cells += [
+                (row, column)
+                for row in range(placement.row, placement.row + placement.span_rows)
+                for column in range(placement.column, placement.column + placement.span_columns)
+            ]
+        self.assertEqual(len(cells), len(set(cells)))
+
+    def test_batches_do_not_overlap(self):
+        load = BatchPlacement._load
+
+        def slow_load(batch):
+            # 読み込みから書き込みまでの間に、もう一方の一括更新が割り込む余地を作る
+            load(batch)
+            time.sleep(0.2)
+
+        def batch(product, column):
+            operation = {'op': 'place', 'product_id': product.id, 'row': 0, 'column': column, 'span_columns': 2}
+            return lambda: BatchPlacement(Shelf.objects.get(pk=self.shelf.pk)).apply([operation])
+
+        with mock.patch.object(BatchPlacement, '_load', slow_load):
+            succeeded, errors = self.run_concurrently([batch(self.products[0], 0), batch(self.products[1], 1)])
+
+        self.assertEqual(succeeded, 1)
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], ValidationError)
+        self.assertEqual(ShelfPlacement.objects.filter(shelf=self.shelf).count(), 1)
+        self.assert_no_overlap()
+
+    def test_single_placements_do_not_overlap(self):
+        for_shelf = ShelfOccupancy.for_shelf.__func__
+
+        def slow_for_shelf(cls, shelf):
+            occupancy = for_shelf(cls, shelf)
+            time.sleep(0.2)
+            return occupancy
+
+        created = []
+
+        def place(product, column):
+            def run():
+                created.append(_create_placement(
+                    shelf=Shelf.objects.get(pk=self.shelf.pk), product=product,
+                    row=0, column=column, face_count=1, span_rows=1, span_columns=2,
+                ))
+            return run
+
+        with mock.patch.object(ShelfOccupancy, 'for_shelf', classmethod(slow_for_shelf)):
+            succeeded, errors = self.run_concurrently([place(self.products[0], 0), place(self.products[1], 1)])
+
+        self.assertEqual((succeeded, errors), (2, []))
+        # 後から書き込む方は空きの確認で重なりを検出して None を返す
+        self.assertEqual(sum(placement is None for placement in created), 1)
+        self.assertEqual(ShelfPlacement.objects.filter(shelf=self.shelf).count(), 1)
+        self.assert_no_overlap()
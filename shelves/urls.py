@@ -13,8 +13,26 @@ urlpatterns = [
     path('<int:pk>/edit/', views.ShelfUpdateView.as_view(), name='shelf_edit'),
     path('<int:pk>/delete/', views.ShelfDeleteView.as_view(), name='shelf_delete'),
     
+    # 売場管理
+    path('floors/', views.FloorListView.as_view(), name='floor_list'),
+    path('floors/add/', views.FloorCreateView.as_view(), name='floor_add'),
+    path('floors/<int:pk>/', views.floor_detail, name='floor_detail'),
+    path('floors/<int:pk>/edit/', views.FloorUpdateView.as_view(), name='floor_edit'),
+    path('floors/<int:pk>/delete/', views.FloorDeleteView.as_view(), name='floor_delete'),
+    
     # 棚割りAPI
+    path('api/products/', views.product_palette, name='product_palette'),
     path('api/place-product/', views.place_product, name='place_product'),
     path('api/remove-product/', views.remove_product, name='remove_product'),
     path('api/update-face-count/', views.update_face_count, name='update_face_count'),
+    path('api/batch/', views.batch_update_placements, name='batch_update_placements'),
+    path('api/simulate/', views.simulate_shelves, name='simulate_shelves'),
+    path('api/auto-arrange/', views.auto_arrange, name='auto_arrange'),
+    path('api/shelves/<int:pk>/placements/', views.shelf_placements, name='shelf_placements'),
+    path('api/shelves/<int:pk>/events/', views.shelf_events, name='shelf_events'),
+    
+    # 売場API
+    path('api/floors/<int:pk>/layout/', views.floor_layout, name='floor_layout'),
+    path('api/floors/add-shelf/', views.add_floor_shelf, name='add_floor_shelf'),
+    path('api/floors/remove-shelf/', views.remove_floor_shelf, name='remove_floor_shelf'),
 ]
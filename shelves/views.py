@@ -1,34 +1,44 @@
 # ==================== shelves/views.py ====================
 
-from django.shortcuts import render, get_object_or_404, redirect
+import json
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
 from django.contrib import messages
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView
-from django.urls import reverse_lazy
-from django.db.models import Q
-from django.views.decorators.http import require_POST
-from products.models import Product
+from django.urls import reverse, reverse_lazy
+from django.db import IntegrityError
+from django.db.models import Count
+from django.views.decorators.http import require_POST, require_GET
+from django.core.exceptions import ValidationError
+from config.database import write_transaction
+from config.pagination import CursorPaginationMixin
+from products.models import Product, Category
+from products.services import masters, search as search_index
 
-from .models import Shelf, ShelfPlacement
-from .forms import ShelfForm
+from .models import Shelf, ShelfPlacement, SalesFloor, FloorShelf
+from .forms import ShelfForm, SalesFloorForm
+from .services.placements import BatchPlacement
+from .services.occupancy import ShelfOccupancy
+from .services import floor as floor_service, live, optimizer, simulation, versions
+from .services.grid import get_shelf_grid
 
 
-class ShelfListView(ListView):
-    """棚一覧"""
+class ShelfListView(CursorPaginationMixin, ListView):
+    """棚一覧（?cursor= でページ送り、?format=json でJSON）"""
     model = Shelf
     template_name = 'shelf_list.html'
     context_object_name = 'shelves'
     paginate_by = 12
 
     def get_queryset(self):
-        queryset = Shelf.objects.all()
+        queryset = Shelf.objects.select_related('stats')
         search = self.request.GET.get('search')
         
         if search:
-            queryset = queryset.filter(
-                Q(name__icontains=search) |
-                Q(description__icontains=search)
-            )
+            return search_index.search(queryset, 'shelf', search).order_by('-search_rank', '-created_at')
         
         return queryset.order_by('-created_at')
 
@@ -37,6 +47,18 @@ class ShelfListView(ListView):
         context['search'] = self.request.GET.get('search', '')
         return context
 
+    def serialize_object(self, shelf):
+        stats = getattr(shelf, 'stats', None)
+        return {
+            'id': shelf.id,
+            'name': shelf.name,
+            'rows': shelf.rows,
+            'columns': shelf.columns,
+            'occupied_cells': stats.occupied_cells if stats else 0,
+            'own_share': stats.own_share if stats else 0,
+            'created_at': shelf.created_at.isoformat(),
+        }
+
 
 class ShelfCreateView(CreateView):
     """棚作成"""
@@ -86,37 +108,163 @@ class ShelfDeleteView(DeleteView):
 
 
 def shelf_detail(request, pk):
-    """棚詳細・編集画面"""
+    """棚詳細・編集画面（棚のバージョンが変わっていなければ 304 を返す）"""
     shelf = get_object_or_404(Shelf, pk=pk)
     
-    # 棚配置データを取得
-    placements = ShelfPlacement.objects.filter(shelf=shelf).select_related('product', 'product__maker')
+    # カテゴリ一覧も描画するため、その世代も含める
+    etag = versions.make_etag(
+        'shelf', shelf.pk, shelf.version, request.user.pk, masters.generation('palette_category'),
+    )
+    last_modified = versions.timestamp(shelf.updated_at)
+    not_modified = versions.not_modified(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
     
-    # グリッド形式でのデータ構築
-    grid = [[None for _ in range(shelf.columns)] for _ in range(shelf.rows)]
-    for placement in placements:
-        if placement.row < shelf.rows and placement.column < shelf.columns:
-            grid[placement.row][placement.column] = placement
+    # 画面の描画より前のイベントIDから購読させ、描画中に配信された差分も受け取れるようにする
+    live_event_id = live.broker.last_event_id(shelf.pk)
+    grid = get_shelf_grid(shelf)
     
-    # 商品一覧を取得
-    products = Product.objects.filter(is_active=True).select_related('maker', 'brand', 'category')
-    
-    # カテゴリ一覧を取得（重複なし）
-    from products.models import Category
-    categories = Category.objects.filter(product__in=products).distinct().order_by('name')
+    # 商品一覧はパレットAPIから遅延取得するため、ここではカテゴリのみ取得
+    # （商品のあるカテゴリとその上位カテゴリ。上位を選ぶと配下の商品も対象になる）
+    categories = masters.objects('palette_category')
     
     context = {
         'shelf': shelf,
-        'grid': grid,
-        'placements': placements,
-        'products': products,
+        'grid': grid.render_rows(),
+        'placement_count': grid.placement_count,
         'categories': categories,
+        'palette_page_size': PALETTE_PAGE_SIZE,
+        'live_event_id': live_event_id,
+        # WSGI ではストリームがワーカーを占有するため、画面からのポーリングで差分を受け取る
+        'live_streaming': isinstance(request, ASGIRequest),
+        'live_poll_ms': live.POLL_MILLISECONDS,
     }
-    return render(request, 'shelf_detail.html', context)
+    return versions.set_validators(render(request, 'shelf_detail.html', context), etag, last_modified)
+
+
+@require_GET
+def shelf_events(request, pk):
+    """棚の配置差分の配信
+
+    ASGI では Server-Sent Events で配信する。再接続時はブラウザが送る Last-Event-ID
+    （初回は ?last_event_id=）以降の差分を再送し、再送できない場合は resync イベントで配置全体の再取得を求める。
+    WSGI ではストリームがワーカーを1つずつ占有するため配信せず、?last_event_id= 以降の差分を
+    JSON で返す（画面が一定間隔で取りに来る）。
+    """
+    shelf_id = get_object_or_404(Shelf.objects.only('pk'), pk=pk).pk
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'success': True, **live.poll(shelf_id, last_event_id)})
+    
+    response = StreamingHttpResponse(live.astream(shelf_id, last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # nginx 等のリバースプロキシでバッファリングさせない
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@require_GET
+def shelf_placements(request, pk):
+    """棚の配置一覧API（配信の再同期用）"""
+    shelf = get_object_or_404(Shelf, pk=pk)
+    live_event_id = live.broker.last_event_id(shelf.pk)
+    grid = get_shelf_grid(shelf)
+    
+    return JsonResponse({
+        'success': True,
+        'placements': grid.placements,
+        'last_event_id': live_event_id,
+    })
+
+
+PALETTE_PAGE_SIZE = 30
+PALETTE_MAX_PAGE_SIZE = 100
+
+
+@require_GET
+async def product_palette(request):
+    """商品パレットAPI（検索・絞り込み・ページング）"""
+    queryset = Product.objects.filter(is_active=True)
+    
+    search = request.GET.get('search', '').strip()
+    is_own = request.GET.get('is_own')
+    
+    try:
+        category = int(request.GET['category']) if request.GET.get('category') else None
+        maker = int(request.GET['maker']) if request.GET.get('maker') else None
+    except ValueError:
+        return JsonResponse({'success': False, 'error': '絞り込み条件が不正です'}, status=400)
+    
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+        page_size = min(max(int(request.GET.get('page_size', PALETTE_PAGE_SIZE)), 1), PALETTE_MAX_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'ページ指定が不正です'}, status=400)
+    
+    if search:
+        # 候補数の判定でクエリを発行するため、同期処理として実行する
+        queryset = await sync_to_async(search_index.search)(queryset, 'product', search)
+    
+    if category is not None:
+        queryset = queryset.filter(Category.subtree_q(category))
+    
+    if maker is not None:
+        queryset = queryset.filter(maker_id=maker)
+    
+    if is_own == 'true':
+        queryset = queryset.filter(is_own_product=True)
+    elif is_own == 'false':
+        queryset = queryset.filter(is_own_product=False)
+    
+    # COUNT(*)を避けるため、1件多く取得して次ページの有無を判定する
+    offset = (page - 1) * page_size
+    rows = [
+        row async for row in queryset.order_by(*(['-search_rank'] if search else []), '-created_at', '-id').values(
+            'id', 'product_name', 'product_code', 'category_id',
+            'is_own_product', 'image', 'image_icon', 'maker__name',
+        )[offset:offset + page_size + 1]
+    ]
+    has_next = len(rows) > page_size
+    image_storage = Product._meta.get_field('image').storage
+    
+    results = [
+        {
+            'id': row['id'],
+            'product_name': row['product_name'],
+            'product_code': row['product_code'],
+            'maker_name': row['maker__name'],
+            'category_id': row['category_id'],
+            'is_own_product': row['is_own_product'],
+            'image_url': image_storage.url(row['image_icon'] or row['image']) if row['image'] else None,
+        }
+        for row in rows[:page_size]
+    ]
+    
+    return JsonResponse({
+        'success': True,
+        'results': results,
+        'page': page,
+        'has_next': has_next,
+        'next_page': page + 1 if has_next else None,
+    })
+
+
+@write_transaction
+def _create_placement(shelf, **fields):
+    """空きを確認して配置を作成（重なる場合は None）
+
+    空きの確認・配置の作成・シグナルによる統計と棚バージョンの更新を1つのトランザクション
+    （SQLite では BEGIN IMMEDIATE）で行い、確認から書き込みまでの間に他の編集が割り込まないようにする。
+    """
+    # 既存配置（複数セル占有を含む）との重なりをチェック
+    occupancy = ShelfOccupancy.for_shelf(shelf)
+    if not occupancy.is_free(fields['row'], fields['column'], fields['span_rows'], fields['span_columns']):
+        return None
+    return ShelfPlacement.objects.create(shelf=shelf, **fields)
 
 
 @require_POST
-def place_product(request):
+async def place_product(request):
     """商品配置API"""
     try:
         shelf_id = request.POST.get('shelf_id')
@@ -127,19 +275,19 @@ def place_product(request):
         span_rows = int(request.POST.get('span_rows', 1))
         span_columns = int(request.POST.get('span_columns', 1))
         
-        shelf = get_object_or_404(Shelf, id=shelf_id)
-        product = get_object_or_404(Product, id=product_id)
+        shelf = await aget_object_or_404(Shelf, id=shelf_id)
+        product = await aget_object_or_404(Product.objects.select_related('maker'), id=product_id)
         
         # 配置可能かチェック
         if row >= shelf.rows or column >= shelf.columns:
             return JsonResponse({'success': False, 'error': '配置位置が範囲外です'})
         
-        # 既存配置をチェック
-        if ShelfPlacement.objects.filter(shelf=shelf, row=row, column=column).exists():
-            return JsonResponse({'success': False, 'error': 'この位置には既に商品が配置されています'})
+        if row + span_rows > shelf.rows or column + span_columns > shelf.columns:
+            return JsonResponse({'success': False, 'error': '占有サイズが棚の範囲を超えています'})
         
-        # 配置を作成
-        placement = ShelfPlacement.objects.create(
+        # 重なりの確認と作成を1トランザクションで行うため、同期処理として実行する
+        user = await request.auser()
+        placement = await sync_to_async(_create_placement)(
             shelf=shelf,
             product=product,
             row=row,
@@ -147,8 +295,10 @@ def place_product(request):
             face_count=face_count,
             span_rows=span_rows,
             span_columns=span_columns,
-            created_by=request.user if request.user.is_authenticated else None
+            created_by=user if user.is_authenticated else None
         )
+        if placement is None:
+            return JsonResponse({'success': False, 'error': 'この位置には既に商品が配置されています'})
         
         return JsonResponse({
             'success': True,
@@ -159,7 +309,9 @@ def place_product(request):
                 'maker_name': product.maker.name,
                 'is_own_product': product.is_own_product,
                 'face_count': placement.face_count,
-                'image_url': product.image.url if product.image else None,
+                'span_rows': placement.span_rows,
+                'span_columns': placement.span_columns,
+                'image_url': product.thumbnail_url,
             }
         })
         
@@ -168,12 +320,12 @@ def place_product(request):
 
 
 @require_POST
-def remove_product(request):
+async def remove_product(request):
     """商品削除API"""
     try:
         placement_id = request.POST.get('placement_id')
-        placement = get_object_or_404(ShelfPlacement, id=placement_id)
-        placement.delete()
+        placement = await aget_object_or_404(ShelfPlacement, id=placement_id)
+        await sync_to_async(write_transaction(placement.delete))()
         
         return JsonResponse({'success': True})
         
@@ -182,17 +334,295 @@ def remove_product(request):
 
 
 @require_POST
-def update_face_count(request):
+async def update_face_count(request):
     """フェース数更新API"""
     try:
         placement_id = request.POST.get('placement_id')
         face_count = int(request.POST.get('face_count'))
         
-        placement = get_object_or_404(ShelfPlacement, id=placement_id)
+        placement = await aget_object_or_404(ShelfPlacement, id=placement_id)
         placement.face_count = face_count
-        placement.save()
+        await sync_to_async(write_transaction(placement.save))()
+        
+        return JsonResponse({'success': True})
+        
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)})
+
+
+def _apply_batch(shelf, user, operations):
+    return BatchPlacement(shelf, user=user).apply(operations)
+
+
+@require_POST
+async def batch_update_placements(request):
+    """配置一括更新API
+
+    リクエスト本文(JSON): {"shelf_id": 1, "operations": [{"op": "place", ...}, ...]}
+    op は place / move / remove / resize / face_count のいずれか。
+    """
+    try:
+        payload = json.loads(request.body)
+    except (ValueError, UnicodeDecodeError):
+        return JsonResponse({'success': False, 'error': 'リクエスト形式が不正です'}, status=400)
+    
+    try:
+        shelf = await aget_object_or_404(Shelf, id=payload.get('shelf_id'))
+        user = await request.auser()
+        # 配置の読み込みから書き込みまでを1トランザクションで行うため、同期処理として実行する
+        result = await sync_to_async(_apply_batch)(shelf, user if user.is_authenticated else None, payload.get('operations'))
+        
+        return JsonResponse({'success': True, **result})
+        
+    except ValidationError as e:
+        return JsonResponse({
+            'success': False,
+            'error': e.messages[0],
+            'index': (e.params or {}).get('index'),
+        })
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)})
+
+
+@require_POST
+def simulate_shelves(request):
+    """棚割りシミュレーションAPI
+
+    リクエスト本文(JSON): {"shelf_ids": [1, 2], "floor_id": 任意, "group_by": "maker",
+                          "changes": [{"op": "add_faces", "product_id": 1, "faces": 2}, ...]}
+    floor_id を指定すると売場に並べた全棚が対象になる。
+    group_by は maker / brand / category のいずれか。
+    """
+    try:
+        payload = json.loads(request.body)
+    except (ValueError, UnicodeDecodeError):
+        return JsonResponse({'success': False, 'error': 'リクエスト形式が不正です'}, status=400)
+    
+    if not isinstance(payload, dict):
+        return JsonResponse({'success': False, 'error': 'リクエスト形式が不正です'}, status=400)
+    changes = payload.get('changes') or []
+    if not isinstance(changes, list) or not all(isinstance(change, dict) for change in changes):
+        return JsonResponse({'success': False, 'error': 'changes は操作のリストで指定してください'}, status=400)
+    
+    try:
+        shelf_ids = [int(shelf_id) for shelf_id in payload.get('shelf_ids') or []]
+        if payload.get('floor_id'):
+            shelf_ids += FloorShelf.objects.filter(floor_id=payload['floor_id']).values_list('shelf_id', flat=True)
+        if not shelf_ids:
+            return JsonResponse({'success': False, 'error': '対象の棚を指定してください'})
+        
+        result = simulation.simulate(
+            shelf_ids, changes=changes, group=payload.get('group_by', 'maker')
+        )
+        return JsonResponse({'success': True, **result})
+        
+    except (TypeError, ValueError) as e:
+        return JsonResponse({'success': False, 'error': str(e)})
+
+
+@require_POST
+def auto_arrange(request):
+    """自動配置API
+
+    リクエスト本文(JSON): {"shelf_id": 1, "category_id": 任意, "maker_id": 任意, "product_ids": 任意,
+                          "own_share_target": 60, "brand_blocking": true, "category_adjacency": true,
+                          "replace": true, "max_faces": 4, "time_budget_ms": 300, "apply": false}
+    apply が false なら配置案だけを返し、true なら一括更新で書き込む。
+    """
+    try:
+        payload = json.loads(request.body)
+    except (ValueError, UnicodeDecodeError):
+        return JsonResponse({'success': False, 'error': 'リクエスト形式が不正です'}, status=400)
+    
+    try:
+        shelf = get_object_or_404(Shelf, id=payload.get('shelf_id'))
+        product_ids = payload.get('product_ids')
+        target = payload.get('own_share_target')
+        user = request.user if request.user.is_authenticated else None
+        result = optimizer.auto_arrange(
+            shelf,
+            product_ids=[int(pid) for pid in product_ids] if product_ids is not None else None,
+            category_id=payload.get('category_id') or None,
+            maker_id=payload.get('maker_id') or None,
+            own_share_target=float(target) if target not in (None, '') else None,
+            brand_blocking=bool(payload.get('brand_blocking', True)),
+            category_adjacency=bool(payload.get('category_adjacency', True)),
+            replace=bool(payload.get('replace', True)),
+            max_faces=max(int(payload.get('max_faces', optimizer.DEFAULT_MAX_FACES)), 1),
+            time_budget_ms=payload.get('time_budget_ms', optimizer.DEFAULT_TIME_BUDGET_MS),
+            apply=bool(payload.get('apply')),
+            user=user,
+        )
+        return JsonResponse({'success': True, **result})
+        
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'error': e.messages[0]})
+    except (TypeError, ValueError) as e:
+        return JsonResponse({'success': False, 'error': str(e)})
+
+
+class FloorListView(ListView):
+    """売場一覧"""
+    model = SalesFloor
+    template_name = 'floor_list.html'
+    context_object_name = 'floors'
+    paginate_by = 12
+
+    def get_queryset(self):
+        return SalesFloor.objects.annotate(shelf_count=Count('floor_shelves')).order_by('-created_at')
+
+
+class FloorCreateView(CreateView):
+    """売場作成"""
+    model = SalesFloor
+    form_class = SalesFloorForm
+    template_name = 'floor_form.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['title'] = '売場作成'
+        return context
+
+    def get_success_url(self):
+        return reverse('shelves:floor_detail', args=[self.object.pk])
+
+    def form_valid(self, form):
+        if self.request.user.is_authenticated:
+            form.instance.created_by = self.request.user
+        messages.success(self.request, '売場を作成しました。')
+        return super().form_valid(form)
+
+
+class FloorUpdateView(UpdateView):
+    """売場編集"""
+    model = SalesFloor
+    form_class = SalesFloorForm
+    template_name = 'floor_form.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['title'] = '売場編集'
+        return context
+
+    def get_success_url(self):
+        return reverse('shelves:floor_detail', args=[self.object.pk])
+
+    def form_valid(self, form):
+        messages.success(self.request, '売場を更新しました。')
+        return super().form_valid(form)
+
+
+class FloorDeleteView(DeleteView):
+    """売場削除（棚そのものは削除しない）"""
+    model = SalesFloor
+    template_name = 'floor_confirm_delete.html'
+    success_url = reverse_lazy('shelves:floor_list')
+
+    def form_valid(self, form):
+        messages.success(self.request, '売場を削除しました。')
+        return super().form_valid(form)
+
+
+def floor_detail(request, pk):
+    """売場画面（複数の棚を通路ごとに並べて表示）"""
+    floor = get_object_or_404(SalesFloor, pk=pk)
+    layout = floor_service.load_floor(floor)
+    
+    aisles = [
+        {
+            'aisle': aisle,
+            'sections': [
+                {'entry': section.entry, 'shelf': section.shelf, 'grid': section.grid.render_rows()}
+                for section in sections
+            ],
+        }
+        for aisle, sections in layout.aisles
+    ]
+    placed_ids = {section.shelf.pk for section in layout.sections}
+    
+    context = {
+        'floor': floor,
+        'aisles': aisles,
+        'shelf_count': layout.shelf_count,
+        'stats': layout.summary(),
+        # 追加先の通路の初期値（画面上は1始まり。最後の通路の末尾に並べる）
+        'default_aisle': aisles[-1]['aisle'] + 1 if aisles else 1,
+        'available_shelves': [
+            shelf for shelf in Shelf.objects.order_by('name').only('id', 'name', 'rows', 'columns')
+            if shelf.pk not in placed_ids
+        ],
+    }
+    return render(request, 'floor_detail.html', context)
+
+
+@require_GET
+def floor_layout(request, pk):
+    """売場の棚割り取得API（全棚の配置を一定のクエリ数で返す）"""
+    floor = get_object_or_404(SalesFloor, pk=pk)
+    layout = floor_service.load_floor(floor)
+    
+    return JsonResponse({
+        'success': True,
+        'floor': {'id': floor.pk, 'name': floor.name},
+        'stats': layout.summary(),
+        'aisles': [
+            {
+                'aisle': aisle,
+                'shelves': [
+                    {
+                        'floor_shelf_id': section.entry.pk,
+                        'position': section.entry.position,
+                        'shelf_id': section.shelf.pk,
+                        'name': section.shelf.name,
+                        'rows': section.grid.rows,
+                        'columns': section.grid.columns,
+                        'placements': section.grid.placements,
+                    }
+                    for section in sections
+                ],
+            }
+            for aisle, sections in layout.aisles
+        ],
+    })
+
+
+@require_POST
+def add_floor_shelf(request):
+    """売場への棚追加API（指定した通路の末尾に並べる）"""
+    try:
+        floor = get_object_or_404(SalesFloor, id=request.POST.get('floor_id'))
+        shelf = get_object_or_404(Shelf, id=request.POST.get('shelf_id'))
+        aisle = int(request.POST.get('aisle', 0))
+        if aisle < 0:
+            return JsonResponse({'success': False, 'error': '通路の指定が不正です'})
+        
+        if FloorShelf.objects.filter(floor=floor, shelf=shelf).exists():
+            return JsonResponse({'success': False, 'error': 'この棚は既に売場に配置されています'})
+        
+        try:
+            entry = FloorShelf.objects.create(
+                floor=floor, shelf=shelf, aisle=aisle, position=floor_service.next_position(floor, aisle)
+            )
+        except IntegrityError:
+            return JsonResponse({'success': False, 'error': '同時に更新されました。もう一度お試しください'})
+        
+        return JsonResponse({
+            'success': True,
+            'floor_shelf': {'id': entry.pk, 'aisle': entry.aisle, 'position': entry.position},
+        })
+        
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)})
+
+
+@require_POST
+def remove_floor_shelf(request):
+    """売場からの棚削除API（棚そのものは削除しない）"""
+    try:
+        entry = get_object_or_404(FloorShelf, id=request.POST.get('floor_shelf_id'))
+        entry.delete()
         
         return JsonResponse({'success': True})
         
     except Exception as e:
-        return JsonResponse({'success': False, 'error': str(e)})
\ No newline at end of file
+        return JsonResponse({'success': False, 'error': str(e)})